@@ -1,9 +1,30 @@
-from flask import Flask, request, g
-from flask_socketio import SocketIO
 from config import Config
+
+# Monkey patching precisa acontecer antes de importar Flask e os modelos
+modo_desconhecido = None
+if Config.SOCKETIO_ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif Config.SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+elif Config.SOCKETIO_ASYNC_MODE != 'threading':
+    modo_desconhecido = Config.SOCKETIO_ASYNC_MODE
+    Config.SOCKETIO_ASYNC_MODE = 'threading'
+
+# Logs configurados antes dos modelos, que já registram eventos ao serem importados
+from logs import obter_logger
+Config.configurar_logs()
+log = obter_logger('webtalk')
+if modo_desconhecido:
+    log.warning("Modo assíncrono desconhecido '%s', usando 'threading'", modo_desconhecido)
+
+from flask import Flask
+from flask_socketio import SocketIO
 from routes import main_bp, admin_bp
-from socketio_handlers import registrar_eventos_socketio
-import time
+from socketio_handlers import registrar_eventos_socketio, registrar_eventos_admin
+from models.envio import MODOS_ENVIO, CapturaEscrita
+from models.requisicoes import InstrumentacaoRequisicoes, anotar_rota
 
 
 def criar_aplicacao():
@@ -11,68 +32,31 @@ def criar_aplicacao():
     app = Flask(__name__)
     app.config.from_object(Config)
 
-    # Middleware de logging compacto para estudo
-    @app.before_request
-    def log_request_info():
-        """Log compacto de requisições HTTP para controle de operações"""
-        g.start_time = time.time()
-
-        # Ignorar arquivos estáticos
-        if request.endpoint and 'static' in request.endpoint:
-            return
-
-        # Log básico da requisição
-        timestamp = time.strftime("%H:%M:%S")
-        client_ip = request.environ.get('REMOTE_ADDR', 'unknown')
-
-        print(f"[{timestamp}] {request.method} {request.path} - IP: {client_ip}")
-
-        # Log adicional para operações importantes
-        if request.method in ['POST', 'PUT', 'DELETE']:
-            if request.is_json:
-                data = request.get_json()
-                if data:
-                    # Mascarar senhas
-                    safe_data = {k: '[***]' if 'senha' in k.lower() or 'password' in k.lower()
-                                 else v for k, v in data.items()}
-                    print(f"  Data: {safe_data}")
-
-            # Log de uploads
-            if request.files:
-                for key, file in request.files.items():
-                    if file.filename:
-                        file.seek(0, 2)
-                        size = file.tell()
-                        file.seek(0)
-                        print(f"  Upload: {file.filename} ({size/1024:.1f}KB)")
-
-    @app.after_request
-    def log_response_info(response):
-        """Log compacto da resposta"""
-        # Ignorar arquivos estáticos
-        if request.endpoint and 'static' in request.endpoint:
-            return response
-
-        processing_time = (
-            time.time() - g.get('start_time', time.time())) * 1000
-
-        # Log da resposta
-        if response.status_code >= 400:
-            print(
-                f"  Response: {response.status_code} ERROR ({processing_time:.0f}ms)")
-        elif processing_time > 1000:  # Log se demorou mais que 1s
-            print(
-                f"  Response: {response.status_code} OK ({processing_time:.0f}ms) [SLOW]")
-        else:
-            print(
-                f"  Response: {response.status_code} OK ({processing_time:.0f}ms)")
-
-        return response
-
     # Registrar blueprints
     app.register_blueprint(main_bp)
     app.register_blueprint(admin_bp)
 
+    if Config.DOWNLOAD_SERVING_MODE not in MODOS_ENVIO:
+        log.warning("Modo de envio desconhecido '%s', usando 'flask'",
+                    Config.DOWNLOAD_SERVING_MODE)
+        Config.DOWNLOAD_SERVING_MODE = 'flask'
+    if Config.DOWNLOAD_SERVING_MODE == 'sendfile':
+        # Expõe o write() do servidor para o envio direto com os.sendfile
+        app.wsgi_app = CapturaEscrita(app.wsgi_app)
+    if Config.METRICS_ENABLED and not Config.METRICS_TOKEN:
+        log.warning("METRICS_ENABLED sem METRICS_TOKEN: /metrics desativado")
+        Config.METRICS_ENABLED = False
+    if Config.REQUEST_LOG_ENABLED or Config.METRICS_ENABLED:
+        # Log e métricas por requisição a partir do environ, sem ler o corpo antes da view
+        app.wsgi_app = InstrumentacaoRequisicoes(
+            app.wsgi_app,
+            limite_lento_ms=Config.REQUEST_SLOW_MS,
+            amostragem_corpo=Config.REQUEST_BODY_SAMPLING,
+            tamanho_max_corpo=Config.REQUEST_BODY_MAX_BYTES,
+            registrar_log=Config.REQUEST_LOG_ENABLED,
+            medir=Config.METRICS_ENABLED)
+        app.before_request(anotar_rota)
+
     return app
 
 
@@ -80,9 +64,12 @@ def criar_aplicacao():
 app = criar_aplicacao()
 
 # Configurar Socket.IO
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+socketio = SocketIO(app,
+                    cors_allowed_origins=Config.SOCKETIO_CORS_ALLOWED_ORIGINS,
+                    async_mode=Config.SOCKETIO_ASYNC_MODE)
 # Registrar eventos do Socket.IO
 registrar_eventos_socketio(socketio)
+registrar_eventos_admin(socketio)
 
 if __name__ == '__main__':
     print("="*60)
@@ -92,10 +79,17 @@ if __name__ == '__main__':
     print(f"Servidor: http://localhost:{Config.PORT}")
     print(f"Admin: http://localhost:{Config.PORT}/admin")
     print(f"Senha Admin: {Config.ADMIN_PASSWORD}")
-    print("Logging HTTP: ATIVO")
+    print(f"Modo assíncrono: {Config.SOCKETIO_ASYNC_MODE}")
+    print(f"Envio de arquivos: {Config.DOWNLOAD_SERVING_MODE}")
+    print(f"Logs: {Config.LOG_LEVEL} ({Config.LOG_FILE or 'sem arquivo'})")
     print("="*60)
 
+    opcoes_servidor = {}
+    if Config.SOCKETIO_ASYNC_MODE == 'eventlet':
+        opcoes_servidor['max_size'] = Config.SOCKETIO_MAX_CONNECTIONS
+
     socketio.run(app,
                  host=Config.HOST,
                  port=Config.PORT,
-                 debug=Config.DEBUG)
+                 debug=Config.DEBUG,
+                 **opcoes_servidor)
@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
+import logs
 
 load_dotenv()
 
@@ -29,23 +30,80 @@ class Config:
 
     # Configurações de banco de dados
     DATABASE_PATH = os.environ.get('DATABASE_PATH', 'webtalk_socket.db')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_HEALTHCHECK_SECONDS = float(
+        os.environ.get('DB_POOL_HEALTHCHECK_SECONDS', 60))
+    # strict | balanced | fast (ver models/banco.py)
+    DB_DURABILITY = os.environ.get('DB_DURABILITY', 'balanced').lower()
+    DB_CHECKPOINT_INTERVAL_SECONDS = float(
+        os.environ.get('DB_CHECKPOINT_INTERVAL_SECONDS', 300))
+
+    # Persistência write-behind das mensagens (ver models/escrita.py)
+    DB_WRITE_BEHIND = os.environ.get(
+        'DB_WRITE_BEHIND', 'False').lower() == 'true'
+    DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', 100))
+    DB_WRITE_INTERVAL_MS = int(os.environ.get('DB_WRITE_INTERVAL_MS', 50))
+    DB_WRITE_QUEUE_SIZE = int(os.environ.get('DB_WRITE_QUEUE_SIZE', 10000))
+    DB_WRITE_QUEUE_TIMEOUT = float(
+        os.environ.get('DB_WRITE_QUEUE_TIMEOUT', 1.0))
+    DB_WRITE_FLUSH_TIMEOUT = float(
+        os.environ.get('DB_WRITE_FLUSH_TIMEOUT', 5.0))
 
     # Configurações de upload
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
     UPLOAD_FOLDER = os.path.join(os.path.dirname(
         os.path.abspath(__file__)), 'uploads')
     ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png'}
+    # Conteúdo armazenado uma única vez por SHA-256 (ver models/armazem.py)
+    UPLOAD_BLOB_FOLDER = os.environ.get(
+        'UPLOAD_BLOB_FOLDER', os.path.join(UPLOAD_FOLDER, 'blobs'))
+    # Uploads em partes: tamanho sugerido de cada parte e validade da sessão
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+    UPLOAD_SESSION_TTL_SECONDS = int(
+        os.environ.get('UPLOAD_SESSION_TTL_SECONDS', 3600))
+    # Uploads em partes abertos ao mesmo tempo por IP e por sala (0 = sem limite)
+    UPLOAD_MAX_SESSIONS_PER_CLIENT = int(
+        os.environ.get('UPLOAD_MAX_SESSIONS_PER_CLIENT', 4))
+    UPLOAD_MAX_SESSIONS_PER_ROOM = int(
+        os.environ.get('UPLOAD_MAX_SESSIONS_PER_ROOM', 20))
+    # Miniaturas de JPG/PNG e primeira página de PDF (ver models/previas.py);
+    # PREVIEW_WORKERS=0 desativa as prévias
+    PREVIEW_FOLDER = os.environ.get(
+        'PREVIEW_FOLDER', os.path.join(UPLOAD_FOLDER, 'previas'))
+    PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', 320))
+    PREVIEW_QUALITY = int(os.environ.get('PREVIEW_QUALITY', 80))
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+    PREVIEW_WAIT_SECONDS = float(os.environ.get('PREVIEW_WAIT_SECONDS', 10))
+    # Imagens maiores não têm prévia (proteção contra bombas de descompressão)
+    PREVIEW_MAX_PIXELS = int(os.environ.get('PREVIEW_MAX_PIXELS', 40_000_000))
+    # Envio de downloads (ver models/envio.py): flask | sendfile (os.sendfile,
+    # os bytes não passam pelo Python) | x-accel-redirect (nginx) | x-sendfile (Apache/lighttpd)
+    DOWNLOAD_SERVING_MODE = os.environ.get(
+        'DOWNLOAD_SERVING_MODE', 'flask').lower()
+    # Location interna do nginx que aponta para UPLOAD_FOLDER (modo x-accel-redirect)
+    DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/_uploads/')
 
     # Configurações de rate limiting
     RATELIMIT_STORAGE_URL = "memory://"
     RATELIMIT_DEFAULT = "100 per hour"
 
     # Configurações de Socket.IO
-    SOCKETIO_ASYNC_MODE = 'threading'
+    # threading (uma thread por conexão) | eventlet | gevent (greenlets, milhares de conexões)
+    SOCKETIO_ASYNC_MODE = os.environ.get(
+        'SOCKETIO_ASYNC_MODE', 'threading').lower()
+    # Limite de greenlets simultâneos do servidor eventlet (padrão dele: 1024)
+    SOCKETIO_MAX_CONNECTIONS = int(
+        os.environ.get('SOCKETIO_MAX_CONNECTIONS', 20000))
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
     SOCKETIO_LOGGER = DEBUG
     SOCKETIO_ENGINEIO_LOGGER = False
 
+    # Barramento de eventos entre processos: local (processo único) | sqlite
+    MESSAGE_BUS = os.environ.get('MESSAGE_BUS', 'local').lower()
+    MESSAGE_BUS_PATH = os.environ.get('MESSAGE_BUS_PATH')
+    MESSAGE_BUS_POLL_MS = int(os.environ.get('MESSAGE_BUS_POLL_MS', 50))
+
     # Configurações de PWA
     PWA_NAME = "WebTalk Socket"
     PWA_SHORT_NAME = "WebTalk"
@@ -57,15 +115,59 @@ class Config:
     CACHE_TYPE = os.environ.get('CACHE_TYPE', 'simple')
     CACHE_DEFAULT_TIMEOUT = 300
 
-    # Configurações de logging
+    # Configurações de logging (ver logs.py)
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
     LOG_FILE = os.environ.get('LOG_FILE', 'webtalk_socket.log')
+    # Níveis por subsistema: "http=WARNING,socketio=DEBUG"
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+    # Amostragem 1 a cada N para eventos de alto volume: "socketio.mensagens=10"
+    LOG_SAMPLING = os.environ.get('LOG_SAMPLING', 'socketio.mensagens=10')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'texto').lower()  # texto | json
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    # Log de requisições HTTP (models/requisicoes.py): uma linha por requisição,
+    # sem ler o corpo. Corpos JSON pequenos podem ser registrados 1 a cada N (0 desativa)
+    REQUEST_LOG_ENABLED = os.environ.get(
+        'REQUEST_LOG_ENABLED', 'True').lower() == 'true'
+    REQUEST_SLOW_MS = int(os.environ.get('REQUEST_SLOW_MS', 1000))
+    REQUEST_BODY_SAMPLING = int(os.environ.get('REQUEST_BODY_SAMPLING', 0))
+    REQUEST_BODY_MAX_BYTES = int(os.environ.get('REQUEST_BODY_MAX_BYTES', 2048))
+
+    # Métricas no formato do Prometheus em /metrics (models/metricas.py).
+    # A coleta exige "Authorization: Bearer <METRICS_TOKEN>"; sem token as
+    # métricas ficam desativadas
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    METRICS_ENABLED = os.environ.get(
+        'METRICS_ENABLED', str(bool(METRICS_TOKEN))).lower() == 'true'
 
     # Configurações de sessão de salas
     ROOM_TIMEOUT_HOURS = int(os.environ.get('ROOM_TIMEOUT_HOURS', 24))
+    # Varredura de expiração em segundo plano (0 desativa). Padrão: 1/24 do
+    # timeout, entre 1 minuto e 1 hora
+    ROOM_EXPIRY_INTERVAL_SECONDS = int(os.environ.get(
+        'ROOM_EXPIRY_INTERVAL_SECONDS', max(60, min(3600, ROOM_TIMEOUT_HOURS * 3600 // 24))))
     MAX_ROOMS = int(os.environ.get('MAX_ROOMS', 100))
     MAX_USERS_PER_ROOM = int(os.environ.get('MAX_USERS_PER_ROOM', 50))
+    # Presença: clientes enviam 'sinal' periodicamente; sessões sem sinal expiram
+    PRESENCE_HEARTBEAT_SECONDS = int(
+        os.environ.get('PRESENCE_HEARTBEAT_SECONDS', 25))
+    PRESENCE_TIMEOUT_SECONDS = int(
+        os.environ.get('PRESENCE_TIMEOUT_SECONDS', 90))
     MAX_MESSAGES_PER_ROOM = int(os.environ.get('MAX_MESSAGES_PER_ROOM', 1000))
+    HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', 20))
+
+    # Carregamento sob demanda das salas com despejo LRU das ociosas
+    ROOM_LAZY_LOADING = os.environ.get(
+        'ROOM_LAZY_LOADING', 'False').lower() == 'true'
+    ROOM_CACHE_MAX = int(os.environ.get('ROOM_CACHE_MAX', 1000))
+    ROOM_IDLE_EVICT_SECONDS = int(
+        os.environ.get('ROOM_IDLE_EVICT_SECONDS', 30 * 60))
+    # Fragmentos do registro de salas, cada um com trava própria
+    ROOM_REGISTRY_SHARDS = int(os.environ.get('ROOM_REGISTRY_SHARDS', 16))
+
+    # Estatísticas incrementais: tamanho da atividade recente e recontagem periódica
+    STATS_ACTIVITY_SIZE = int(os.environ.get('STATS_ACTIVITY_SIZE', 10))
+    STATS_RECONCILE_SECONDS = int(
+        os.environ.get('STATS_RECONCILE_SECONDS', 300))
 
     # Configurações de backup automático
     AUTO_BACKUP_ENABLED = os.environ.get(
@@ -73,6 +175,17 @@ class Config:
     BACKUP_INTERVAL_HOURS = int(os.environ.get('BACKUP_INTERVAL_HOURS', 6))
     BACKUP_RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', 30))
 
+    @staticmethod
+    def configurar_logs():
+        """Instala a fila de logs com os níveis, amostragem e formato configurados"""
+        return logs.configurar_logs(
+            nivel=Config.LOG_LEVEL,
+            arquivo=Config.LOG_FILE,
+            niveis=Config.LOG_LEVELS,
+            amostragem=Config.LOG_SAMPLING,
+            formato=Config.LOG_FORMAT,
+            tamanho_fila=Config.LOG_QUEUE_SIZE)
+
     @staticmethod
     def init_app(app):
         """Inicialização da aplicação com configurações específicas"""
@@ -80,16 +193,7 @@ class Config:
         os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
 
         # Configurar logging baseado no nível definido
-        import logging
-        log_level = getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
-        logging.basicConfig(
-            level=log_level,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(Config.LOG_FILE),
-                logging.StreamHandler()
-            ]
-        )
+        Config.configurar_logs()
 
         # Configurações específicas para produção
         if not Config.DEBUG:
@@ -2,6 +2,25 @@ import sqlite3
 import os
 import shutil
 from datetime import datetime
+from config import Config
+
+
+def pastas_de_arquivos(pasta_uploads):
+    """Pasta de uploads mais o armazém de conteúdo e as prévias, se configurados fora dela"""
+    base = os.path.abspath(pasta_uploads)
+    pastas = [pasta_uploads]
+    for pasta in (Config.UPLOAD_BLOB_FOLDER, Config.PREVIEW_FOLDER):
+        if os.path.commonpath([os.path.abspath(pasta), base]) != base:
+            pastas.append(pasta)
+    return pastas
+
+
+def remover_pastas_de_arquivos(pasta_uploads):
+    """Remove uploads, conteúdo deduplicado e prévias; recria a pasta de uploads"""
+    for pasta in pastas_de_arquivos(pasta_uploads):
+        if os.path.exists(pasta):
+            shutil.rmtree(pasta)
+    os.makedirs(pasta_uploads, exist_ok=True)
 
 
 def limpar_banco_completamente():
@@ -44,13 +63,12 @@ def limpar_banco_completamente():
     else:
         print("Nenhum banco de dados encontrado.")
 
-    # Limpar pasta de uploads
-    if os.path.exists(pasta_uploads):
-        try:
-            shutil.rmtree(pasta_uploads)
-            print("Pasta de uploads removida.")
-        except Exception as e:
-            print(f"Erro ao remover pasta de uploads: {e}")
+    # Limpar pasta de uploads, conteúdo deduplicado e prévias
+    try:
+        remover_pastas_de_arquivos(pasta_uploads)
+        print("Pasta de uploads removida.")
+    except Exception as e:
+        print(f"Erro ao remover pasta de uploads: {e}")
 
     # Criar novo banco com estrutura correta
     print("Criando novo banco de dados...")
@@ -65,7 +83,8 @@ def limpar_banco_completamente():
         criador TEXT NOT NULL,
         senha TEXT,
         criado_em TEXT NOT NULL,
-        esta_ativa INTEGER DEFAULT 1
+        esta_ativa INTEGER DEFAULT 1,
+        total_mensagens INTEGER NOT NULL DEFAULT 0
     )
     ''')
 
@@ -80,10 +99,24 @@ def limpar_banco_completamente():
         caminho_arquivo TEXT,
         tipo_arquivo TEXT,
         horario TEXT NOT NULL,
+        seq INTEGER,
+        sha256 TEXT,
         FOREIGN KEY (id_sala) REFERENCES salas (id)
     )
     ''')
 
+    cursor.execute('''
+    CREATE TABLE arquivos (
+        sha256 TEXT PRIMARY KEY,
+        tamanho INTEGER NOT NULL,
+        referencias INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+    cursor.execute(
+        'CREATE INDEX idx_mensagens_sala_seq ON mensagens (id_sala, seq)')
+    cursor.execute('CREATE INDEX idx_mensagens_seq ON mensagens (seq)')
+
     conexao.commit()
     conexao.close()
 
@@ -127,21 +160,23 @@ def limpar_apenas_dados():
 
         # Contar arquivos antes
         arquivos_antes = 0
-        if os.path.exists(pasta_uploads):
-            for _, _, files in os.walk(pasta_uploads):
+        for pasta in pastas_de_arquivos(pasta_uploads):
+            for _, _, files in os.walk(pasta):
                 arquivos_antes += len(files)
 
         # Limpar dados
         cursor.execute("DELETE FROM mensagens")
         cursor.execute("DELETE FROM salas")
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'arquivos'")
+        if cursor.fetchone():
+            cursor.execute("DELETE FROM arquivos")
 
         conexao.commit()
         conexao.close()
 
-        # Limpar arquivos
-        if os.path.exists(pasta_uploads):
-            shutil.rmtree(pasta_uploads)
-            os.makedirs(pasta_uploads, exist_ok=True)
+        # Limpar arquivos: sem as linhas de arquivos, blobs e prévias ficariam órfãos
+        remover_pastas_de_arquivos(pasta_uploads)
 
         print(f"Limpeza concluída!")
         print(f"Salas removidas: {salas_antes}")
@@ -175,14 +210,18 @@ def limpar_arquivos_orfaos():
 
         cursor.execute(
             "SELECT caminho_arquivo FROM mensagens WHERE tipo = 'arquivo' AND caminho_arquivo IS NOT NULL")
-        arquivos_bd = set(row[0] for row in cursor.fetchall() if row[0])
+        arquivos_bd = set(os.path.abspath(row[0]) for row in cursor.fetchall() if row[0])
         conexao.close()
 
-        # Obter todos os arquivos físicos
+        # Obter todos os arquivos físicos (caminhos absolutos, como os do armazém);
+        # prévias não são referenciadas por mensagens e ficam de fora
+        pasta_previas = os.path.abspath(Config.PREVIEW_FOLDER)
         arquivos_fisicos = set()
         for root, dirs, files in os.walk(pasta_uploads):
+            if os.path.commonpath([os.path.abspath(root), pasta_previas]) == pasta_previas:
+                continue
             for file in files:
-                caminho_completo = os.path.join(root, file)
+                caminho_completo = os.path.abspath(os.path.join(root, file))
                 arquivos_fisicos.add(caminho_completo)
 
         # Encontrar órfãos
@@ -0,0 +1,213 @@
+"""Logs em níveis, por subsistema, gravados fora da thread que os produz.
+
+Cada módulo usa um logger 'webtalk.<subsistema>' (webtalk.http,
+webtalk.socketio, webtalk.salas, ...). A chamada de log só monta o registro
+e o coloca em uma fila limitada; a formatação da data, a escrita no
+terminal e no arquivo ficam com uma thread de fundo (QueueListener). Com a
+fila cheia o registro é descartado e contado, sem bloquear a requisição.
+
+Níveis desativados custam só a verificação de nível do logger: as mensagens
+usam argumentos no estilo %s, formatados apenas se o registro for emitido.
+
+Os módulos obtêm o logger com obter_logger('webtalk.<subsistema>'), que o
+cria como LoggerWebtalk; loggers de outras bibliotecas (werkzeug, engineio,
+socketio) continuam logging.Logger.
+
+Configuração (ver config.py):
+- LOG_LEVEL: nível geral
+- LOG_LEVELS: níveis por subsistema, ex. "http=WARNING,socketio=DEBUG"
+- LOG_SAMPLING: amostragem 1 a cada N, ex. "socketio.mensagens=10"
+- LOG_FORMAT: texto | json (uma linha JSON por registro)
+"""
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+RAIZ = 'webtalk'
+FORMATO_TEXTO = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+_ouvinte = None
+_trava_classe = threading.Lock()
+
+
+def interpretar_pares(texto):
+    """Converte "a=1,b=2" em {'a': '1', 'b': '2'} (ignora itens malformados)"""
+    pares = {}
+    for item in (texto or '').split(','):
+        nome, separador, valor = item.partition('=')
+        if separador and nome.strip() and valor.strip():
+            pares[nome.strip()] = valor.strip()
+    return pares
+
+
+def _nivel(valor):
+    """Nível numérico a partir do nome (INFO se desconhecido)"""
+    nivel = logging.getLevelName(str(valor).upper())
+    return nivel if isinstance(nivel, int) else logging.INFO
+
+
+def _nome_logger(subsistema):
+    return subsistema if subsistema.startswith(RAIZ) else f'{RAIZ}.{subsistema}'
+
+
+class LoggerWebtalk(logging.Logger):
+    """Logger dos subsistemas 'webtalk.*'
+
+    Não procura na pilha o arquivo e a linha de origem (os formatos não os
+    usam) e aceita amostragem: com `amostrar(taxa)` emite 1 a cada `taxa`
+    chamadas (a primeira sempre passa). A amostragem acontece em
+    isEnabledFor, antes de o registro ser montado, então as chamadas
+    descartadas custam quase o mesmo que um nível desativado.
+
+    Criado só por obter_logger.
+    """
+    taxa = 1
+
+    def findCaller(self, stack_info=False, stacklevel=1):
+        if stack_info:
+            return super().findCaller(stack_info, stacklevel)
+        return '(unknown file)', 0, '(unknown function)', None
+
+    def amostrar(self, taxa):
+        self.taxa = max(1, int(taxa))
+        self._contador = itertools.count()
+
+    def isEnabledFor(self, level):
+        if not super().isEnabledFor(level):
+            return False
+        return self.taxa == 1 or next(self._contador) % self.taxa == 0
+
+    def makeRecord(self, *args, **kwargs):
+        registro = super().makeRecord(*args, **kwargs)
+        if self.taxa > 1:
+            registro.amostragem = self.taxa
+        return registro
+
+
+class FilaNaoBloqueante(logging.handlers.QueueHandler):
+    """QueueHandler que descarta o registro em vez de esperar com a fila cheia"""
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # O registro é exclusivo deste handler: basta fixar a mensagem e a
+        # exceção em texto, sem a cópia que a implementação padrão faz
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def obter_logger(nome):
+    """Logger 'webtalk.<subsistema>' da classe LoggerWebtalk
+
+    A classe é trocada no gerenciador do logging só enquanto este logger é
+    criado; se ele já existir, é devolvido como está.
+    """
+    gerenciador = logging.Logger.manager
+    with _trava_classe:
+        anterior = gerenciador.loggerClass
+        gerenciador.setLoggerClass(LoggerWebtalk)
+        try:
+            return logging.getLogger(_nome_logger(nome))
+        finally:
+            gerenciador.loggerClass = anterior
+
+
+class FormatadorJson(logging.Formatter):
+    """Uma linha JSON por registro, para coleta por ferramentas de log"""
+
+    def format(self, record):
+        dados = {
+            'horario': self.formatTime(record),
+            'nivel': record.levelname,
+            'subsistema': record.name,
+            'mensagem': record.getMessage(),
+        }
+        if getattr(record, 'amostragem', None):
+            dados['amostragem'] = record.amostragem
+        if record.exc_text:
+            dados['excecao'] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False)
+
+
+def configurar_logs(nivel='INFO', arquivo=None, niveis=None, amostragem=None,
+                    formato='texto', tamanho_fila=10000):
+    """Instala a fila de logs no logger 'webtalk' e inicia a thread de escrita
+
+    niveis e amostragem aceitam dicionários ou texto "subsistema=valor,...".
+    Chamadas repetidas substituem a configuração anterior.
+    """
+    global _ouvinte
+    parar_logs()
+
+    formatador = FormatadorJson() if formato == 'json' else logging.Formatter(FORMATO_TEXTO)
+    destinos = [logging.StreamHandler()]
+    if arquivo:
+        destinos.append(logging.FileHandler(arquivo, encoding='utf-8'))
+    for destino in destinos:
+        destino.setFormatter(formatador)
+
+    fila = queue.Queue(maxsize=tamanho_fila)
+    raiz = obter_logger(RAIZ)
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(FilaNaoBloqueante(fila))
+    raiz.setLevel(_nivel(nivel))
+    raiz.propagate = False
+
+    if isinstance(niveis, str):
+        niveis = interpretar_pares(niveis)
+    for subsistema, nivel_subsistema in (niveis or {}).items():
+        obter_logger(subsistema).setLevel(_nivel(nivel_subsistema))
+
+    if isinstance(amostragem, str):
+        amostragem = interpretar_pares(amostragem)
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        if isinstance(logger, LoggerWebtalk) and logger.taxa > 1:
+            logger.amostrar(1)  # Amostragem anterior removida da configuração
+    for subsistema, taxa in (amostragem or {}).items():
+        logger = obter_logger(subsistema)
+        if isinstance(logger, LoggerWebtalk):
+            logger.amostrar(taxa)
+        else:
+            raiz.warning("Logger %s não criado por obter_logger: amostragem ignorada", logger.name)
+
+    _ouvinte = logging.handlers.QueueListener(
+        fila, *destinos, respect_handler_level=True)
+    _ouvinte.start()
+    return _ouvinte
+
+
+def parar_logs():
+    """Grava os registros pendentes e encerra a thread de escrita"""
+    global _ouvinte
+    if _ouvinte is not None:
+        _ouvinte.stop()
+        for destino in _ouvinte.handlers:
+            destino.close()
+        _ouvinte = None
+_trava_classe = threading.Lock()
+
+
+def registros_descartados():
+    """Registros perdidos por fila cheia desde a configuração (medidor webtalk_logs_descartados)"""
+    return sum(getattr(handler, 'descartados', 0)
+               for handler in logging.getLogger(RAIZ).handlers)
+
+
+atexit.register(parar_logs)
@@ -0,0 +1,147 @@
+import errno
+import hashlib
+import os
+import shutil
+import threading
+import uuid
+from logs import obter_logger
+from models.concorrencia import executar_bloqueante
+
+log = obter_logger('webtalk.arquivos')
+
+
+def calcular_sha256(caminho, tamanho_bloco=1024 * 1024):
+    """SHA-256 de um arquivo lido em blocos"""
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+class ArmazemArquivos:
+    """Arquivos endereçados pelo SHA-256 do conteúdo, com contagem de referências
+
+    O mesmo conteúdo compartilhado em várias salas é gravado uma única vez em
+    <pasta>/<2 primeiros dígitos>/<sha256>. A tabela arquivos guarda quantas
+    mensagens de arquivo apontam para cada conteúdo; a contagem muda na mesma
+    transação que insere ou marca como deletada a mensagem, e o arquivo físico
+    só é apagado quando ela chega a zero.
+
+    Os métodos que recebem cursor ou conexão devem ser chamados com a trava do
+    armazém, que serializa referências e remoções neste processo. Entre
+    processos, a contagem zerada por liberar() é conferida de novo por
+    remover() dentro de uma transação de escrita, que só termina depois de o
+    arquivo ser apagado: um referenciar() em outro processo ou vê a linha de
+    volta (e o arquivo é mantido) ou espera a remoção e grava o conteúdo de novo.
+    """
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.trava = threading.Lock()
+        os.makedirs(pasta, exist_ok=True)
+
+    def caminho(self, sha256):
+        return os.path.join(self.pasta, sha256[:2], sha256)
+
+    def referenciar(self, cursor, sha256, tamanho, caminho_origem):
+        """Soma uma referência ao conteúdo, armazenando-o se ainda não existir
+
+        caminho_origem é consumido: movido para o armazém se o conteúdo é
+        novo, apagado se já havia cópia. Retorna (caminho, era_novo).
+        """
+        destino = self.caminho(sha256)
+        existente = cursor.execute(
+            'SELECT referencias FROM arquivos WHERE sha256 = ?', (sha256,)).fetchone()
+        cursor.execute('''
+            INSERT INTO arquivos (sha256, tamanho, referencias) VALUES (?, ?, 1)
+            ON CONFLICT (sha256) DO UPDATE SET referencias = referencias + 1
+        ''', (sha256, tamanho))
+
+        novo = existente is None or not os.path.exists(destino)
+        if novo:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            executar_bloqueante(self._mover, caminho_origem, destino)
+        elif os.path.exists(caminho_origem):
+            executar_bloqueante(os.remove, caminho_origem)  # Cópia duplicada
+        return destino, novo
+
+    @staticmethod
+    def _mover(origem, destino):
+        """Move o arquivo para o armazém, mesmo vindo de outro sistema de arquivos
+
+        Entre dispositivos (EXDEV) o conteúdo é copiado para um temporário ao
+        lado do destino e renomeado, para o destino nunca ficar pela metade.
+        """
+        try:
+            os.replace(origem, destino)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        temporario = f'{destino}.{uuid.uuid4().hex}.tmp'
+        try:
+            shutil.copyfile(origem, temporario)
+            os.replace(temporario, destino)
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        os.remove(origem)
+
+    def liberar(self, cursor, sha256, quantidade=1):
+        """Desconta referências; retorna True se a contagem chegou a zero
+
+        Nesse caso o arquivo deve ser apagado com remover() depois do commit,
+        ainda sob a trava do armazém.
+        """
+        cursor.execute(
+            'UPDATE arquivos SET referencias = referencias - ? WHERE sha256 = ?',
+            (quantidade, sha256))
+        linha = cursor.execute(
+            'SELECT referencias FROM arquivos WHERE sha256 = ?', (sha256,)).fetchone()
+        if linha is None or linha[0] > 0:
+            return False
+        cursor.execute('DELETE FROM arquivos WHERE sha256 = ?', (sha256,))
+        return True
+
+    def remover(self, conexao, sha256):
+        """Apaga o arquivo físico de um conteúdo que continua sem referências
+
+        Retorna True se o arquivo foi apagado. Entre o commit de liberar() e
+        esta chamada outro processo pode ter referenciado o mesmo conteúdo;
+        a contagem é lida de novo com a trava de escrita do banco, mantida
+        até o arquivo sair do disco.
+        """
+        caminho = self.caminho(sha256)
+        conexao.execute('BEGIN IMMEDIATE')
+        try:
+            linha = conexao.execute(
+                'SELECT referencias FROM arquivos WHERE sha256 = ?', (sha256,)).fetchone()
+            if linha is not None and linha[0] > 0:
+                log.info("Conteúdo %s referenciado de novo, arquivo mantido", sha256[:12])
+                return False
+            if os.path.exists(caminho):
+                executar_bloqueante(os.remove, caminho)
+                log.info("Arquivo físico removido (sem referências): %s", caminho)
+            return True
+        except OSError as e:
+            log.error("Falha ao remover arquivo físico: %s", e)
+            return False
+        finally:
+            conexao.rollback()  # Nada foi escrito: só libera a trava de escrita
+
+    def estatisticas(self, cursor):
+        """Espaço ocupado em disco frente ao que seria sem deduplicação"""
+        unicos, armazenados, referencias, logicos = cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(tamanho), 0),
+                   COALESCE(SUM(referencias), 0), COALESCE(SUM(tamanho * referencias), 0)
+            FROM arquivos WHERE referencias > 0
+        ''').fetchone()
+        return {
+            'arquivos_unicos': unicos,
+            'referencias': referencias,
+            'bytes_armazenados': armazenados,
+            'bytes_referenciados': logicos,
+            'bytes_economizados': logicos - armazenados
+        }
@@ -0,0 +1,196 @@
+import sqlite3
+import threading
+import queue
+import time
+from contextlib import contextmanager
+from logs import obter_logger
+from models.concorrencia import delegar_conexao, TarefaPeriodica
+from models.metricas import DURACAO_BANCO
+
+log = obter_logger('webtalk.banco')
+
+
+# Perfis de durabilidade aplicados como PRAGMAs em cada nova conexão
+PERFIS_DURABILIDADE = {
+    # fsync a cada commit: nenhuma transação confirmada é perdida
+    'strict': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8000,
+        'mmap_size': 0,
+        'busy_timeout': 5000,
+    },
+    # fsync apenas nos checkpoints: seguro contra crash do processo
+    'balanced': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 64 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+    # sem fsync: pode perder as últimas transações se o SO cair
+    'fast': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'busy_timeout': 5000,
+    },
+}
+
+
+def obter_pragmas(perfil):
+    """Retorna os PRAGMAs do perfil de durabilidade (padrão: balanced)"""
+    if perfil not in PERFIS_DURABILIDADE:
+        log.warning("Perfil de durabilidade desconhecido '%s', usando 'balanced'", perfil)
+        perfil = 'balanced'
+    return PERFIS_DURABILIDADE[perfil]
+
+
+class PoolEsgotadoError(Exception):
+    """Nenhuma conexão ficou disponível dentro do tempo limite"""
+
+
+class PoolConexoes:
+    """Pool de conexões SQLite de longa duração compartilhado entre threads"""
+
+    def __init__(self, caminho_bd, tamanho=5, timeout=30.0, intervalo_verificacao=60.0, pragmas=None):
+        self.caminho_bd = caminho_bd
+        self.pragmas = pragmas or {}
+        # Banco em memória só existe dentro de uma única conexão
+        self.tamanho = 1 if caminho_bd == ':memory:' else max(1, tamanho)
+        self.timeout = timeout
+        self.intervalo_verificacao = intervalo_verificacao
+        self._disponiveis = queue.LifoQueue(maxsize=self.tamanho)
+        self._ultimo_uso = {}
+        self._criadas = 0
+        self._trava = threading.Lock()
+        self._fechado = False
+
+    def _nova_conexao(self):
+        """Abre uma nova conexão configurada para uso entre threads"""
+        conexao = sqlite3.connect(
+            self.caminho_bd, timeout=self.timeout, check_same_thread=False)
+        conexao.row_factory = sqlite3.Row
+        for nome, valor in self.pragmas.items():
+            conexao.execute(f'PRAGMA {nome} = {valor}')
+        return delegar_conexao(conexao)
+
+    def _esta_saudavel(self, conexao):
+        """Verifica se a conexão ainda responde a consultas"""
+        try:
+            conexao.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, conexao):
+        """Fecha conexão defeituosa e libera sua vaga no pool"""
+        try:
+            conexao.close()
+        except sqlite3.Error:
+            pass
+        with self._trava:
+            self._ultimo_uso.pop(id(conexao), None)
+            self._criadas -= 1
+
+    def adquirir(self):
+        """Obtém uma conexão do pool, criando-a sob demanda"""
+        if self._fechado:
+            raise PoolEsgotadoError('Pool de conexões encerrado')
+
+        while True:
+            try:
+                conexao = self._disponiveis.get_nowait()
+            except queue.Empty:
+                with self._trava:
+                    pode_criar = self._criadas < self.tamanho
+                    if pode_criar:
+                        self._criadas += 1
+                if pode_criar:
+                    try:
+                        conexao = self._nova_conexao()
+                    except sqlite3.Error:
+                        with self._trava:
+                            self._criadas -= 1
+                        raise
+                    self._ultimo_uso[id(conexao)] = time.monotonic()
+                    return conexao
+                try:
+                    conexao = self._disponiveis.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolEsgotadoError(
+                        f'Nenhuma conexão livre após {self.timeout}s')
+
+            # Verificar saúde apenas de conexões ociosas há algum tempo
+            ocioso = time.monotonic() - self._ultimo_uso.get(id(conexao), 0)
+            if ocioso > self.intervalo_verificacao and not self._esta_saudavel(conexao):
+                log.warning("Conexão inválida descartada do pool")
+                self._descartar(conexao)
+                continue
+            return conexao
+
+    def liberar(self, conexao):
+        """Devolve conexão ao pool desfazendo transações pendentes"""
+        try:
+            if conexao.in_transaction:
+                conexao.rollback()
+        except sqlite3.Error:
+            self._descartar(conexao)
+            return
+
+        if self._fechado:
+            self._descartar(conexao)
+            return
+
+        self._ultimo_uso[id(conexao)] = time.monotonic()
+        self._disponiveis.put_nowait(conexao)
+
+    @contextmanager
+    def conexao(self, operacao='outra'):
+        """Context manager que empresta uma conexão do pool
+
+        O tempo com a conexão emprestada entra na métrica de banco rotulado
+        com `operacao` (ex. pool.conexao('criar_sala')).
+        """
+        conexao = self.adquirir()
+        inicio = time.perf_counter()
+        try:
+            yield conexao
+        finally:
+            self.liberar(conexao)
+            DURACAO_BANCO.observar(time.perf_counter() - inicio, operacao)
+
+    def fechar(self):
+        """Encerra o pool fechando todas as conexões ociosas"""
+        self._fechado = True
+        while True:
+            try:
+                conexao = self._disponiveis.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conexao)
+
+
+class AgendadorCheckpoint(TarefaPeriodica):
+    """Executa checkpoints periódicos do WAL em uma thread de fundo"""
+
+    def __init__(self, pool, intervalo=300.0):
+        super().__init__(self.checkpoint, intervalo, 'checkpoint-wal', log)
+        self.pool = pool
+
+    def checkpoint(self, modo='PASSIVE'):
+        """Transfere páginas do WAL para o arquivo principal do banco"""
+        try:
+            with self.pool.conexao('checkpoint') as conexao:
+                ocupado, paginas_log, paginas_copiadas = conexao.execute(
+                    f'PRAGMA wal_checkpoint({modo})').fetchone()
+            return paginas_copiadas
+        except Exception as e:
+            log.error("Falha no checkpoint do WAL: %s", e)
+            return 0
+
+    def parar(self):
+        """Interrompe a thread e executa um checkpoint final"""
+        super().parar()
+        self.checkpoint('TRUNCATE')
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+import time
+import uuid
+from logs import obter_logger
+from models.banco import PoolConexoes
+
+log = obter_logger('webtalk.barramento')
+
+
+class BarramentoLocal:
+    """Barramento de processo único: a entrega local já é feita pelo Socket.IO"""
+
+    def __init__(self):
+        self.id_processo = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._assinantes = []
+
+    def assinar(self, callback):
+        """Registra callback(evento, dados, id_sala) para eventos de outros processos"""
+        self._assinantes.append(callback)
+
+    def publicar(self, evento, dados, id_sala=None):
+        """Sem outros processos não há para quem repassar"""
+
+    def parar(self):
+        pass
+
+
+class BarramentoSQLite(BarramentoLocal):
+    """Barramento entre processos locais usando uma tabela SQLite como log de eventos"""
+
+    def __init__(self, caminho_bd, intervalo_ms=50, retencao_segundos=60, pragmas=None):
+        super().__init__()
+        self.intervalo = intervalo_ms / 1000.0
+        self.retencao_segundos = retencao_segundos
+        self.pool = PoolConexoes(caminho_bd, tamanho=2, pragmas=pragmas)
+        self._parar = threading.Event()
+        self._thread = None
+
+        with self.pool.conexao('barramento_inicializar') as conexao:
+            conexao.execute('''
+                CREATE TABLE IF NOT EXISTS eventos_barramento (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origem TEXT NOT NULL,
+                    id_sala TEXT,
+                    evento TEXT NOT NULL,
+                    dados TEXT NOT NULL,
+                    criado_em REAL NOT NULL
+                )
+            ''')
+            conexao.commit()
+            # Não reprocessar eventos publicados antes deste processo subir
+            self._ultimo_id = conexao.execute(
+                'SELECT COALESCE(MAX(id), 0) FROM eventos_barramento').fetchone()[0]
+
+    def assinar(self, callback):
+        super().assinar(callback)
+        if not self._thread:
+            self._thread = threading.Thread(
+                target=self._consumir, name='barramento-sqlite', daemon=True)
+            self._thread.start()
+
+    def publicar(self, evento, dados, id_sala=None):
+        """Grava o evento no log compartilhado para os demais processos"""
+        try:
+            with self.pool.conexao('barramento_publicar') as conexao:
+                conexao.execute(
+                    'INSERT INTO eventos_barramento (origem, id_sala, evento, dados, criado_em) VALUES (?, ?, ?, ?, ?)',
+                    (self.id_processo, id_sala, evento,
+                     json.dumps(dados), time.time()))
+                conexao.commit()
+        except Exception as e:
+            log.error("Falha ao publicar evento '%s' no barramento: %s", evento, e)
+
+    def _consumir(self):
+        ciclos = 0
+        while not self._parar.wait(self.intervalo):
+            try:
+                with self.pool.conexao('barramento_consumir') as conexao:
+                    linhas = conexao.execute(
+                        'SELECT * FROM eventos_barramento WHERE id > ? ORDER BY id',
+                        (self._ultimo_id,)).fetchall()
+
+                    # Limpeza periódica de eventos já entregues a todos
+                    ciclos += 1
+                    if ciclos % 200 == 0:
+                        conexao.execute(
+                            'DELETE FROM eventos_barramento WHERE criado_em < ?',
+                            (time.time() - self.retencao_segundos,))
+                        conexao.commit()
+            except Exception as e:
+                log.error("Falha ao ler eventos do barramento: %s", e)
+                continue
+
+            for linha in linhas:
+                self._ultimo_id = linha['id']
+                if linha['origem'] == self.id_processo:
+                    continue
+                dados = json.loads(linha['dados'])
+                for callback in self._assinantes:
+                    try:
+                        callback(linha['evento'], dados, linha['id_sala'])
+                    except Exception as e:
+                        log.error("Falha ao processar evento remoto '%s': %s", linha['evento'], e)
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.pool.fechar()
+
+
+def criar_barramento(tipo, caminho_bd, intervalo_ms=50, pragmas=None):
+    """Instancia o barramento configurado (local | sqlite)"""
+    if tipo == 'sqlite':
+        return BarramentoSQLite(caminho_bd, intervalo_ms=intervalo_ms, pragmas=pragmas)
+    if tipo != 'local':
+        log.warning("Barramento desconhecido '%s', usando 'local'", tipo)
+    return BarramentoLocal()
@@ -0,0 +1,124 @@
+"""Integração com os servidores assíncronos suportados pelo Socket.IO.
+
+Nos modos eventlet e gevent todas as conexões rodam em greenlets de uma única
+thread do sistema operacional. Chamadas bloqueantes em código C (sqlite3,
+leitura e gravação de arquivos) travariam o loop inteiro, então são
+executadas no pool de threads nativas do servidor. No modo threading as
+funções daqui chamam o código diretamente, sem custo adicional.
+"""
+import select
+import sqlite3
+import sys
+import threading
+from logs import obter_logger
+
+_modo = None
+
+
+def modo_assincrono():
+    """Detecta se o processo recebeu monkey patching do eventlet ou do gevent"""
+    global _modo
+    if _modo is None:
+        _modo = 'threading'
+        if 'eventlet' in sys.modules:
+            from eventlet import patcher
+            if patcher.is_monkey_patched('thread'):
+                _modo = 'eventlet'
+        if _modo == 'threading' and 'gevent' in sys.modules:
+            from gevent import monkey
+            if monkey.is_module_patched('threading'):
+                _modo = 'gevent'
+    return _modo
+
+
+def executar_bloqueante(funcao, *args, **kwargs):
+    """Executa funcao fora do loop de eventos quando o servidor é assíncrono"""
+    modo = modo_assincrono()
+    if modo == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(funcao, *args, **kwargs)
+    if modo == 'gevent':
+        from gevent import get_hub
+        return get_hub().threadpool.apply(funcao, args, kwargs)
+    return funcao(*args, **kwargs)
+
+
+def esperar_escrita(descritor, timeout=None):
+    """Aguarda o socket aceitar escrita cedendo a vez às demais conexões"""
+    modo = modo_assincrono()
+    if modo == 'eventlet':
+        from eventlet.hubs import trampoline
+        trampoline(descritor, write=True, timeout=timeout)
+    elif modo == 'gevent':
+        from gevent.socket import wait_write
+        wait_write(descritor, timeout=timeout)
+    elif not select.select([], [descritor], [], timeout)[1]:
+        raise TimeoutError('Socket não ficou disponível para escrita')
+
+
+class _Delegado:
+    """Repassa chamadas de métodos de conexões e cursores para executar_bloqueante"""
+
+    __slots__ = ('_alvo',)
+
+    def __init__(self, alvo):
+        self._alvo = alvo
+
+    def __getattr__(self, nome):
+        valor = getattr(self._alvo, nome)
+        if not callable(valor):
+            return valor
+
+        def chamar(*args, **kwargs):
+            resultado = executar_bloqueante(valor, *args, **kwargs)
+            if isinstance(resultado, sqlite3.Cursor):
+                return _Delegado(resultado)
+            return resultado
+        return chamar
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+def delegar_conexao(conexao):
+    """Envolve a conexão SQLite para não bloquear o loop nos modos assíncronos"""
+    if modo_assincrono() == 'threading':
+        return conexao
+    return _Delegado(conexao)
+
+
+class TarefaPeriodica:
+    """Executa funcao a cada `intervalo` segundos em uma thread de fundo
+
+    Falhas são registradas em `log` e não interrompem as execuções seguintes.
+    """
+
+    def __init__(self, funcao, intervalo, nome, log=None):
+        self.funcao = funcao
+        self.intervalo = intervalo
+        self.nome = nome
+        self.log = log or obter_logger('webtalk')
+        self._parar = threading.Event()
+        self._thread = None
+
+    def iniciar(self):
+        """Inicia a thread se ainda não estiver rodando"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(
+            target=self._executar, name=self.nome, daemon=True)
+        self._thread.start()
+
+    def _executar(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.funcao()
+            except Exception as e:
+                self.log.error("Falha na tarefa periódica %s: %s", self.nome, e)
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,134 @@
+"""Envio de arquivos fora do worker Python.
+
+Modos (DOWNLOAD_SERVING_MODE):
+- flask: o worker lê o arquivo e escreve os bytes (padrão)
+- sendfile: o worker envia os cabeçalhos e o kernel copia o arquivo direto
+  para o socket com os.sendfile, sem passar os bytes pelo Python
+- x-accel-redirect / x-sendfile: a resposta leva só os cabeçalhos e o
+  proxy na frente (nginx / Apache, lighttpd) envia o arquivo
+
+A autorização continua no Python: estes modos só entram depois que a rota
+decidiu servir o arquivo.
+"""
+import os
+import ssl
+from urllib.parse import quote
+from logs import obter_logger
+from models.concorrencia import esperar_escrita
+
+log = obter_logger('webtalk.arquivos')
+
+MODOS_ENVIO = ('flask', 'sendfile', 'x-accel-redirect', 'x-sendfile')
+MODOS_PROXY = ('x-accel-redirect', 'x-sendfile')
+
+# Chave do environ onde a middleware guarda o write() do servidor WSGI
+CHAVE_ESCRITA = 'webtalk.escrever'
+TIMEOUT_ESCRITA = 60  # Segundos sem o cliente consumir dados antes de desistir
+
+
+class CapturaEscrita:
+    """Middleware WSGI que expõe no environ o write() devolvido por start_response
+
+    Com ele o corpo da resposta consegue enviar os cabeçalhos antes de
+    escrever no socket por conta própria (eventlet e gevent ignoram
+    pedaços vazios do corpo, então não basta produzir b'').
+    """
+
+    def __init__(self, aplicacao):
+        self.aplicacao = aplicacao
+
+    def __call__(self, environ, start_response):
+        environ[CHAVE_ESCRITA] = None  # Preenchido quando a resposta começar
+
+        def iniciar_resposta(status, cabecalhos, exc_info=None):
+            escrever = start_response(status, cabecalhos, exc_info)
+            environ[CHAVE_ESCRITA] = escrever
+            return escrever
+        return self.aplicacao(environ, iniciar_resposta)
+
+
+def socket_cliente(environ):
+    """Socket da conexão exposto pelo servidor WSGI (werkzeug, eventlet ou gevent)"""
+    soquete = environ.get('werkzeug.socket')
+    if soquete is None and hasattr(environ.get('eventlet.input'), 'get_socket'):
+        soquete = environ['eventlet.input'].get_socket()
+    if soquete is None:
+        soquete = getattr(environ.get('wsgi.input'), 'socket', None)
+    if soquete is None:
+        # gevent só preenche Input.socket em corpo chunked; o rfile aponta para o socket
+        bruto = getattr(getattr(environ.get('wsgi.input'), 'rfile', None), 'raw', None)
+        soquete = getattr(bruto, '_sock', None)
+    if soquete is None or isinstance(soquete, ssl.SSLSocket):
+        return None  # TLS cifra no espaço do usuário: não há cópia direta
+    try:
+        soquete.fileno()
+    except (AttributeError, OSError):
+        return None
+    return soquete
+
+
+class CorpoSendfile:
+    """Corpo de resposta WSGI que copia o arquivo para o socket com os.sendfile"""
+
+    def __init__(self, caminho, environ, soquete, inicio, tamanho, tamanho_bloco=1024 * 1024):
+        self.arquivo = open(caminho, 'rb')
+        self.environ = environ
+        self.soquete = soquete
+        self.inicio = inicio
+        self.tamanho = tamanho
+        self.tamanho_bloco = tamanho_bloco
+
+    def __iter__(self):
+        # Cabeçalhos primeiro, pelo próprio servidor
+        self.environ[CHAVE_ESCRITA](b'')
+
+        saida = self.soquete.fileno()
+        entrada = self.arquivo.fileno()
+        enviado = 0
+        try:
+            while enviado < self.tamanho:
+                try:
+                    parte = os.sendfile(saida, entrada, self.inicio + enviado,
+                                        min(self.tamanho_bloco, self.tamanho - enviado))
+                except BlockingIOError:
+                    esperar_escrita(saida, TIMEOUT_ESCRITA)
+                    continue
+                if parte == 0:
+                    break  # Arquivo encolheu durante o envio
+                enviado += parte
+        except OSError as e:
+            log.debug("Conexão encerrada pelo cliente após %s bytes: %s", enviado, e)
+        return iter(())
+
+    def close(self):
+        self.arquivo.close()
+
+
+def usar_sendfile(resposta, environ, caminho):
+    """Troca o corpo de uma resposta de send_file por CorpoSendfile quando possível
+
+    Mantém status e cabeçalhos já calculados (200 ou 206 com Content-Range);
+    retorna a resposta original se o servidor não expõe o socket.
+    """
+    if resposta.status_code not in (200, 206) or environ.get('REQUEST_METHOD') == 'HEAD':
+        return resposta
+    soquete = socket_cliente(environ)
+    if soquete is None or CHAVE_ESCRITA not in environ:
+        return resposta  # Servidor sem socket exposto ou app sem CapturaEscrita
+
+    if resposta.status_code == 206:
+        inicio, fim = resposta.content_range.start, resposta.content_range.stop
+    else:
+        inicio, fim = 0, resposta.content_length
+    resposta.close()  # Fecha o arquivo aberto por send_file
+    resposta.response = CorpoSendfile(caminho, environ, soquete, inicio, fim - inicio)
+    resposta.direct_passthrough = True
+    return resposta
+
+
+def caminho_interno_accel(caminho, raiz, prefixo):
+    """URI interna do nginx para um arquivo sob a raiz de uploads, ou None se estiver fora"""
+    relativo = os.path.relpath(os.path.abspath(caminho), os.path.abspath(raiz))
+    if relativo.startswith(os.pardir):
+        return None
+    return prefixo.rstrip('/') + '/' + quote(relativo.replace(os.sep, '/'))
@@ -0,0 +1,160 @@
+"""Persistência write-behind com group commit para mensagens de chat.
+
+Semântica de durabilidade:
+- A mensagem é confirmada ao cliente (broadcast) antes de chegar ao disco.
+- O escritor em segundo plano grava lotes de até `tamanho_lote` operações
+  ou a cada `intervalo_ms`, o que ocorrer primeiro, em uma única transação.
+- A fila é limitada: quando cheia, `enfileirar` bloqueia o produtor por até
+  `timeout_bloqueio` segundos (backpressure) e então lança FilaCheiaError.
+- No encerramento normal (`parar`), tudo o que estiver na fila é gravado.
+- `descarregar` é uma barreira: coloca um marcador na fila e espera o
+  escritor gravar o lote que o contém. Só aguarda o que foi enfileirado
+  antes da chamada, então termina mesmo com produtores ativos.
+- Um lote que falha em todas as tentativas é descartado e os ids das
+  mensagens perdidas são registrados em nível de erro.
+- Em caso de crash do processo, as operações ainda na fila são perdidas;
+  a janela de perda é limitada a um lote/intervalo. Um lote nunca é gravado
+  pela metade: a transação é desfeita e o lote inteiro é tentado de novo.
+- A ordem FIFO é preservada, então um UPDATE de soft delete nunca é aplicado
+  antes do INSERT da mensagem correspondente.
+"""
+import queue
+import threading
+import time
+from logs import obter_logger
+
+log = obter_logger('webtalk.banco')
+
+
+class FilaCheiaError(Exception):
+    """A fila de escrita permaneceu cheia além do tempo de espera"""
+
+
+class FilaEscrita:
+    """Fila limitada de operações SQL gravadas em lote por uma thread de fundo"""
+
+    _SENTINELA = object()
+
+    def __init__(self, pool, tamanho_lote=100, intervalo_ms=50, tamanho_maximo=10000,
+                 timeout_bloqueio=1.0, tentativas=3, timeout_descarga=5.0):
+        self.pool = pool
+        self.tamanho_lote = max(1, tamanho_lote)
+        self.intervalo = intervalo_ms / 1000.0
+        self.timeout_bloqueio = timeout_bloqueio
+        self.timeout_descarga = timeout_descarga
+        self.tentativas = tentativas
+        self._fila = queue.Queue(maxsize=tamanho_maximo)
+        self._thread = threading.Thread(
+            target=self._executar, name='escrita-mensagens', daemon=True)
+        self._ativa = False
+
+    def iniciar(self):
+        """Inicia a thread escritora"""
+        if not self._ativa:
+            self._ativa = True
+            self._thread.start()
+
+    def enfileirar(self, sql, parametros=(), chave=None):
+        """Agenda uma operação de escrita aplicando backpressure se a fila estiver cheia
+
+        `chave` identifica a operação (id da mensagem) no log se o lote for descartado.
+        """
+        if not self._ativa:
+            raise FilaCheiaError('Fila de escrita encerrada')
+        try:
+            self._fila.put((sql, parametros, chave), timeout=self.timeout_bloqueio)
+        except queue.Full:
+            raise FilaCheiaError(
+                f'Fila de escrita cheia ({self._fila.maxsize} operações pendentes)')
+
+    def pendentes(self):
+        """Número aproximado de operações aguardando gravação"""
+        return self._fila.qsize()
+
+    def descarregar(self, timeout=None):
+        """Aguarda a gravação de tudo o que foi enfileirado antes desta chamada
+
+        Retorna False se o prazo (timeout_descarga por padrão) acabar antes.
+        """
+        if not self._ativa:
+            return True
+        timeout = self.timeout_descarga if timeout is None else timeout
+        prazo = time.monotonic() + timeout
+        barreira = threading.Event()
+        try:
+            self._fila.put(barreira, timeout=timeout)
+        except queue.Full:
+            log.warning("Descarga da fila de escrita expirou: fila cheia")
+            return False
+        if not barreira.wait(max(0.0, prazo - time.monotonic())):
+            log.warning("Descarga da fila de escrita expirou após %.1fs", timeout)
+            return False
+        return True
+
+    def parar(self):
+        """Grava as operações pendentes e encerra a thread escritora"""
+        if not self._ativa:
+            return
+        self._ativa = False
+        self._fila.put(self._SENTINELA)
+        self._thread.join()
+
+    def _coletar_lote(self):
+        """Aguarda a primeira operação e acumula as seguintes até o limite do lote"""
+        primeira = self._fila.get()
+        lote = [primeira]
+        if not isinstance(primeira, tuple):
+            return lote
+
+        prazo = time.monotonic() + self.intervalo
+        while len(lote) < self.tamanho_lote:
+            restante = prazo - time.monotonic()
+            try:
+                item = self._fila.get(timeout=restante) if restante > 0 \
+                    else self._fila.get_nowait()
+            except queue.Empty:
+                break
+            lote.append(item)
+            if not isinstance(item, tuple):
+                break  # Sentinela ou barreira: gravar já, sem esperar o intervalo
+        return lote
+
+    def _gravar_lote(self, operacoes):
+        """Grava todas as operações em uma única transação com novas tentativas"""
+        for tentativa in range(1, self.tentativas + 1):
+            try:
+                with self.pool.conexao('gravar_lote') as conexao:
+                    for sql, parametros, _ in operacoes:
+                        conexao.execute(sql, parametros)
+                    conexao.commit()
+                return True
+            except Exception as e:
+                log.error(
+                    "Falha ao gravar lote de %s operações (tentativa %s/%s): %s",
+                    len(operacoes), tentativa, self.tentativas, e)
+                time.sleep(0.1 * tentativa)
+        return False
+
+    def _processar(self, lote):
+        """Grava as operações do lote e libera as barreiras; True se havia o sentinela"""
+        operacoes = [item for item in lote if isinstance(item, tuple)]
+        if operacoes and not self._gravar_lote(operacoes):
+            log.error("Lote de %s operações descartado após falhas; mensagens perdidas: %s",
+                      len(operacoes), ', '.join(str(chave) for _, _, chave in operacoes if chave))
+        for item in lote:
+            if isinstance(item, threading.Event):
+                item.set()
+        return any(item is self._SENTINELA for item in lote)
+
+    def _executar(self):
+        while not self._processar(self._coletar_lote()):
+            pass
+
+        # Após o sentinela, gravar o que ainda restar na fila
+        restantes = []
+        while True:
+            try:
+                restantes.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        self._processar(restantes)
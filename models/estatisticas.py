@@ -0,0 +1,114 @@
+import threading
+from collections import deque
+from logs import obter_logger
+
+log = obter_logger('webtalk.estatisticas')
+
+
+class EstatisticasSistema:
+    """Contadores do painel administrativo atualizados a cada escrita
+
+    Leituras não consultam o banco nem percorrem as salas. Cada alteração
+    incrementa a versão e é repassada aos assinantes como delta, para que
+    o painel aplique só a diferença e detecte deltas perdidos pela versão.
+    Os deltas saem na ordem das versões: a trava de notificação cobre a
+    alteração e o envio, enquanto a trava dos valores fica livre durante os
+    callbacks (que podem ler os contadores).
+    A atividade recente fica em um buffer circular limitado.
+    """
+
+    CAMPOS = ('total_salas', 'salas_ativas', 'usuarios_online')
+
+    def __init__(self, capacidade_atividades=10):
+        self._trava = threading.Lock()
+        self._trava_notificacao = threading.RLock()
+        self._valores = dict.fromkeys(self.CAMPOS, 0)
+        # Quantas vezes cada campo foi alterado, para a reconciliação
+        self._alteracoes = dict.fromkeys(self.CAMPOS, 0)
+        self.versao = 0
+        self._assinantes = []
+        self._atividades = deque(maxlen=max(1, capacidade_atividades))
+
+    def assinar(self, callback):
+        """Registra callback(evento, dados) para 'delta' e 'atividade'"""
+        self._assinantes.append(callback)
+
+    def _notificar(self, evento, dados):
+        for callback in self._assinantes:
+            try:
+                callback(evento, dados)
+            except Exception as e:
+                log.error("Falha ao notificar estatísticas (%s): %s", evento, e)
+
+    def definir(self, **valores):
+        """Substitui valores absolutos (carga inicial)"""
+        with self._trava:
+            self._valores.update(valores)
+            self.versao += 1
+
+    def ajustar(self, **deltas):
+        """Aplica incrementos aos contadores e notifica o delta"""
+        deltas = {campo: delta for campo, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        with self._trava_notificacao:
+            with self._trava:
+                for campo, delta in deltas.items():
+                    self._valores[campo] = max(0, self._valores[campo] + delta)
+                    self._alteracoes[campo] += 1
+                self.versao += 1
+                dados = {'versao': self.versao, 'delta': deltas}
+            self._notificar('delta', dados)
+
+    def marcar(self):
+        """Marca tomada antes de recontar os valores na fonte"""
+        with self._trava:
+            return dict(self._alteracoes)
+
+    def reconciliar(self, marca, **valores_reais):
+        """Corrige a deriva dos contadores frente a valores recontados na fonte
+
+        Campos alterados depois da marca são ignorados nesta passada: a
+        recontagem pode ter visto ou não essa alteração. A correção é
+        aplicada como delta comum; retorna o que foi ajustado.
+        """
+        with self._trava:
+            deltas = {campo: valor - self._valores[campo]
+                      for campo, valor in valores_reais.items()
+                      if self._alteracoes[campo] == marca.get(campo)
+                      and valor != self._valores[campo]}
+        self.ajustar(**deltas)
+        return deltas
+
+    def registrar_atividade(self, tipo, texto, horario, id_sala=None):
+        """Guarda o evento no buffer de atividade recente e o repassa aos assinantes"""
+        atividade = {
+            'tipo': tipo,
+            'texto': texto,
+            'horario': horario,
+            'id_sala': id_sala
+        }
+        with self._trava:
+            self._atividades.append(atividade)
+        self._notificar('atividade', atividade)
+
+    def carregar_atividades(self, atividades):
+        """Preenche o buffer a partir de eventos já ordenados do mais antigo ao mais recente"""
+        with self._trava:
+            self._atividades.extend(atividades)
+
+    def atividades_recentes(self):
+        """Atividades do buffer, da mais recente para a mais antiga"""
+        with self._trava:
+            recentes = list(self._atividades)
+        recentes.reverse()
+        return recentes
+
+    def obter(self):
+        """Retrato dos contadores com a versão correspondente"""
+        with self._trava:
+            retrato = dict(self._valores)
+            retrato['versao'] = self.versao
+        return retrato
+
+
@@ -0,0 +1,50 @@
+import heapq
+import threading
+
+
+class AgendaExpiracao:
+    """Salas ordenadas pela última atividade registrada, em um heap
+
+    Atividade nova na sala não mexe no heap: a varredura retira as entradas
+    vencidas e reagenda as salas que tiveram atividade depois do registro.
+    Cada sala tem uma única entrada válida; entradas substituídas são
+    descartadas quando chegam ao topo.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._atividades = {}  # id_sala -> atividade da entrada válida
+        self._trava = threading.Lock()
+
+    def agendar(self, id_sala, atividade):
+        """Registra (ou substitui) a última atividade conhecida da sala"""
+        with self._trava:
+            if self._atividades.get(id_sala) == atividade:
+                return
+            self._atividades[id_sala] = atividade
+            heapq.heappush(self._heap, (atividade, id_sala))
+            if len(self._heap) > 2 * len(self._atividades) + 64:
+                self._compactar()
+
+    def remover(self, id_sala):
+        with self._trava:
+            self._atividades.pop(id_sala, None)
+
+    def vencidas(self, limite):
+        """Retira da agenda e retorna [(id_sala, atividade)] com atividade <= limite"""
+        vencidas = []
+        with self._trava:
+            while self._heap and self._heap[0][0] <= limite:
+                atividade, id_sala = heapq.heappop(self._heap)
+                if self._atividades.get(id_sala) == atividade:
+                    del self._atividades[id_sala]
+                    vencidas.append((id_sala, atividade))
+        return vencidas
+
+    def _compactar(self):
+        # Descartar as entradas substituídas acumuladas
+        self._heap = [(atividade, id_sala) for id_sala, atividade in self._atividades.items()]
+        heapq.heapify(self._heap)
+
+    def __len__(self):
+        return len(self._atividades)
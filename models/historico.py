@@ -0,0 +1,139 @@
+import base64
+import sys
+import threading
+from collections import deque
+
+
+class HistoricoMensagens:
+    """Buffer circular limitado com as mensagens mais recentes de uma sala e índice por id
+
+    Escritas e iterações passam pela trava da sala; iterar devolve um retrato
+    do buffer, então anexar mensagens durante a leitura não interrompe quem lê.
+    """
+
+    def __init__(self, capacidade=100, mensagens=None, trava=None):
+        self.capacidade = max(1, capacidade)
+        self._mensagens = deque(maxlen=self.capacidade)
+        self._por_id = {}
+        self._trava = trava or threading.RLock()
+        self.bytes_estimados = 0  # Memória aproximada das mensagens no buffer
+        for mensagem in mensagens or ():
+            self.append(mensagem)
+
+    def append(self, mensagem):
+        """Adiciona mensagem em O(1), descartando a mais antiga se cheio"""
+        with self._trava:
+            descartada = self._mensagens[0] if len(
+                self._mensagens) == self.capacidade else None
+            self._mensagens.append(mensagem)
+            self.bytes_estimados += tamanho_estimado(mensagem)
+            if descartada is not None:
+                self.bytes_estimados -= tamanho_estimado(descartada)
+
+            # Manter índice sincronizado com o conteúdo do buffer
+            if descartada is not None and self._por_id.get(descartada.get('id')) is descartada:
+                del self._por_id[descartada['id']]
+            if mensagem.get('id'):
+                self._por_id[mensagem['id']] = mensagem
+            return descartada
+
+    def obter(self, id_mensagem):
+        """Busca mensagem em memória pelo id em O(1)"""
+        return self._por_id.get(id_mensagem)
+
+    def __iter__(self):
+        with self._trava:
+            return iter(list(self._mensagens))
+
+    def __reversed__(self):
+        with self._trava:
+            retrato = list(self._mensagens)
+        retrato.reverse()
+        return iter(retrato)
+
+    def __contains__(self, id_mensagem):
+        return id_mensagem in self._por_id
+
+    def __len__(self):
+        return len(self._mensagens)
+
+    def __bool__(self):
+        return bool(self._mensagens)
+
+
+def tamanho_estimado(mensagem):
+    """Bytes aproximados de uma mensagem em memória (dicionário e valores)"""
+    return sys.getsizeof(mensagem) + sum(map(sys.getsizeof, mensagem.values()))
+
+
+def chave_ordenacao(mensagem):
+    """Ordem do histórico: (seq, id)
+
+    O seq é gerado em cada processo e pode se repetir entre workers; o id
+    desempata, então a chave é única e nenhuma mensagem fica de fora na
+    fronteira entre páginas.
+    """
+    return (mensagem.get('seq') or 0, mensagem.get('id') or '')
+
+
+def codificar_cursor(seq, id_mensagem):
+    """Cursor de paginação do histórico, o mesmo na API REST e no Socket.IO
+
+    É opaco para o cliente: a chave (seq, id) da mensagem mais antiga da
+    página, em base64 url-safe. O cliente só devolve o valor recebido para
+    pedir a página anterior.
+    """
+    return base64.urlsafe_b64encode(f'{seq}:{id_mensagem}'.encode()).rstrip(b'=').decode()
+
+
+def decodificar_cursor(cursor):
+    """Chave (seq, id) representada pelo cursor; ValueError se o cursor for inválido"""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (TypeError, ValueError):  # binascii.Error e UnicodeDecodeError são ValueError
+        texto = ''
+    seq, _, id_mensagem = texto.partition(':')
+    if not seq.isdigit() or int(seq) <= 0 or not id_mensagem:
+        raise ValueError(f'Cursor inválido: {cursor!r}')
+    return int(seq), id_mensagem
+
+
+def cursor_da_pagina(mensagens):
+    """Cursor para a página anterior à primeira mensagem (a mais antiga) da lista"""
+    return codificar_cursor(*chave_ordenacao(mensagens[0])) if mensagens else None
+
+
+def serializar_mensagem(mensagem):
+    """Converte mensagem em memória para o formato compacto enviado aos clientes"""
+    # VERIFICAR SE A MENSAGEM FOI DELETADA
+    if mensagem.get('deletada'):
+        eh_arquivo = mensagem.get('tipo') == 'arquivo'
+        return {
+            'id': mensagem['id'],
+            'nome_usuario': mensagem['nome_usuario'],
+            'mensagem': 'Arquivo deletado' if eh_arquivo else 'Mensagem deletada',
+            'tipo': 'arquivo_deletado' if eh_arquivo else 'texto_deletado',
+            'horario': mensagem['horario'],
+            'deletada': True
+        }
+
+    if mensagem.get('tipo') == 'arquivo':
+        dados = {
+            'id': mensagem['id'],
+            'nome_usuario': mensagem['nome_usuario'],
+            'tipo': 'arquivo',
+            'nome_arquivo': mensagem['nome_arquivo'],
+            'tipo_arquivo': mensagem['tipo_arquivo'],
+            'horario': mensagem['horario']
+        }
+        if mensagem.get('url_previa'):
+            dados['url_previa'] = mensagem['url_previa']
+        return dados
+
+    return {
+        'id': mensagem['id'],
+        'nome_usuario': mensagem['nome_usuario'],
+        'mensagem': mensagem['mensagem'],
+        'tipo': 'texto',
+        'horario': mensagem['horario']
+    }
@@ -0,0 +1,240 @@
+"""Métricas no formato de texto do Prometheus (exposto em /metrics).
+
+Contadores e histogramas são fragmentados: cada thread escreve sempre no
+mesmo fragmento, escolhido na primeira observação, e cada fragmento tem
+trava própria. A trava fica quase sempre livre (no modo threading só
+disputam threads que caíram no mesmo fragmento; no eventlet/gevent não há
+troca de contexto dentro da seção crítica) e a soma dos fragmentos só é
+feita na coleta. Medidores podem ser ajustados (+/-) ou calculados por uma
+função no momento da coleta.
+"""
+import functools
+import itertools
+import threading
+import time
+from bisect import bisect_left
+from logs import registros_descartados
+
+# Limites em segundos, de 1ms a 10s
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_proximo_fragmento = itertools.count()
+
+
+def _indice_fragmento(quantidade):
+    """Fragmento fixo da thread atual, distribuído em rodízio entre as threads"""
+    try:
+        indice = _local.indice
+    except AttributeError:
+        indice = _local.indice = next(_proximo_fragmento)
+    return indice % quantidade
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatar_rotulos(nomes, valores, extra=''):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _formatar_numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Fragmento:
+    __slots__ = ('trava', 'series')
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.series = {}  # valores dos rótulos -> valor ou lista de contagens
+
+
+class _MetricaFragmentada:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=(), fragmentos=16):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._fragmentos = [_Fragmento() for _ in range(max(1, fragmentos))]
+
+    def _fragmento(self):
+        return self._fragmentos[_indice_fragmento(len(self._fragmentos))]
+
+    def _somar_fragmentos(self, somar, inicial):
+        """Une as séries de todos os fragmentos; cada trava é segurada só para copiar"""
+        total = {}
+        for fragmento in self._fragmentos:
+            with fragmento.trava:
+                series = [(chave, list(valor) if isinstance(valor, list) else valor)
+                          for chave, valor in fragmento.series.items()]
+            for chave, valor in series:
+                total[chave] = somar(total.get(chave, inicial()), valor)
+        return total
+
+    def _cabecalho(self):
+        return [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+
+
+class Contador(_MetricaFragmentada):
+    """Valor que só cresce (mensagens, entradas, bytes recebidos)"""
+    tipo = 'counter'
+
+    def incrementar(self, *valores, quantidade=1):
+        fragmento = self._fragmento()
+        with fragmento.trava:
+            fragmento.series[valores] = fragmento.series.get(valores, 0) + quantidade
+
+    def valores(self):
+        return self._somar_fragmentos(lambda a, b: a + b, int)
+
+    def exportar(self):
+        linhas = self._cabecalho()
+        for chave, valor in sorted(self.valores().items()):
+            linhas.append(f'{self.nome}{_formatar_rotulos(self.rotulos, chave)} '
+                          f'{_formatar_numero(valor)}')
+        return linhas
+
+
+class Medidor(_MetricaFragmentada):
+    """Valor instantâneo: ajustado com deltas ou calculado por `funcao` na coleta"""
+    tipo = 'gauge'
+
+    def __init__(self, nome, ajuda, funcao=None, fragmentos=16):
+        super().__init__(nome, ajuda, fragmentos=fragmentos)
+        self.funcao = funcao
+
+    def ajustar(self, delta):
+        fragmento = self._fragmento()
+        with fragmento.trava:
+            fragmento.series[()] = fragmento.series.get((), 0) + delta
+
+    def valor(self):
+        if self.funcao is not None:
+            return self.funcao()
+        return self._somar_fragmentos(lambda a, b: a + b, int).get((), 0)
+
+    def exportar(self):
+        return self._cabecalho() + [f'{self.nome} {_formatar_numero(self.valor())}']
+
+
+class Histograma(_MetricaFragmentada):
+    """Distribuição de durações em faixas fixas, com soma e contagem"""
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_LATENCIA, fragmentos=16):
+        super().__init__(nome, ajuda, rotulos, fragmentos)
+        self.limites = tuple(sorted(limites))
+
+    def observar(self, valor, *valores):
+        # Contagem por faixa (não acumulada) + faixa +Inf + soma no fim
+        faixa = bisect_left(self.limites, valor)
+        fragmento = self._fragmento()
+        with fragmento.trava:
+            serie = fragmento.series.get(valores)
+            if serie is None:
+                serie = fragmento.series[valores] = [0] * (len(self.limites) + 2)
+            serie[faixa] += 1
+            serie[-1] += valor
+
+    def medir(self, *valores):
+        """Decorador que observa a duração de cada chamada bem-sucedida"""
+        def decorador(funcao):
+            @functools.wraps(funcao)
+            def medida(*args, **kwargs):
+                inicio = time.perf_counter()
+                resultado = funcao(*args, **kwargs)
+                self.observar(time.perf_counter() - inicio, *valores)
+                return resultado
+            return medida
+        return decorador
+
+    def valores(self):
+        return self._somar_fragmentos(
+            lambda a, b: [x + y for x, y in zip(a, b)],
+            lambda: [0] * (len(self.limites) + 2))
+
+    def exportar(self):
+        linhas = self._cabecalho()
+        for chave, serie in sorted(self.valores().items()):
+            acumulado = 0
+            for limite, contagem in zip(self.limites + (float('inf'),), serie):
+                acumulado += contagem
+                rotulos = _formatar_rotulos(
+                    self.rotulos, chave, f'le="{_formatar_numero(float(limite))}"')
+                linhas.append(f'{self.nome}_bucket{rotulos} {acumulado}')
+            rotulos = _formatar_rotulos(self.rotulos, chave)
+            linhas.append(f'{self.nome}_sum{rotulos} {_formatar_numero(serie[-1])}')
+            linhas.append(f'{self.nome}_count{rotulos} {acumulado}')
+        return linhas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas exportadas juntas"""
+
+    def __init__(self, fragmentos=16):
+        self.fragmentos = fragmentos
+        self._metricas = []
+
+    def _registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos, self.fragmentos))
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_LATENCIA):
+        return self._registrar(Histograma(nome, ajuda, rotulos, limites, self.fragmentos))
+
+    def medidor(self, nome, ajuda, funcao=None):
+        return self._registrar(Medidor(nome, ajuda, funcao, self.fragmentos))
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)"""
+        linhas = []
+        for metrica in self._metricas:
+            linhas.extend(metrica.exportar())
+        return '\n'.join(linhas) + '\n'
+
+
+registro = RegistroMetricas()
+
+DURACAO_HTTP = registro.histograma(
+    'webtalk_http_duracao_segundos',
+    'Duração das requisições HTTP por rota', ('metodo', 'rota'))
+REQUISICOES_HTTP = registro.contador(
+    'webtalk_http_requisicoes_total',
+    'Requisições HTTP por rota e status', ('metodo', 'rota', 'status'))
+DURACAO_EVENTOS = registro.histograma(
+    'webtalk_socketio_evento_duracao_segundos',
+    'Duração dos handlers de eventos Socket.IO', ('evento',))
+DURACAO_BANCO = registro.histograma(
+    'webtalk_banco_duracao_segundos',
+    'Tempo com uma conexão do pool emprestada, por operação', ('operacao',))
+MENSAGENS = registro.contador(
+    'webtalk_mensagens_total', 'Mensagens de texto enviadas')
+ENTRADAS = registro.contador(
+    'webtalk_entradas_total', 'Entradas de usuários em salas')
+BYTES_UPLOAD = registro.contador(
+    'webtalk_upload_bytes_total', 'Bytes de arquivos recebidos em uploads')
+SIDS_CONECTADOS = registro.medidor(
+    'webtalk_socketio_sids_conectados', 'Conexões Socket.IO abertas')
+LOGS_DESCARTADOS = registro.medidor(
+    'webtalk_logs_descartados', 'Registros de log descartados com a fila de logs cheia',
+    registros_descartados)
+
+
+def evento_socketio(socketio, evento, namespace=None):
+    """Equivalente a @socketio.on(evento) que também mede a duração do handler"""
+    def decorador(handler):
+        socketio.on(evento, namespace)(DURACAO_EVENTOS.medir(evento)(handler))
+        return handler
+    return decorador
@@ -0,0 +1,118 @@
+import threading
+import time
+
+
+class Presenca:
+    """Presença de usuários indexada pelo sid do Socket.IO
+
+    Cada sid ocupa no máximo uma sala. Um mesmo nome pode ter vários sids
+    na sala (abas diferentes) e só deixa a sala quando o último sai. Todas
+    as operações são O(1), exceto a expiração, que percorre as sessões.
+    """
+
+    def __init__(self, ao_alterar_total=None):
+        self._trava = threading.Lock()
+        # callback(delta) chamado fora da trava quando o total muda
+        self._ao_alterar_total = ao_alterar_total
+        self._sessoes = {}    # sid -> [id_sala, nome_usuario, ultimo_sinal]
+        self._por_sala = {}   # id_sala -> {nome_usuario: quantidade de sids}
+        self._total = 0       # pares (sala, usuário) distintos
+
+    def entrar(self, sid, id_sala, nome_usuario):
+        """Associa o sid à sala; retorna (saida_anterior, entrou_na_sala)
+
+        saida_anterior é (id_sala, nome_usuario) se o sid deixou outra sala
+        ou usuário por completo ao entrar nesta, senão None.
+        """
+        with self._trava:
+            saida_anterior = None
+            atual = self._sessoes.get(sid)
+            if atual and (atual[0], atual[1]) == (id_sala, nome_usuario):
+                atual[2] = time.monotonic()
+                return None, False
+            if atual:
+                if self._decrementar(atual[0], atual[1]):
+                    saida_anterior = (atual[0], atual[1])
+
+            self._sessoes[sid] = [id_sala, nome_usuario, time.monotonic()]
+            usuarios = self._por_sala.setdefault(id_sala, {})
+            usuarios[nome_usuario] = usuarios.get(nome_usuario, 0) + 1
+            entrou = usuarios[nome_usuario] == 1
+            if entrou:
+                self._total += 1
+        self._notificar(int(entrou) - int(bool(saida_anterior)))
+        return saida_anterior, entrou
+
+    def sair(self, sid):
+        """Remove o sid; retorna (id_sala, nome_usuario, saiu_da_sala) ou None"""
+        with self._trava:
+            sessao = self._sessoes.pop(sid, None)
+            if not sessao:
+                return None
+            saiu = self._decrementar(sessao[0], sessao[1])
+        self._notificar(-int(saiu))
+        return sessao[0], sessao[1], saiu
+
+    def _decrementar(self, id_sala, nome_usuario):
+        """Desconta um sid do usuário na sala; True se era o último"""
+        usuarios = self._por_sala.get(id_sala)
+        if not usuarios or nome_usuario not in usuarios:
+            return False
+        usuarios[nome_usuario] -= 1
+        if usuarios[nome_usuario] > 0:
+            return False
+        del usuarios[nome_usuario]
+        if not usuarios:
+            del self._por_sala[id_sala]
+        self._total -= 1
+        return True
+
+    def sinal(self, sid):
+        """Registra sinal de vida do sid; False se ele não está em nenhuma sala"""
+        sessao = self._sessoes.get(sid)
+        if not sessao:
+            return False
+        sessao[2] = time.monotonic()
+        return True
+
+    def sessao(self, sid):
+        """Retorna (id_sala, nome_usuario) do sid ou None"""
+        sessao = self._sessoes.get(sid)
+        return (sessao[0], sessao[1]) if sessao else None
+
+    def expirar(self, tempo_limite):
+        """Remove sessões sem sinal há mais de tempo_limite segundos
+
+        Retorna lista de (sid, id_sala, nome_usuario, saiu_da_sala).
+        """
+        limite = time.monotonic() - tempo_limite
+        with self._trava:
+            vencidos = [sid for sid, sessao in self._sessoes.items()
+                        if sessao[2] < limite]
+            expiradas = []
+            for sid in vencidos:
+                id_sala, nome_usuario, _ = self._sessoes.pop(sid)
+                expiradas.append(
+                    (sid, id_sala, nome_usuario, self._decrementar(id_sala, nome_usuario)))
+        self._notificar(-sum(1 for *_, saiu in expiradas if saiu))
+        return expiradas
+
+    def remover_sala(self, id_sala):
+        """Descarta todas as sessões de uma sala excluída"""
+        with self._trava:
+            usuarios = self._por_sala.pop(id_sala, {})
+            self._total -= len(usuarios)
+            for sid in [sid for sid, sessao in self._sessoes.items() if sessao[0] == id_sala]:
+                del self._sessoes[sid]
+        self._notificar(-len(usuarios))
+
+    def _notificar(self, delta):
+        if delta and self._ao_alterar_total:
+            self._ao_alterar_total(delta)
+
+    def esta_presente(self, id_sala, nome_usuario):
+        return nome_usuario in self._por_sala.get(id_sala, ())
+
+    def total_usuarios(self):
+        """Total de pares (sala, usuário) conectados em todas as salas"""
+        return self._total
@@ -0,0 +1,248 @@
+"""Miniaturas de imagens e prévias da primeira página de PDFs.
+
+Depois que um arquivo é registrado na sala, a geração da prévia entra em uma
+fila atendida por threads de fundo. A decodificação e a compressão rodam no
+pool de threads nativas (executar_bloqueante), sem travar o loop nos modos
+eventlet/gevent. As prévias ficam em cache no disco, endereçadas como o
+armazém (pelo SHA-256 do conteúdo), então o mesmo arquivo compartilhado em
+várias salas tem uma única prévia.
+
+Dependências opcionais: Pillow para JPG/PNG e o pdftoppm (poppler-utils)
+para PDF. Sem elas o tipo correspondente simplesmente não tem prévia e o
+cliente usa o arquivo original.
+"""
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import uuid
+from collections import OrderedDict
+from logs import obter_logger
+from models.concorrencia import executar_bloqueante
+
+log = obter_logger('webtalk.arquivos')
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+PDFTOPPM = shutil.which('pdftoppm')
+FORMATOS_IMAGEM = {'jpg', 'jpeg', 'png'}
+ROTA_PREVIA = '/api/salas/{id_sala}/arquivos/{id_mensagem}/previa'
+
+
+class GeradorPrevias:
+    """Pool de threads que gera prévias JPEG em uma pasta de cache"""
+
+    _SENTINELA = object()
+
+    def __init__(self, pasta, tamanho_maximo=320, qualidade=80, trabalhadores=2,
+                 tamanho_fila=1000, timeout_pdf=20, maximo_pixels=40_000_000,
+                 maximo_falhas=10000):
+        self.pasta = pasta
+        self.tamanho_maximo = tamanho_maximo
+        self.qualidade = qualidade
+        self.trabalhadores = trabalhadores
+        self.timeout_pdf = timeout_pdf
+        self.maximo_pixels = maximo_pixels
+        self.maximo_falhas = maximo_falhas
+        self._fila = queue.Queue(maxsize=tamanho_fila)
+        self._pendentes = {}  # chave -> Event sinalizado ao fim da geração
+        # Chaves que não geraram prévia (não tentar a cada acesso); as mais
+        # antigas saem primeiro acima de maximo_falhas
+        self._falhas = OrderedDict()
+        self._trava = threading.Lock()
+        self._threads = []
+        self._contadores = dict.fromkeys(
+            ('geradas', 'falhas', 'bytes_originais', 'bytes_previas'), 0)
+        os.makedirs(pasta, exist_ok=True)
+
+    @property
+    def ativo(self):
+        return self.trabalhadores > 0
+
+    def suporta(self, tipo_arquivo):
+        """Indica se há gerador disponível para o tipo de arquivo"""
+        tipo = (tipo_arquivo or '').lower()
+        if not self.ativo:
+            return False
+        if tipo in FORMATOS_IMAGEM:
+            return Image is not None
+        return tipo == 'pdf' and PDFTOPPM is not None
+
+    @staticmethod
+    def chave(mensagem):
+        """Prévias seguem o conteúdo; arquivos anteriores ao armazém usam o id da mensagem"""
+        return mensagem.get('sha256') or f"m{mensagem['id']}"
+
+    def caminho(self, chave):
+        return os.path.join(self.pasta, chave[:2], f'{chave}.jpg')
+
+    def url(self, id_sala, mensagem):
+        """URL da prévia para o payload da mensagem, ou None se o tipo não tem prévia"""
+        if not self.suporta(mensagem.get('tipo_arquivo')):
+            return None
+        return ROTA_PREVIA.format(id_sala=id_sala, id_mensagem=mensagem['id'])
+
+    def iniciar(self):
+        """Inicia as threads de geração"""
+        if self._threads or not self.ativo:
+            return
+        for indice in range(self.trabalhadores):
+            thread = threading.Thread(
+                target=self._executar, name=f'previas-{indice}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def parar(self):
+        """Encerra as threads depois das gerações em andamento"""
+        for _ in self._threads:
+            self._fila.put(self._SENTINELA)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def agendar(self, mensagem):
+        """Enfileira a geração da prévia; retorna o Event da geração ou None
+
+        None significa que não há o que esperar: tipo sem prévia, prévia já
+        em cache, falha anterior ou fila cheia.
+        """
+        if not self.suporta(mensagem.get('tipo_arquivo')) or not mensagem.get('caminho_arquivo'):
+            return None
+        chave = self.chave(mensagem)
+        if os.path.exists(self.caminho(chave)):
+            return None
+
+        with self._trava:
+            if chave in self._falhas:
+                return None
+            evento = self._pendentes.get(chave)
+            if evento:
+                return evento
+            evento = self._pendentes[chave] = threading.Event()
+        try:
+            self._fila.put_nowait(
+                (chave, mensagem['caminho_arquivo'], mensagem['tipo_arquivo'].lower()))
+        except queue.Full:
+            self._concluir(chave)
+            log.warning("Fila de prévias cheia, %s fica para o próximo acesso", chave[:12])
+            return None
+        return evento
+
+    def obter(self, mensagem, timeout=10.0):
+        """Caminho da prévia pronta, aguardando a geração em andamento
+
+        Retorna None se o tipo não tem prévia, se a geração falhou ou se não
+        terminou dentro do timeout.
+        """
+        if not self.suporta(mensagem.get('tipo_arquivo')):
+            return None
+        destino = self.caminho(self.chave(mensagem))
+        if os.path.exists(destino):
+            return destino
+        evento = self.agendar(mensagem)
+        if evento is None or not evento.wait(timeout):
+            return None
+        return destino if os.path.exists(destino) else None
+
+    def remover(self, mensagem):
+        """Apaga a prévia de um conteúdo que deixou de existir"""
+        chave = self.chave(mensagem)
+        with self._trava:
+            self._falhas.pop(chave, None)
+        caminho = self.caminho(chave)
+        try:
+            if os.path.exists(caminho):
+                executar_bloqueante(os.remove, caminho)
+        except OSError as e:
+            log.error("Falha ao remover prévia: %s", e)
+
+    def estatisticas(self):
+        """Prévias geradas e bytes das prévias frente aos originais"""
+        with self._trava:
+            contadores = dict(self._contadores)
+            contadores['pendentes'] = len(self._pendentes)
+        return contadores
+
+    def _concluir(self, chave):
+        with self._trava:
+            evento = self._pendentes.pop(chave, None)
+        if evento:
+            evento.set()
+
+    def _executar(self):
+        while True:
+            tarefa = self._fila.get()
+            if tarefa is self._SENTINELA:
+                return
+            chave, origem, tipo = tarefa
+            try:
+                if tipo == 'pdf':
+                    # pdftoppm roda em outro processo: a espera já coopera com o loop
+                    tamanho = self._gerar(origem, tipo, self.caminho(chave))
+                else:
+                    tamanho = executar_bloqueante(self._gerar, origem, tipo, self.caminho(chave))
+                with self._trava:
+                    self._contadores['geradas'] += 1
+                    self._contadores['bytes_originais'] += os.path.getsize(origem)
+                    self._contadores['bytes_previas'] += tamanho
+            except Exception as e:
+                with self._trava:
+                    self._falhas[chave] = None
+                    if len(self._falhas) > self.maximo_falhas:
+                        self._falhas.popitem(last=False)
+                    self._contadores['falhas'] += 1
+                log.warning("Falha ao gerar prévia de %s: %s", chave[:12], e)
+            finally:
+                self._concluir(chave)
+
+    def _gerar(self, origem, tipo, destino):
+        """Gera a prévia em arquivo temporário e a publica com os.replace; retorna o tamanho"""
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        temporario = f'{destino}.{uuid.uuid4().hex}'
+        try:
+            if tipo == 'pdf':
+                self._gerar_pdf(origem, temporario)
+            else:
+                self._gerar_imagem(origem, temporario)
+            os.replace(temporario, destino)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        return os.path.getsize(destino)
+
+    def _gerar_imagem(self, origem, destino):
+        limite = (self.tamanho_maximo, self.tamanho_maximo)
+        with Image.open(origem) as imagem:
+            # As dimensões vêm do cabeçalho, antes de decodificar: um PNG pequeno
+            # e muito comprimido pode declarar uma imagem de gigabytes
+            largura, altura = imagem.size
+            if largura * altura > self.maximo_pixels:
+                raise Image.DecompressionBombError(
+                    f'Imagem de {largura}x{altura} pixels acima do limite de {self.maximo_pixels}')
+            imagem.draft('RGB', limite)  # JPEG: decodifica já em escala reduzida
+            imagem = ImageOps.exif_transpose(imagem)
+            imagem.thumbnail(limite)
+            if imagem.mode in ('RGBA', 'LA', 'P'):
+                # JPEG não tem transparência: compor sobre fundo branco
+                imagem = imagem.convert('RGBA')
+                fundo = Image.new('RGB', imagem.size, 'white')
+                fundo.paste(imagem, mask=imagem.getchannel('A'))
+                imagem = fundo
+            elif imagem.mode not in ('RGB', 'L'):
+                imagem = imagem.convert('RGB')
+            imagem.save(destino, 'JPEG', quality=self.qualidade,
+                        optimize=True, progressive=True)
+
+    def _gerar_pdf(self, origem, destino):
+        # pdftoppm acrescenta a extensão ao prefixo de saída
+        subprocess.run(
+            [PDFTOPPM, '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+             '-jpegopt', f'quality={self.qualidade}',
+             '-scale-to', str(self.tamanho_maximo), origem, destino],
+            check=True, timeout=self.timeout_pdf,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        os.replace(f'{destino}.jpg', destino)
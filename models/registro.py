@@ -0,0 +1,75 @@
+import threading
+
+
+class _Fragmento:
+    """Parte do registro com trava própria para as escritas"""
+
+    __slots__ = ('trava', 'salas')
+
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.salas = {}
+
+
+class RegistroSalas:
+    """Mapa de salas fragmentado com buscas sem trava
+
+    Escritas alteram o dicionário do fragmento no lugar, sob a trava do
+    fragmento, em O(1). Buscas por id (get, in) são uma única operação de
+    dicionário e dispensam trava. Só a iteração precisa de retrato: cada
+    fragmento é copiado sob sua trava, para não percorrer um dicionário que
+    muda de tamanho. Criar e excluir salas em fragmentos diferentes não
+    disputam a mesma trava.
+    """
+
+    def __init__(self, fragmentos=16, salas=None):
+        self._fragmentos = [_Fragmento() for _ in range(max(1, fragmentos))]
+        for id_sala, sala in (salas or {}).items():
+            self._fragmento(id_sala).salas[id_sala] = sala
+
+    def _fragmento(self, id_sala):
+        # hash de str fica em cache no próprio objeto: custo desprezível por leitura
+        return self._fragmentos[hash(id_sala) % len(self._fragmentos)]
+
+    def get(self, id_sala, padrao=None):
+        """Busca sala sem trava"""
+        return self._fragmento(id_sala).salas.get(id_sala, padrao)
+
+    def inserir_se_ausente(self, id_sala, sala):
+        """Insere a sala se o id estiver livre e retorna a sala registrada"""
+        fragmento = self._fragmento(id_sala)
+        with fragmento.trava:
+            return fragmento.salas.setdefault(id_sala, sala)
+
+    def pop(self, id_sala, padrao=None, esperada=None):
+        """Remove a sala; com esperada, só remove se ainda for o mesmo objeto"""
+        fragmento = self._fragmento(id_sala)
+        with fragmento.trava:
+            atual = fragmento.salas.get(id_sala)
+            if atual is None or (esperada is not None and atual is not esperada):
+                return padrao
+            del fragmento.salas[id_sala]
+            return atual
+
+    def _retratos(self):
+        """Cópia de cada fragmento feita sob a sua trava"""
+        for fragmento in self._fragmentos:
+            with fragmento.trava:
+                retrato = list(fragmento.salas.items())
+            yield retrato
+
+    def values(self):
+        """Retrato das salas de todos os fragmentos"""
+        return [sala for retrato in self._retratos() for _, sala in retrato]
+
+    def items(self):
+        return [item for retrato in self._retratos() for item in retrato]
+
+    def __contains__(self, id_sala):
+        return id_sala in self._fragmento(id_sala).salas
+
+    def __len__(self):
+        return sum(len(fragmento.salas) for fragmento in self._fragmentos)
+
+    def __iter__(self):
+        return iter([id_sala for retrato in self._retratos() for id_sala, _ in retrato])
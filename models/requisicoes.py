@@ -0,0 +1,136 @@
+"""Instrumentação das requisições HTTP na camada WSGI.
+
+Uma linha de log por requisição com método, caminho, status, latência e
+bytes de entrada/saída. Tudo vem do environ e dos cabeçalhos da resposta:
+o corpo da requisição não é lido nem interpretado, então uploads grandes
+não passam por um parse ou seek extra antes da view.
+
+Com as métricas ativas, a duração também entra no histograma por rota
+(o padrão da URL no Flask, ex. /api/salas/<id_sala>/entrar, e não o caminho,
+para não criar uma série por sala).
+
+O registro do corpo é opcional e amostrado (1 a cada N requisições JSON
+pequenas). Nesse caso o corpo é lido uma vez e devolvido à aplicação em
+memória, sem consumir o wsgi.input da view.
+"""
+import io
+import itertools
+import json
+import time
+from flask import request
+from logs import obter_logger
+from models.metricas import DURACAO_HTTP, REQUISICOES_HTTP
+
+log = obter_logger('webtalk.http')
+
+CHAVE_ROTA = 'webtalk.rota'
+
+TIPOS_CORPO = ('application/json',)
+CAMPOS_SENSIVEIS = ('senha', 'password')
+METODOS_HTTP = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+def _tamanho(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def anotar_rota():
+    """before_request: guarda no environ o padrão da rota atendida
+
+    O Flask desfaz o vínculo entre environ e Request ao fim da requisição,
+    então a middleware lê a rota desta chave.
+    """
+    if request.url_rule is not None:
+        request.environ[CHAVE_ROTA] = request.url_rule.rule
+
+
+def _mascarar(dados):
+    """Troca o valor de campos de senha por [***]"""
+    if not isinstance(dados, dict):
+        return dados
+    return {chave: '[***]' if any(campo in chave.lower() for campo in CAMPOS_SENSIVEIS)
+            else valor for chave, valor in dados.items()}
+
+
+class InstrumentacaoRequisicoes:
+    """Middleware WSGI que registra cada requisição ao fim do processamento da view
+
+    A latência vai do início da requisição até a aplicação devolver o corpo
+    da resposta (cabeçalhos prontos), como o antigo after_request. Os bytes
+    de saída vêm do Content-Length; respostas em streaming aparecem com '-'.
+    """
+
+    def __init__(self, aplicacao, ignorar=('/static/',), limite_lento_ms=1000,
+                 amostragem_corpo=0, tamanho_max_corpo=2048, registrar_log=True, medir=True):
+        self.aplicacao = aplicacao
+        self.registrar_log = registrar_log
+        self.medir = medir
+        self.ignorar = tuple(ignorar)
+        self.limite_lento_ms = limite_lento_ms
+        self.amostragem_corpo = amostragem_corpo
+        self.tamanho_max_corpo = tamanho_max_corpo
+        self._contador_corpo = itertools.count()
+
+    def __call__(self, environ, start_response):
+        caminho = environ.get('PATH_INFO', '')
+        if caminho.startswith(self.ignorar):
+            return self.aplicacao(environ, start_response)
+
+        inicio = time.perf_counter()
+        metodo = environ.get('REQUEST_METHOD', '-')
+        if self.amostragem_corpo and self.registrar_log:
+            self._registrar_corpo(environ, metodo, caminho)
+
+        resposta = {}
+
+        def iniciar_resposta(status, cabecalhos, exc_info=None):
+            resposta['status'] = status
+            resposta['cabecalhos'] = cabecalhos
+            return start_response(status, cabecalhos, exc_info)
+
+        try:
+            return self.aplicacao(environ, iniciar_resposta)
+        finally:
+            self._registrar(environ, metodo, caminho, resposta,
+                            (time.perf_counter() - inicio) * 1000)
+
+    def _registrar(self, environ, metodo, caminho, resposta, duracao_ms):
+        status = _tamanho(resposta.get('status', '500')[:3]) or 500
+        if self.medir:
+            metodo_rotulo = metodo if metodo in METODOS_HTTP else 'OUTRO'
+            rota = environ.get(CHAVE_ROTA, '<sem rota>')
+            DURACAO_HTTP.observar(duracao_ms / 1000, metodo_rotulo, rota)
+            REQUISICOES_HTTP.incrementar(metodo_rotulo, rota, status)
+        if not self.registrar_log:
+            return
+        saida = next((valor for nome, valor in resposta.get('cabecalhos', ())
+                      if nome.lower() == 'content-length'), '-')
+        argumentos = (metodo, caminho, status, duracao_ms,
+                      environ.get('CONTENT_LENGTH') or 0, saida,
+                      environ.get('REMOTE_ADDR', 'unknown'))
+        if status >= 400:
+            log.warning("%s %s %s ERROR (%.0fms) in=%s out=%s - IP: %s", *argumentos)
+        elif duracao_ms > self.limite_lento_ms:
+            log.warning("%s %s %s [SLOW] (%.0fms) in=%s out=%s - IP: %s", *argumentos)
+        else:
+            log.info("%s %s %s (%.0fms) in=%s out=%s - IP: %s", *argumentos)
+
+    def _registrar_corpo(self, environ, metodo, caminho):
+        """Registra o corpo JSON de 1 a cada N requisições elegíveis"""
+        tamanho = _tamanho(environ.get('CONTENT_LENGTH'))
+        tipo = environ.get('CONTENT_TYPE', '').split(';')[0].strip().lower()
+        if not tamanho or tamanho > self.tamanho_max_corpo or tipo not in TIPOS_CORPO:
+            return
+        if next(self._contador_corpo) % self.amostragem_corpo:
+            return
+
+        corpo = environ['wsgi.input'].read(tamanho)
+        environ['wsgi.input'] = io.BytesIO(corpo)  # A view lê o mesmo corpo
+        try:
+            dados = _mascarar(json.loads(corpo))
+        except ValueError:
+            dados = '<JSON inválido>'
+        log.info("Corpo %s %s (1/%s): %s", metodo, caminho, self.amostragem_corpo, dados)
@@ -1,3 +1,4 @@
+import heapq
 import uuid
 import time
 from datetime import datetime, timedelta
@@ -6,19 +7,59 @@ import os
 import json
 import threading
 import shutil
+import atexit
+from logs import obter_logger
+from config import Config
+from models.banco import PoolConexoes, AgendadorCheckpoint, obter_pragmas
+from models.escrita import FilaEscrita
+from models.historico import HistoricoMensagens, chave_ordenacao
+from models.barramento import criar_barramento
+from models.concorrencia import executar_bloqueante, TarefaPeriodica
+from models.registro import RegistroSalas
+from models.presenca import Presenca
+from models.estatisticas import EstatisticasSistema
+from models.armazem import ArmazemArquivos
+from models.previas import GeradorPrevias
+from models.expiracao import AgendaExpiracao
+from models.metricas import registro as registro_metricas
+
+log = obter_logger('webtalk.salas')
+
+# Consultas de histórico e atividade recente; devem seguir pelos índices
+# idx_mensagens_sala_seq_id e idx_mensagens_seq (ver tests/test_plano_consultas.py).
+# O histórico é paginado pela chave (seq, id): seq pode se repetir entre workers
+SQL_MENSAGENS_RECENTES = (
+    'SELECT * FROM mensagens WHERE id_sala = ? ORDER BY seq DESC, id DESC LIMIT ?')
+SQL_MENSAGENS_ANTERIORES = (
+    'SELECT * FROM mensagens WHERE id_sala = ? AND (seq, id) < (?, ?) '
+    'ORDER BY seq DESC, id DESC LIMIT ?')
+SQL_ATIVIDADE_RECENTE = '''
+    SELECT salas.nome, mensagens.nome_usuario, mensagens.horario
+    FROM mensagens JOIN salas ON mensagens.id_sala = salas.id
+    ORDER BY mensagens.seq DESC LIMIT ?
+'''
 
 
 class Sala:
-    def __init__(self, id, nome, criador, criado_em=None, senha=None, esta_ativa=True):
+    def __init__(self, id, nome, criador, criado_em=None, senha=None, esta_ativa=True, capacidade_historico=None):
         self.id = id
         self.nome = nome
         self.criador = criador
         self.senha = senha
         self.esta_ativa = esta_ativa
         self.criado_em = criado_em or datetime.now().isoformat()
-        self.mensagens = []
-        self.usuarios = set()
+        # Trava da sala: protege histórico e membros sem bloquear outras salas
+        self.trava = threading.RLock()
+        self.mensagens = HistoricoMensagens(
+            capacidade_historico or Config.MAX_MESSAGES_PER_ROOM, trava=self.trava)
+        # Conjunto imutável substituído a cada alteração: leitura sem trava
+        self.usuarios = frozenset()
         self.ultima_atividade = time.time()
+        self.ultimo_acesso = self.ultima_atividade
+        # Total vindo do banco quando a sala não está hidratada em memória
+        self.total_mensagens = None
+        # Histórico liberado da memória, recarregado do banco no próximo acesso
+        self.historico_descarregado = False
 
     def para_dicionario(self):
         """Converte objeto Sala para dicionário serializável"""
@@ -30,26 +71,26 @@ class Sala:
             'tem_senha': bool(self.senha),
             'esta_ativa': self.esta_ativa,
             'contador_usuarios': len(self.usuarios),
-            'contador_mensagens': len(self.mensagens)
+            'contador_mensagens': len(self.mensagens) if self.total_mensagens is None else self.total_mensagens
         }
 
     def adicionar_usuario(self, nome_usuario):
         """Adiciona usuário à sala e atualiza atividade"""
-        self.usuarios.add(nome_usuario)
+        with self.trava:
+            self.usuarios = self.usuarios | {nome_usuario}
         self.atualizar_atividade()
 
     def remover_usuario(self, nome_usuario):
         """Remove usuário da sala e atualiza atividade"""
-        if nome_usuario in self.usuarios:
-            self.usuarios.remove(nome_usuario)
+        with self.trava:
+            if nome_usuario in self.usuarios:
+                self.usuarios = self.usuarios - {nome_usuario}
         self.atualizar_atividade()
 
     def adicionar_mensagem(self, mensagem):
         """Adiciona mensagem ao histórico da sala"""
-        self.mensagens.append(mensagem)
+        self.mensagens.append(mensagem)  # Buffer circular descarta a mais antiga
         self.atualizar_atividade()
-        if len(self.mensagens) > 100:  # Limitar a 100 mensagens mais recentes
-            self.mensagens = self.mensagens[-100:]
 
     def adicionar_arquivo(self, nome_usuario, nome_arquivo, caminho_arquivo, tipo_arquivo):
         """Adiciona informação de arquivo compartilhado"""
@@ -79,31 +120,32 @@ class Sala:
 
     def remover_mensagem(self, id_mensagem, nome_usuario):
         """Marca mensagem como deletada se o usuário for o autor"""
-        for mensagem in self.mensagens:
-            if mensagem.get('id') == id_mensagem:
-                if mensagem.get('nome_usuario') == nome_usuario:
-                    # Marcar como deletada ao invés de remover
-                    mensagem['deletada'] = True
-                    mensagem['conteudo_original'] = mensagem.get(
-                        'mensagem', mensagem.get('nome_arquivo', ''))
-
-                    if mensagem.get('tipo') == 'arquivo':
-                        mensagem['mensagem'] = 'Arquivo deletado'
-                        # Opcional: remover arquivo físico
-                        if mensagem.get('caminho_arquivo') and os.path.exists(mensagem['caminho_arquivo']):
-                            try:
-                                os.remove(mensagem['caminho_arquivo'])
-                                print(
-                                    f"[DELETE] Arquivo físico removido: {mensagem['caminho_arquivo']}")
-                            except Exception as e:
-                                print(f"[ERROR] Falha ao remover arquivo: {e}")
-                    else:
-                        mensagem['mensagem'] = 'Mensagem deletada'
-
-                    return True
-                else:
-                    return False  # Não é o autor
-        return False  # Mensagem não encontrada
+        with self.trava:
+            mensagem = self.mensagens.obter(id_mensagem)
+            if not mensagem:
+                return False  # Mensagem não encontrada
+
+            if mensagem.get('nome_usuario') != nome_usuario:
+                return False  # Não é o autor
+
+            # Marcar como deletada ao invés de remover
+            mensagem['deletada'] = True
+            mensagem['conteudo_original'] = mensagem.get(
+                'mensagem', mensagem.get('nome_arquivo', ''))
+            if mensagem.get('tipo') != 'arquivo':
+                mensagem['mensagem'] = 'Mensagem deletada'
+                return True
+            mensagem['mensagem'] = 'Arquivo deletado'
+
+        # Opcional: remover arquivo físico fora da trava da sala
+        if mensagem.get('caminho_arquivo') and os.path.exists(mensagem['caminho_arquivo']):
+            try:
+                executar_bloqueante(os.remove, mensagem['caminho_arquivo'])
+                log.info("Arquivo físico removido: %s", mensagem['caminho_arquivo'])
+            except Exception as e:
+                log.error("Falha ao remover arquivo: %s", e)
+
+        return True
 
     def atualizar_atividade(self):
         self.ultima_atividade = time.time()
@@ -116,72 +158,133 @@ class Sala:
 
 
 class GerenciadorSalas:
-    def __init__(self, caminho_bd='db.sqlite3'):
+    def __init__(self, caminho_bd='db.sqlite3', tamanho_pool=None):
         self.caminho_bd = caminho_bd
-        self.salas = {}
-        self._trava = threading.Lock()
+        self.salas = RegistroSalas(Config.ROOM_REGISTRY_SHARDS)
+        self.armazem = ArmazemArquivos(Config.UPLOAD_BLOB_FOLDER)
+        self.previas = GeradorPrevias(
+            Config.PREVIEW_FOLDER,
+            tamanho_maximo=Config.PREVIEW_MAX_SIZE,
+            qualidade=Config.PREVIEW_QUALITY,
+            trabalhadores=Config.PREVIEW_WORKERS,
+            maximo_pixels=Config.PREVIEW_MAX_PIXELS)
+        self.previas.iniciar()
+        self.estatisticas = EstatisticasSistema(Config.STATS_ACTIVITY_SIZE)
+        self.agendador_reconciliacao = None
+        self.presenca = Presenca(
+            ao_alterar_total=lambda delta: self.estatisticas.ajustar(usuarios_online=delta))
+        self.carregamento_sob_demanda = Config.ROOM_LAZY_LOADING
+        self.maximo_salas_memoria = Config.ROOM_CACHE_MAX
+        self.tempo_ocioso_despejo = Config.ROOM_IDLE_EVICT_SECONDS
+        self._proxima_varredura_ociosas = time.time() + self.tempo_ocioso_despejo
+        # Salas por última atividade: a expiração não percorre todas as salas
+        self.agenda_expiracao = AgendaExpiracao()
+        self.agendador_expiracao = None
+        self.pool = PoolConexoes(
+            caminho_bd,
+            tamanho=tamanho_pool or Config.DB_POOL_SIZE,
+            timeout=Config.DB_POOL_TIMEOUT,
+            intervalo_verificacao=Config.DB_POOL_HEALTHCHECK_SECONDS,
+            pragmas=obter_pragmas(Config.DB_DURABILITY))
+        self.agendador_checkpoint = None
+        self.fila_escrita = None
+        self._trava_seq = threading.Lock()
+        self._ultimo_seq = 0
         self.inicializar_bd()
-        self.carregar_salas()
+        self.barramento = criar_barramento(
+            Config.MESSAGE_BUS,
+            Config.MESSAGE_BUS_PATH or caminho_bd,
+            intervalo_ms=Config.MESSAGE_BUS_POLL_MS,
+            pragmas=obter_pragmas(Config.DB_DURABILITY))
+        if self.carregamento_sob_demanda:
+            log.info("Carregamento sob demanda ativo (máximo %s salas em memória)",
+                     self.maximo_salas_memoria)
+        else:
+            self.carregar_salas()
+        self._inicializar_estatisticas()
+
+        if Config.DB_WRITE_BEHIND:
+            self.fila_escrita = FilaEscrita(
+                self.pool,
+                tamanho_lote=Config.DB_WRITE_BATCH_SIZE,
+                intervalo_ms=Config.DB_WRITE_INTERVAL_MS,
+                tamanho_maximo=Config.DB_WRITE_QUEUE_SIZE,
+                timeout_bloqueio=Config.DB_WRITE_QUEUE_TIMEOUT,
+                timeout_descarga=Config.DB_WRITE_FLUSH_TIMEOUT)
+            self.fila_escrita.iniciar()
+
+        if Config.STATS_RECONCILE_SECONDS > 0:
+            self.agendador_reconciliacao = TarefaPeriodica(
+                self.reconciliar_estatisticas, Config.STATS_RECONCILE_SECONDS,
+                'reconciliacao-estatisticas', obter_logger('webtalk.estatisticas'))
+            self.agendador_reconciliacao.iniciar()
+
+        if Config.ROOM_EXPIRY_INTERVAL_SECONDS > 0 and Config.ROOM_TIMEOUT_HOURS > 0:
+            self.agendador_expiracao = TarefaPeriodica(
+                self.limpar_salas_expiradas, Config.ROOM_EXPIRY_INTERVAL_SECONDS,
+                'expiracao-salas', log)
+            self.agendador_expiracao.iniciar()
+
+        if caminho_bd != ':memory:' and Config.DB_CHECKPOINT_INTERVAL_SECONDS > 0:
+            self.agendador_checkpoint = AgendadorCheckpoint(
+                self.pool, Config.DB_CHECKPOINT_INTERVAL_SECONDS)
+            self.agendador_checkpoint.iniciar()
+
+    def fechar(self):
+        """Encerra o acesso ao banco liberando as conexões do pool"""
+        self.barramento.parar()
+        self.previas.parar()
+        if self.agendador_reconciliacao:
+            self.agendador_reconciliacao.parar()
+        if self.agendador_expiracao:
+            self.agendador_expiracao.parar()
+        if self.fila_escrita:
+            self.fila_escrita.parar()
+        if self.agendador_checkpoint:
+            self.agendador_checkpoint.parar()
+        self.pool.fechar()
+        log.info("Pool de conexões encerrado")
 
     def obter_horario(self):
         """Retorna horário atual formatado"""
         return datetime.now().strftime('%H:%M:%S')
 
+    def _proximo_seq(self):
+        """Gera chave de ordenação monotônica (microssegundos desde a época)"""
+        with self._trava_seq:
+            self._ultimo_seq = max(time.time_ns() // 1000, self._ultimo_seq + 1)
+            return self._ultimo_seq
+
+    def _executar_escrita(self, sql, parametros=(), chave=None):
+        """Executa escrita direto no banco ou a agenda na fila write-behind"""
+        if self.fila_escrita:
+            self.fila_escrita.enfileirar(sql, parametros, chave)
+            return
+
+        with self.pool.conexao('executar_escrita') as conexao:
+            conexao.execute(sql, parametros)
+            conexao.commit()
+
     def inicializar_bd(self):
         """Inicializa estrutura do banco de dados SQLite"""
         try:
-            conexao = sqlite3.connect(self.caminho_bd)
-            cursor = conexao.cursor()
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS salas (
-                id TEXT PRIMARY KEY,
-                nome TEXT NOT NULL,
-                criador TEXT NOT NULL,
-                senha TEXT,
-                criado_em TEXT NOT NULL,
-                esta_ativa INTEGER DEFAULT 1
-            )
-            ''')
-
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mensagens (
-                id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
-                id_sala TEXT NOT NULL,
-                nome_usuario TEXT NOT NULL,
-                conteudo TEXT NOT NULL,
-                tipo TEXT DEFAULT 'texto',
-                nome_arquivo TEXT,
-                caminho_arquivo TEXT,
-                tipo_arquivo TEXT,
-                horario TEXT NOT NULL,
-                FOREIGN KEY (id_sala) REFERENCES salas (id)
-            )
-            ''')
-
-            # Verificar se as colunas existem e adicionar se necessário
-            cursor.execute("PRAGMA table_info(mensagens)")
-            colunas = [coluna[1] for coluna in cursor.fetchall()]
-
-            colunas_para_adicionar = [
-                ('tipo', 'TEXT DEFAULT "texto"'),
-                ('nome_arquivo', 'TEXT'),
-                ('caminho_arquivo', 'TEXT'),
-                ('tipo_arquivo', 'TEXT')
-            ]
+            with self.pool.conexao('inicializar_bd') as conexao:
+                cursor = conexao.cursor()
 
-            for nome_coluna, definicao in colunas_para_adicionar:
-                if nome_coluna not in colunas:
-                    cursor.execute(
-                        f'ALTER TABLE mensagens ADD COLUMN {nome_coluna} {definicao}')
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS salas (
+                    id TEXT PRIMARY KEY,
+                    nome TEXT NOT NULL,
+                    criador TEXT NOT NULL,
+                    senha TEXT,
+                    criado_em TEXT NOT NULL,
+                    esta_ativa INTEGER DEFAULT 1,
+                    total_mensagens INTEGER NOT NULL DEFAULT 0
+                )
+                ''')
 
-            # Verificar se a coluna id é TEXT (para UUIDs)
-            if colunas and any(col for col in cursor.execute("PRAGMA table_info(mensagens)").fetchall() if col[1] == 'id' and col[2] != 'TEXT'):
-                # Recriar tabela com id como TEXT se necessário
-                print("[DATABASE] Atualizando estrutura da tabela mensagens...")
-                cursor.execute('ALTER TABLE mensagens RENAME TO mensagens_old')
                 cursor.execute('''
-                CREATE TABLE mensagens (
+                CREATE TABLE IF NOT EXISTS mensagens (
                     id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
                     id_sala TEXT NOT NULL,
                     nome_usuario TEXT NOT NULL,
@@ -191,106 +294,256 @@ class GerenciadorSalas:
                     caminho_arquivo TEXT,
                     tipo_arquivo TEXT,
                     horario TEXT NOT NULL,
+                    seq INTEGER,
+                    sha256 TEXT,
                     FOREIGN KEY (id_sala) REFERENCES salas (id)
                 )
                 ''')
+
+                # Conteúdo de arquivos deduplicado: uma linha por SHA-256
                 cursor.execute('''
-                INSERT INTO mensagens (id_sala, nome_usuario, conteudo, tipo, nome_arquivo, caminho_arquivo, tipo_arquivo, horario)
-                SELECT id_sala, nome_usuario, conteudo, 
-                       COALESCE(tipo, 'texto'),
-                       nome_arquivo, caminho_arquivo, tipo_arquivo, horario
-                FROM mensagens_old
+                CREATE TABLE IF NOT EXISTS arquivos (
+                    sha256 TEXT PRIMARY KEY,
+                    tamanho INTEGER NOT NULL,
+                    referencias INTEGER NOT NULL DEFAULT 0
+                )
                 ''')
-                cursor.execute('DROP TABLE mensagens_old')
 
-            conexao.commit()
-            conexao.close()
-            print("[DATABASE] Estrutura do banco de dados inicializada com sucesso")
+                # Verificar se as colunas existem e adicionar se necessário
+                cursor.execute("PRAGMA table_info(mensagens)")
+                colunas = [coluna[1] for coluna in cursor.fetchall()]
+
+                colunas_para_adicionar = [
+                    ('tipo', 'TEXT DEFAULT "texto"'),
+                    ('nome_arquivo', 'TEXT'),
+                    ('caminho_arquivo', 'TEXT'),
+                    ('tipo_arquivo', 'TEXT'),
+                    ('seq', 'INTEGER'),
+                    ('sha256', 'TEXT')
+                ]
+
+                for nome_coluna, definicao in colunas_para_adicionar:
+                    if nome_coluna not in colunas:
+                        cursor.execute(
+                            f'ALTER TABLE mensagens ADD COLUMN {nome_coluna} {definicao}')
+
+                # Verificar se a coluna id é TEXT (para UUIDs)
+                if colunas and any(col for col in cursor.execute("PRAGMA table_info(mensagens)").fetchall() if col[1] == 'id' and col[2] != 'TEXT'):
+                    # Recriar tabela com id como TEXT se necessário
+                    log.info("Atualizando estrutura da tabela mensagens...")
+                    cursor.execute('ALTER TABLE mensagens RENAME TO mensagens_old')
+                    cursor.execute('''
+                    CREATE TABLE mensagens (
+                        id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
+                        id_sala TEXT NOT NULL,
+                        nome_usuario TEXT NOT NULL,
+                        conteudo TEXT NOT NULL,
+                        tipo TEXT DEFAULT 'texto',
+                        nome_arquivo TEXT,
+                        caminho_arquivo TEXT,
+                        tipo_arquivo TEXT,
+                        horario TEXT NOT NULL,
+                        seq INTEGER,
+                        sha256 TEXT,
+                        FOREIGN KEY (id_sala) REFERENCES salas (id)
+                    )
+                    ''')
+                    cursor.execute('''
+                    INSERT INTO mensagens (id_sala, nome_usuario, conteudo, tipo, nome_arquivo, caminho_arquivo, tipo_arquivo, horario)
+                    SELECT id_sala, nome_usuario, conteudo, 
+                           COALESCE(tipo, 'texto'),
+                           nome_arquivo, caminho_arquivo, tipo_arquivo, horario
+                    FROM mensagens_old
+                    ''')
+                    cursor.execute('DROP TABLE mensagens_old')
+
+                # Preencher chave de ordenação de linhas antigas na ordem de inserção
+                cursor.execute(
+                    'UPDATE mensagens SET seq = rowid WHERE seq IS NULL')
+
+                # Índices para histórico por sala e atividade global recente
+                cursor.execute('DROP INDEX IF EXISTS idx_mensagens_sala_seq')
+                cursor.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_mensagens_sala_seq_id ON mensagens (id_sala, seq, id)')
+                cursor.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_mensagens_seq ON mensagens (seq)')
+
+                # Total de mensagens por sala mantido por triggers na mesma transação
+                # de cada gravação (inclusive os lotes da fila write-behind), para a
+                # listagem de salas não precisar de um COUNT(*) por sala
+                cursor.execute("PRAGMA table_info(salas)")
+                if 'total_mensagens' not in [coluna[1] for coluna in cursor.fetchall()]:
+                    cursor.execute(
+                        'ALTER TABLE salas ADD COLUMN total_mensagens INTEGER NOT NULL DEFAULT 0')
+                    cursor.execute('''
+                    UPDATE salas SET total_mensagens = (
+                        SELECT COUNT(*) FROM mensagens WHERE mensagens.id_sala = salas.id)
+                    ''')
+                cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_mensagens_inseridas AFTER INSERT ON mensagens
+                BEGIN
+                    UPDATE salas SET total_mensagens = total_mensagens + 1 WHERE id = NEW.id_sala;
+                END
+                ''')
+                cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_mensagens_removidas AFTER DELETE ON mensagens
+                BEGIN
+                    UPDATE salas SET total_mensagens = total_mensagens - 1 WHERE id = OLD.id_sala;
+                END
+                ''')
+
+                self._ultimo_seq = cursor.execute(
+                    'SELECT COALESCE(MAX(seq), 0) FROM mensagens').fetchone()[0]
+
+                conexao.commit()
+            log.info("Estrutura do banco de dados inicializada com sucesso")
 
         except Exception as e:
-            print(f"[ERROR] Falha ao inicializar banco de dados: {e}")
+            log.error("Falha ao inicializar banco de dados: %s", e)
 
-    def carregar_salas(self):
-        """Carrega salas existentes do banco de dados para memória"""
+    def _contar_salas_no_bd(self):
+        """Conta salas totais e ativas diretamente no banco"""
+        with self.pool.conexao('contar_salas_no_bd') as conexao:
+            total, ativas = conexao.execute(
+                'SELECT COUNT(*), COALESCE(SUM(esta_ativa), 0) FROM salas').fetchone()
+        return total, ativas
+
+    def _inicializar_estatisticas(self):
+        """Carrega contadores e atividade recente uma única vez na inicialização"""
         try:
-            conexao = sqlite3.connect(self.caminho_bd)
-            conexao.row_factory = sqlite3.Row
-            cursor = conexao.cursor()
-
-            cursor.execute('SELECT * FROM salas')
-            linhas = cursor.fetchall()
-
-            for linha in linhas:
-                sala = Sala(
-                    id=linha['id'],
-                    nome=linha['nome'],
-                    criador=linha['criador'],
-                    criado_em=linha['criado_em'],
-                    senha=linha['senha'],
-                    esta_ativa=bool(linha['esta_ativa'])
-                )
+            total, ativas = self._contar_salas_no_bd()
+            self.estatisticas.definir(total_salas=total, salas_ativas=ativas)
+        except Exception as e:
+            log.error("Falha ao contar salas: %s", e)
+        self.estatisticas.carregar_atividades(
+            reversed(self._obter_atividade_recente(Config.STATS_ACTIVITY_SIZE)))
+
+    def reconciliar_estatisticas(self):
+        """Recontagem periódica que corrige deriva dos contadores incrementais"""
+        marca = self.estatisticas.marcar()
+        total, ativas = self._contar_salas_no_bd()
+        corrigidos = self.estatisticas.reconciliar(
+            marca,
+            total_salas=total,
+            salas_ativas=ativas,
+            usuarios_online=self.presenca.total_usuarios())
+        if corrigidos:
+            log.info("Contadores corrigidos na reconciliação: %s", corrigidos)
+        return corrigidos
+
+    def _criar_sala_de_linha(self, linha):
+        """Constrói objeto Sala a partir de uma linha da tabela salas"""
+        return Sala(
+            id=linha['id'],
+            nome=linha['nome'],
+            criador=linha['criador'],
+            criado_em=linha['criado_em'],
+            senha=linha['senha'],
+            esta_ativa=bool(linha['esta_ativa'])
+        )
+
+    def _linha_para_mensagem(self, msg):
+        """Converte linha da tabela mensagens no formato usado em memória"""
+        mensagem_obj = {
+            'id': msg['id'] or str(uuid.uuid4()),
+            'nome_usuario': msg['nome_usuario'],
+            'horario': msg['horario'],
+            'seq': msg['seq']
+        }
 
-                # CORREÇÃO: Carregar mensagens considerando soft delete
-                cursor.execute(
-                    'SELECT * FROM mensagens WHERE id_sala = ? ORDER BY horario DESC LIMIT 50',
-                    (sala.id,))
-                mensagens = cursor.fetchall()
-
-                for msg in reversed(mensagens):
-                    mensagem_obj = {
-                        'id': msg['id'] or str(uuid.uuid4()),
-                        'nome_usuario': msg['nome_usuario'],
-                        'horario': msg['horario']
-                    }
-
-                    # VERIFICAR SE FOI SOFT DELETED
-                    if msg['tipo'] == 'deletada':
-                        # Mensagem foi soft deleted
-                        mensagem_obj['deletada'] = True
-                        if 'arquivo' in msg['conteudo'].lower():
-                            mensagem_obj['tipo'] = 'arquivo'
-                            mensagem_obj['mensagem'] = 'Arquivo deletado'
-                            mensagem_obj['nome_arquivo'] = 'Arquivo deletado'
-                        else:
-                            mensagem_obj['tipo'] = 'texto'
-                            mensagem_obj['mensagem'] = 'Mensagem deletada'
-                    elif msg['tipo'] == 'arquivo':
-                        mensagem_obj.update({
-                            'tipo': 'arquivo',
-                            'nome_arquivo': msg['nome_arquivo'],
-                            'caminho_arquivo': msg['caminho_arquivo'],
-                            'tipo_arquivo': msg['tipo_arquivo']
-                        })
-                    else:
-                        mensagem_obj.update({
-                            'tipo': 'texto',
-                            'mensagem': msg['conteudo']
-                        })
-
-                    sala.mensagens.append(mensagem_obj)
-
-                self.salas[sala.id] = sala
-
-            conexao.close()
-            print(
-                f"[DATABASE] Carregadas {len(self.salas)} salas do banco de dados")
+        # VERIFICAR SE FOI SOFT DELETED
+        if msg['tipo'] == 'deletada':
+            # Mensagem foi soft deleted
+            mensagem_obj['deletada'] = True
+            if 'arquivo' in msg['conteudo'].lower():
+                mensagem_obj['tipo'] = 'arquivo'
+                mensagem_obj['mensagem'] = 'Arquivo deletado'
+                mensagem_obj['nome_arquivo'] = 'Arquivo deletado'
+            else:
+                mensagem_obj['tipo'] = 'texto'
+                mensagem_obj['mensagem'] = 'Mensagem deletada'
+        elif msg['tipo'] == 'arquivo':
+            mensagem_obj.update({
+                'tipo': 'arquivo',
+                'nome_arquivo': msg['nome_arquivo'],
+                'caminho_arquivo': msg['caminho_arquivo'],
+                'tipo_arquivo': msg['tipo_arquivo'],
+                'sha256': msg['sha256']
+            })
+            self._anotar_previa(msg['id_sala'], mensagem_obj)
+        else:
+            mensagem_obj.update({
+                'tipo': 'texto',
+                'mensagem': msg['conteudo']
+            })
+
+        return mensagem_obj
+
+    def _anotar_previa(self, id_sala, mensagem):
+        """Inclui na mensagem de arquivo a URL da prévia, quando o tipo tem prévia"""
+        url_previa = self.previas.url(id_sala, mensagem)
+        if url_previa:
+            mensagem['url_previa'] = url_previa
+
+    def carregar_salas(self, limite_mensagens=50):
+        """Carrega salas e suas mensagens recentes em consultas únicas"""
+        try:
+            inicio = time.perf_counter()
+
+            with self.pool.conexao('carregar_salas') as conexao:
+                linhas_salas = conexao.execute('SELECT * FROM salas').fetchall()
+                fim_salas = time.perf_counter()
+
+                # Últimas N mensagens de cada sala, já em ordem cronológica.
+                # A janela roda só sobre o índice (id_sala, seq, id) e as linhas
+                # completas são buscadas por rowid apenas para as selecionadas.
+                linhas_mensagens = conexao.execute('''
+                    SELECT mensagens.* FROM (
+                        SELECT rowid AS id_linha, ROW_NUMBER() OVER (
+                            PARTITION BY id_sala ORDER BY seq DESC, id DESC) AS posicao
+                        FROM mensagens
+                    ) recentes
+                    JOIN mensagens ON mensagens.rowid = recentes.id_linha
+                    WHERE recentes.posicao <= ?
+                    ORDER BY mensagens.id_sala, mensagens.seq, mensagens.id
+                ''', (limite_mensagens,)).fetchall()
+                fim_mensagens = time.perf_counter()
+
+            salas = {linha['id']: self._criar_sala_de_linha(linha)
+                     for linha in linhas_salas}
+
+            for msg in linhas_mensagens:
+                sala = salas.get(msg['id_sala'])
+                if sala:
+                    sala.mensagens.append(self._linha_para_mensagem(msg))
+
+            self.salas = RegistroSalas(Config.ROOM_REGISTRY_SHARDS, salas)
+            for sala in salas.values():
+                self._agendar_expiracao(sala)
+            fim = time.perf_counter()
+
+            log.info(
+                "Carregadas %s salas e %s mensagens em %.0fms "
+                "(salas %.0fms, mensagens %.0fms, montagem %.0fms)",
+                len(salas), len(linhas_mensagens), (fim - inicio) * 1000,
+                (fim_salas - inicio) * 1000, (fim_mensagens - fim_salas) * 1000,
+                (fim - fim_mensagens) * 1000)
 
         except Exception as e:
-            print(f"[ERROR] Falha ao carregar salas: {e}")
-            self.salas = {}
+            log.error("Falha ao carregar salas: %s", e)
+            self.salas = RegistroSalas(Config.ROOM_REGISTRY_SHARDS)
 
     def criar_sala(self, nome, criador, senha=None):
         """Cria nova sala e persiste no banco de dados"""
-        with self._trava:
-            try:
-                # Gerar ID único
+        try:
+            # Gerar ID único; a chave primária do banco resolve colisões entre threads
+            id_sala = str(uuid.uuid4())[:8]
+            while id_sala in self.salas:  # Garantir unicidade
                 id_sala = str(uuid.uuid4())[:8]
-                while id_sala in self.salas:  # Garantir unicidade
-                    id_sala = str(uuid.uuid4())[:8]
 
-                sala = Sala(id_sala, nome, criador, senha=senha)
+            sala = Sala(id_sala, nome, criador, senha=senha)
 
-                conexao = sqlite3.connect(self.caminho_bd)
+            with self.pool.conexao('criar_sala') as conexao:
                 cursor = conexao.cursor()
 
                 cursor.execute(
@@ -300,47 +553,260 @@ class GerenciadorSalas:
                 )
 
                 conexao.commit()
-                conexao.close()
 
-                self.salas[id_sala] = sala
-                print(
-                    f"[ROOM] Nova sala criada: ID={id_sala}, Nome='{nome}', Criador='{criador}'")
-                return sala
+            self.salas.inserir_se_ausente(id_sala, sala)
+            self._agendar_expiracao(sala)
+            self.despejar_salas_ociosas()
+            self.estatisticas.ajustar(total_salas=1, salas_ativas=1)
+            self.estatisticas.registrar_atividade(
+                'sala_criada', f"{criador} criou a sala {nome}", self.obter_horario(), id_sala)
+            log.info("Nova sala criada: ID=%s, Nome='%s', Criador='%s'", id_sala, nome, criador)
+            self.barramento.publicar('sala_criada', {}, id_sala)
+            return sala
 
-            except Exception as e:
-                print(f"[ERROR] Falha ao criar sala: {e}")
-                raise
+        except Exception as e:
+            log.error("Falha ao criar sala: %s", e)
+            raise
 
     def obter_sala(self, id_sala):
-        return self.salas.get(id_sala)
+        sala = self.salas.get(id_sala)
+        if not self.carregamento_sob_demanda:
+            if sala is not None and sala.historico_descarregado:
+                self._recarregar_historico(sala)
+            return sala
+
+        if sala is not None:
+            # Registro de uso para o despejo LRU, sem trava
+            sala.ultimo_acesso = time.time()
+            return sala
+
+        return self._hidratar_sala(id_sala)
+
+    def _hidratar_sala(self, id_sala, limite_mensagens=50):
+        """Carrega uma sala e suas mensagens recentes do banco para a memória"""
+        # Mensagens ainda na fila write-behind precisam estar no banco antes da leitura
+        if self.fila_escrita:
+            self.fila_escrita.descarregar()
+
+        try:
+            with self.pool.conexao('hidratar_sala') as conexao:
+                linha = conexao.execute(
+                    'SELECT * FROM salas WHERE id = ?', (id_sala,)).fetchone()
+                if not linha:
+                    return None
+
+                mensagens = conexao.execute(
+                    SQL_MENSAGENS_RECENTES, (id_sala, limite_mensagens)).fetchall()
+
+        except Exception as e:
+            log.error("Falha ao carregar sala %s: %s", id_sala, e)
+            return None
+
+        sala = self._criar_sala_de_linha(linha)
+        for msg in reversed(mensagens):
+            sala.mensagens.append(self._linha_para_mensagem(msg))
+
+        # Outra thread pode ter hidratado a mesma sala enquanto consultávamos
+        registrada = self.salas.inserir_se_ausente(id_sala, sala)
+        if registrada is sala:
+            self._agendar_expiracao(sala)
+            self.despejar_salas_ociosas()
+        return registrada
+
+    def despejar_salas_ociosas(self):
+        """Remove da memória salas sem usuários, das menos usadas para as mais usadas"""
+        if not self.carregamento_sob_demanda:
+            return 0
+
+        # Varredura completa só acima do limite ou periodicamente para as ociosas
+        agora = time.time()
+        excesso = len(self.salas) - self.maximo_salas_memoria
+        if excesso <= 0 and agora < self._proxima_varredura_ociosas:
+            return 0
+        self._proxima_varredura_ociosas = agora + min(
+            60, self.tempo_ocioso_despejo)
+
+        despejadas = 0
+        for sala in sorted(self.salas.values(), key=lambda s: s.ultimo_acesso):
+            ociosa = agora - sala.ultimo_acesso > self.tempo_ocioso_despejo
+            if excesso <= 0 and not ociosa:
+                break  # Demais salas foram usadas mais recentemente
+            if sala.usuarios:
+                continue
+            # Só despeja se ninguém substituiu a sala no registro entretanto
+            if self.salas.pop(sala.id, esperada=sala) is not None:
+                # Fora da memória, a agenda guarda a última atividade para a expiração
+                self._agendar_expiracao(sala)
+                despejadas += 1
+                excesso -= 1
+
+        if despejadas:
+            log.info("%s salas ociosas removidas da memória", despejadas)
+        return despejadas
 
     def obter_todas_salas(self):
-        return list(self.salas.values())
+        if not self.carregamento_sob_demanda:
+            return list(self.salas.values())
+
+        # Salas fora da memória são listadas sem hidratar o histórico; o total
+        # de mensagens vem da coluna mantida pelos triggers
+        try:
+            with self.pool.conexao('obter_todas_salas') as conexao:
+                linhas = conexao.execute('SELECT * FROM salas').fetchall()
+        except Exception as e:
+            log.error("Falha ao listar salas: %s", e)
+            return list(self.salas.values())
+
+        salas = []
+        for linha in linhas:
+            sala = self.salas.get(linha['id'])
+            if sala is None:
+                sala = self._criar_sala_de_linha(linha)
+                sala.total_mensagens = linha['total_mensagens']
+            salas.append(sala)
+        return salas
+
+    def obter_pagina_historico(self, id_sala, antes=None, limite=20):
+        """Retorna página de mensagens anteriores ao cursor (seq, id) e se há mais
+
+        Páginas cobertas pelo buffer em memória não tocam o banco; as demais
+        são lidas com paginação por chave sobre o índice (id_sala, seq, id).
+        """
+        sala = self.obter_sala(id_sala)
+        if not sala:
+            return None, False
+
+        # Do mais recente para o mais antigo pela chave (seq, id), e não pela
+        # ordem de chegada ao buffer (mensagens de outros workers chegam pelo
+        # barramento), pedindo um item extra para saber se existe página seguinte
+        candidatas = (mensagem for mensagem in sala.mensagens
+                      if antes is None or chave_ordenacao(mensagem) < antes)
+        pagina = heapq.nlargest(limite + 1, candidatas, key=chave_ordenacao)
+
+        if len(pagina) > limite:
+            pagina.reverse()
+            return pagina[1:], True
+
+        # Página parcial em memória: completar a partir do banco
+        if self.fila_escrita:
+            self.fila_escrita.descarregar()
+
+        try:
+            with self.pool.conexao('obter_pagina_historico') as conexao:
+                if antes is None:
+                    linhas = conexao.execute(
+                        SQL_MENSAGENS_RECENTES, (id_sala, limite + 1)).fetchall()
+                else:
+                    linhas = conexao.execute(
+                        SQL_MENSAGENS_ANTERIORES, (id_sala, *antes, limite + 1)).fetchall()
+        except Exception as e:
+            log.error("Falha ao buscar histórico da sala %s: %s", id_sala, e)
+            pagina.reverse()
+            return pagina, False
+
+        # Preferir os objetos em memória, que refletem soft deletes recentes
+        pagina = [sala.mensagens.obter(linha['id']) or self._linha_para_mensagem(linha)
+                  for linha in linhas]
+        tem_mais = len(pagina) > limite
+        pagina = pagina[:limite]
+        pagina.reverse()
+        return pagina, tem_mais
 
     def excluir_sala(self, id_sala):
         """Remove sala permanentemente do sistema"""
-        with self._trava:
-            try:
-                if id_sala in self.salas:
-                    conexao = sqlite3.connect(self.caminho_bd)
+        # Retirar do registro primeiro: só uma thread vence a exclusão
+        sala = self.salas.pop(id_sala)
+        if sala is None:
+            return False
+
+        try:
+            # Garantir que nenhuma mensagem pendente seja gravada depois da exclusão
+            if self.fila_escrita:
+                self.fila_escrita.descarregar()
+
+            with self.armazem.trava:
+                with self.pool.conexao('excluir_sala') as conexao:
                     cursor = conexao.cursor()
 
-                    cursor.execute(
-                        'DELETE FROM mensagens WHERE id_sala = ?', (id_sala,))
+                    # Descontar as referências dos arquivos da sala antes de apagar as mensagens
+                    cursor.execute('''
+                        SELECT sha256, COUNT(*) FROM mensagens
+                        WHERE id_sala = ? AND tipo = 'arquivo' AND sha256 IS NOT NULL
+                        GROUP BY sha256
+                    ''', (id_sala,))
+                    sem_referencias = [(sha256, self.armazem.liberar(cursor, sha256, quantidade))
+                                       for sha256, quantidade in cursor.fetchall()]
+
+                    # Sala primeiro: o trigger de contagem não reescreve a linha por mensagem
                     cursor.execute(
                         'DELETE FROM salas WHERE id = ?', (id_sala,))
+                    cursor.execute(
+                        'DELETE FROM mensagens WHERE id_sala = ?', (id_sala,))
 
                     conexao.commit()
-                    conexao.close()
 
-                    del self.salas[id_sala]
-                    print(f"[ROOM] Sala excluída: ID={id_sala}")
-                    return True
-                return False
+                    for sha256, zerado in sem_referencias:
+                        if zerado and self.armazem.remover(conexao, sha256):
+                            self.previas.remover({'sha256': sha256})
+
+            self.presenca.remover_sala(id_sala)
+            self.agenda_expiracao.remover(id_sala)
+            self.estatisticas.ajustar(
+                total_salas=-1, salas_ativas=-int(sala.esta_ativa))
+            self.estatisticas.registrar_atividade(
+                'sala_excluida', f"Sala {sala.nome} excluída", self.obter_horario(), id_sala)
+            log.info("Sala excluída: ID=%s", id_sala)
+            self.barramento.publicar('sala_excluida', {}, id_sala)
+            return True
 
-            except Exception as e:
-                print(f"[ERROR] Falha ao excluir sala {id_sala}: {e}")
-                return False
+        except Exception as e:
+            log.error("Falha ao excluir sala %s: %s", id_sala, e)
+            self.salas.inserir_se_ausente(id_sala, sala)
+            return False
+
+    def aplicar_evento_remoto(self, evento, dados, id_sala):
+        """Sincroniza o estado em memória com eventos publicados por outros processos"""
+        if evento == 'sala_criada':
+            self.estatisticas.ajustar(total_salas=1, salas_ativas=1)
+            if id_sala not in self.salas and not self.carregamento_sob_demanda:
+                self._hidratar_sala(id_sala)
+            return
+
+        if evento == 'sala_excluida':
+            sala = self.salas.pop(id_sala)
+            self.agenda_expiracao.remover(id_sala)
+            self.estatisticas.ajustar(
+                total_salas=-1, salas_ativas=-int(sala.esta_ativa if sala else True))
+            return
+
+        # Demais eventos só afetam salas já presentes neste processo
+        sala = self.salas.get(id_sala)
+        if not sala:
+            return
+
+        if evento == 'mensagem_chat':
+            with sala.trava:
+                if dados.get('id') not in sala.mensagens:
+                    sala.adicionar_mensagem(dict(dados))
+            self._registrar_atividade_mensagem(sala, dados.get('nome_usuario'), dados.get('horario'))
+        elif evento == 'arquivo_compartilhado':
+            # O payload não traz o caminho do arquivo: buscar o registro completo
+            if dados.get('id') and dados['id'] not in sala.mensagens:
+                mensagem = self._buscar_mensagem_no_bd(id_sala, dados['id'])
+                with sala.trava:
+                    if mensagem and dados['id'] not in sala.mensagens:
+                        sala.adicionar_mensagem(mensagem)
+        elif evento == 'mensagem_removida':
+            with sala.trava:
+                mensagem = sala.mensagens.obter(dados.get('id_mensagem'))
+                if mensagem and not mensagem.get('deletada'):
+                    self._marcar_deletada_em_memoria(mensagem)
+        elif evento == 'usuario_entrou':
+            sala.adicionar_usuario(dados.get('nome_usuario'))
+        elif evento == 'usuario_saiu':
+            # O mesmo nome pode continuar conectado neste processo
+            if not self.presenca.esta_presente(id_sala, dados.get('nome_usuario')):
+                sala.remover_usuario(dados.get('nome_usuario'))
 
     def verificar_senha_sala(self, id_sala, senha):
         """Valida senha de acesso à sala"""
@@ -362,6 +828,7 @@ class GerenciadorSalas:
 
             horario = self.obter_horario()
             id_mensagem = str(uuid.uuid4())
+            seq = self._proximo_seq()
 
             # Criar objeto de mensagem
             mensagem_obj = {
@@ -369,45 +836,46 @@ class GerenciadorSalas:
                 'nome_usuario': nome_usuario,
                 'mensagem': mensagem,
                 'tipo': 'texto',
-                'horario': horario
+                'horario': horario,
+                'seq': seq
             }
 
-            # Salvar no banco de dados
-            conexao = sqlite3.connect(self.caminho_bd)
-            cursor = conexao.cursor()
-
-            cursor.execute(
-                'INSERT INTO mensagens (id, id_sala, nome_usuario, conteudo, tipo, horario) VALUES (?, ?, ?, ?, ?, ?)',
-                (id_mensagem, id_sala, nome_usuario, mensagem, 'texto', horario)
+            # Salvar no banco de dados (ou agendar gravação em lote)
+            self._executar_escrita(
+                'INSERT INTO mensagens (id, id_sala, nome_usuario, conteudo, tipo, horario, seq) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (id_mensagem, id_sala, nome_usuario, mensagem, 'texto', horario, seq),
+                chave=id_mensagem
             )
 
-            conexao.commit()
-            conexao.close()
-
             # Adicionar à memória
             sala.adicionar_mensagem(mensagem_obj)
+            self._registrar_atividade_mensagem(sala, nome_usuario, horario)
             return mensagem_obj
 
         except Exception as e:
-            print(
-                f"[ERROR] Falha ao adicionar mensagem na sala {id_sala}: {e}")
+            log.error("Falha ao adicionar mensagem na sala %s: %s", id_sala, e)
             return False
 
-    def adicionar_arquivo_na_sala(self, id_sala, nome_usuario, nome_arquivo, caminho_arquivo, tipo_arquivo):
-        """Adiciona novo arquivo à sala e persiste no banco"""
-        conexao = None
+    def adicionar_arquivo_na_sala(self, id_sala, nome_usuario, nome_arquivo, caminho_arquivo, tipo_arquivo,
+                                  sha256=None, tamanho=None):
+        """Adiciona novo arquivo à sala e persiste no banco
+
+        Com sha256 (calculado pelo servidor sobre os bytes recebidos),
+        caminho_arquivo passa para o armazém deduplicado.
+        """
+        caminho_criado = None  # Conteúdo novo no armazém, a desfazer em caso de erro
         try:
             sala = self.obter_sala(id_sala)
             if not sala:
                 # Remover arquivo se a sala não existir
-                if os.path.exists(caminho_arquivo):
-                    os.remove(caminho_arquivo)
-                    print(
-                        f"[CLEANUP] Arquivo removido - sala não encontrada: {caminho_arquivo}")
+                if caminho_arquivo and os.path.exists(caminho_arquivo):
+                    executar_bloqueante(os.remove, caminho_arquivo)
+                    log.info("Arquivo removido - sala não encontrada: %s", caminho_arquivo)
                 return False
 
             horario = self.obter_horario()
             id_mensagem = str(uuid.uuid4())
+            seq = self._proximo_seq()
 
             # Adicionar à memória primeiro
             mensagem_arquivo = {
@@ -417,60 +885,158 @@ class GerenciadorSalas:
                 'nome_arquivo': nome_arquivo,
                 'caminho_arquivo': caminho_arquivo,
                 'tipo_arquivo': tipo_arquivo,
-                'horario': horario
+                'horario': horario,
+                'seq': seq
             }
 
-            # Tentar salvar no banco de dados
-            conexao = sqlite3.connect(self.caminho_bd)
-            cursor = conexao.cursor()
+            # Tentar salvar no banco de dados; a referência ao conteúdo entra na mesma transação
+            with self.armazem.trava, self.pool.conexao('adicionar_arquivo_na_sala') as conexao:
+                cursor = conexao.cursor()
+
+                if sha256:
+                    caminho_armazenado, novo = self.armazem.referenciar(
+                        cursor, sha256, tamanho, caminho_arquivo)
+                    caminho_criado = caminho_armazenado if novo else None
+                    mensagem_arquivo['caminho_arquivo'] = caminho_armazenado
+                    mensagem_arquivo['sha256'] = sha256
 
-            cursor.execute(
-                'INSERT INTO mensagens (id, id_sala, nome_usuario, conteudo, tipo, nome_arquivo, caminho_arquivo, tipo_arquivo, horario) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                cursor.execute(
+                    'INSERT INTO mensagens (id, id_sala, nome_usuario, conteudo, tipo, nome_arquivo, caminho_arquivo, tipo_arquivo, horario, seq, sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
 
-                (id_mensagem, id_sala, nome_usuario, f"Compartilhou o arquivo: {nome_arquivo}",
-                 'arquivo', nome_arquivo, caminho_arquivo, tipo_arquivo, horario)
-            )
+                    (id_mensagem, id_sala, nome_usuario, f"Compartilhou o arquivo: {nome_arquivo}",
+                     'arquivo', nome_arquivo, mensagem_arquivo['caminho_arquivo'], tipo_arquivo, horario, seq, sha256)
+                )
 
-            conexao.commit()
+                conexao.commit()
+
+            if sha256 and not caminho_criado:
+                log.info("Deduplicação: conteúdo %s já armazenado, %s bytes economizados",
+                         sha256[:12], tamanho or 0)
 
             # Só adicionar à memória se salvou no banco com sucesso
+            self._anotar_previa(id_sala, mensagem_arquivo)
             sala.adicionar_mensagem(mensagem_arquivo)
-            print(
-                f"[FILE] Arquivo registrado com sucesso: {nome_arquivo} na sala {id_sala}")
+            self.previas.agendar(mensagem_arquivo)
+            self.estatisticas.registrar_atividade(
+                'arquivo', f"{nome_usuario} compartilhou um arquivo na sala {sala.nome}", horario, id_sala)
+            log.info("Arquivo registrado com sucesso: %s na sala %s", nome_arquivo, id_sala)
             return mensagem_arquivo
 
         except sqlite3.Error as db_error:
-            print(
-                f"[ERROR] Erro de banco de dados ao adicionar arquivo na sala {id_sala}: {db_error}")
-            self._cleanup_arquivo_erro(caminho_arquivo)
+            log.error("Erro de banco de dados ao adicionar arquivo na sala %s: %s", id_sala, db_error)
+            self._cleanup_arquivo_erro(caminho_criado or caminho_arquivo)
             return False
         except Exception as e:
-            print(f"[ERROR] Falha ao adicionar arquivo na sala {id_sala}: {e}")
-            self._cleanup_arquivo_erro(caminho_arquivo)
+            log.error("Falha ao adicionar arquivo na sala %s: %s", id_sala, e)
+            self._cleanup_arquivo_erro(caminho_criado or caminho_arquivo)
             return False
-        finally:
-            if conexao:
-                conexao.close()
+
+    def obter_estatisticas_armazenamento(self):
+        """Espaço em disco economizado pela deduplicação de arquivos e tamanho das prévias"""
+        with self.pool.conexao('obter_estatisticas_armazenamento') as conexao:
+            estatisticas = self.armazem.estatisticas(conexao.cursor())
+        estatisticas['previas'] = self.previas.estatisticas()
+        return estatisticas
+
+    def _registrar_atividade_mensagem(self, sala, nome_usuario, horario):
+        self.estatisticas.registrar_atividade(
+            'mensagem', f"{nome_usuario} enviou uma mensagem na sala {sala.nome}", horario, sala.id)
 
     def _cleanup_arquivo_erro(self, caminho_arquivo):
         """Remove arquivo em caso de erro durante o processamento"""
         if caminho_arquivo and os.path.exists(caminho_arquivo):
             try:
-                os.remove(caminho_arquivo)
-                print(
-                    f"[CLEANUP] Arquivo removido após erro: {caminho_arquivo}")
+                executar_bloqueante(os.remove, caminho_arquivo)
+                log.info("Arquivo removido após erro: %s", caminho_arquivo)
 
                 # Tentar remover pasta se estiver vazia
                 pasta_pai = os.path.dirname(caminho_arquivo)
                 if os.path.exists(pasta_pai):
                     try:
                         os.rmdir(pasta_pai)
-                        print(f"[CLEANUP] Pasta vazia removida: {pasta_pai}")
+                        log.info("Pasta vazia removida: %s", pasta_pai)
                     except OSError:
                         pass  # Pasta não estava vazia
 
             except Exception as cleanup_error:
-                print(f"[ERROR] Falha ao limpar arquivo: {cleanup_error}")
+                log.error("Falha ao limpar arquivo: %s", cleanup_error)
+
+    def obter_arquivo(self, id_sala, id_mensagem=None, nome_arquivo=None):
+        """Localiza mensagem de arquivo não deletada pelo id (ou, para links antigos, pelo nome)
+
+        Consulta o índice em memória da sala e depois o banco; mensagens de
+        arquivo são gravadas de forma síncrona, então não é preciso esvaziar
+        a fila write-behind.
+        """
+        sala = self.obter_sala(id_sala)
+        if not sala:
+            return None
+
+        if id_mensagem:
+            mensagem = sala.mensagens.obter(id_mensagem)
+            consulta = ('SELECT * FROM mensagens WHERE id = ? AND id_sala = ?',
+                        (id_mensagem, id_sala))
+        else:
+            mensagem = next((m for m in reversed(sala.mensagens)
+                             if m.get('tipo') == 'arquivo' and not m.get('deletada')
+                             and m.get('nome_arquivo') == nome_arquivo), None)
+            consulta = ('''SELECT * FROM mensagens WHERE id_sala = ? AND tipo = 'arquivo'
+                           AND nome_arquivo = ? ORDER BY seq DESC LIMIT 1''',
+                        (id_sala, nome_arquivo))
+
+        if not mensagem:
+            with self.pool.conexao('obter_arquivo') as conexao:
+                linha = conexao.execute(*consulta).fetchone()
+            mensagem = self._linha_para_mensagem(linha) if linha else None
+
+        if (not mensagem or mensagem.get('deletada') or mensagem.get('tipo') != 'arquivo'
+                or not mensagem.get('caminho_arquivo')):
+            return None
+        return mensagem
+
+    def _buscar_mensagem_no_bd(self, id_sala, id_mensagem):
+        """Busca pela chave primária uma mensagem que não está mais em memória"""
+        # A mensagem pode ainda estar na fila write-behind
+        if self.fila_escrita:
+            self.fila_escrita.descarregar()
+
+        with self.pool.conexao('buscar_mensagem_no_bd') as conexao:
+            linha = conexao.execute(
+                'SELECT * FROM mensagens WHERE id = ? AND id_sala = ?',
+                (id_mensagem, id_sala)).fetchone()
+
+        return self._linha_para_mensagem(linha) if linha else None
+
+    def _marcar_deletada_em_memoria(self, mensagem):
+        """Aplica o soft delete ao objeto de mensagem mantido em memória"""
+        mensagem['deletada'] = True
+        mensagem['conteudo_original'] = mensagem.get(
+            'mensagem', mensagem.get('nome_arquivo', ''))
+
+        if mensagem.get('tipo') == 'arquivo':
+            mensagem['mensagem'] = 'Arquivo deletado'
+            mensagem['nome_arquivo'] = 'Arquivo deletado'
+            # Limpar dados do arquivo
+            mensagem['caminho_arquivo'] = None
+            mensagem['tipo_arquivo'] = None
+            mensagem.pop('url_previa', None)
+        else:
+            mensagem['mensagem'] = 'Mensagem deletada'
+
+    def _remover_referencia_arquivo(self, id_mensagem, novo_conteudo, sha256):
+        """Marca a mensagem de arquivo como deletada e apaga o conteúdo sem referências"""
+        with self.armazem.trava:
+            with self.pool.conexao('remover_referencia_arquivo') as conexao:
+                cursor = conexao.cursor()
+                cursor.execute(
+                    "UPDATE mensagens SET conteudo = ?, tipo = 'deletada' WHERE id = ? AND tipo = 'arquivo'",
+                    (novo_conteudo, id_mensagem))
+                # Só a transição arquivo -> deletada desconta a referência
+                sem_referencias = cursor.rowcount == 1 and self.armazem.liberar(cursor, sha256)
+                conexao.commit()
+
+                if sem_referencias and self.armazem.remover(conexao, sha256):
+                    self.previas.remover({'sha256': sha256})
 
     def remover_mensagem_da_sala(self, id_sala, id_mensagem, nome_usuario):
         """Marca mensagem como deletada na sala e no banco de dados"""
@@ -479,114 +1045,172 @@ class GerenciadorSalas:
             if not sala:
                 return False
 
-            # Verificar se a mensagem existe e pertence ao usuário
-            mensagem_para_deletar = None
-            for mensagem in sala.mensagens:
-                if mensagem.get('id') == id_mensagem:
-                    if mensagem.get('nome_usuario') == nome_usuario:
-                        # Verificar se já foi deletada
-                        if mensagem.get('deletada'):
-                            return False  # Já foi deletada
-                        mensagem_para_deletar = mensagem
-                        break
-                    else:
-                        return False  # Não é o autor
+            # Verificar se a mensagem existe (memória ou banco) e pertence ao usuário
+            mensagem_para_deletar = sala.mensagens.obter(id_mensagem)
+            if not mensagem_para_deletar:
+                mensagem_para_deletar = self._buscar_mensagem_no_bd(
+                    id_sala, id_mensagem)
 
             if not mensagem_para_deletar:
                 return False  # Mensagem não encontrada
 
-            # Atualizar no banco de dados primeiro
-            conexao = sqlite3.connect(self.caminho_bd)
-            cursor = conexao.cursor()
+            # Verificação e marcação atômicas: duas remoções simultâneas não passam ambas
+            with sala.trava:
+                if mensagem_para_deletar.get('nome_usuario') != nome_usuario:
+                    return False  # Não é o autor
 
-            if mensagem_para_deletar.get('tipo') == 'arquivo':
-                novo_conteudo = 'Arquivo deletado'
-                # Remover arquivo físico se existir
-                caminho_arquivo = mensagem_para_deletar.get('caminho_arquivo')
-                if caminho_arquivo and os.path.exists(caminho_arquivo):
-                    try:
-                        os.remove(caminho_arquivo)
-                        print(
-                            f"[DELETE] Arquivo físico removido: {caminho_arquivo}")
-                    except Exception as e:
-                        print(f"[ERROR] Falha ao remover arquivo físico: {e}")
-            else:
-                novo_conteudo = 'Mensagem deletada'
+                if mensagem_para_deletar.get('deletada'):
+                    return False  # Já foi deletada
 
-            # MARCAR COMO DELETADA NO BANCO
-            cursor.execute(
-                'UPDATE mensagens SET conteudo = ?, tipo = ? WHERE id = ?',
-                (novo_conteudo, 'deletada', id_mensagem)
-            )
-            conexao.commit()
-            conexao.close()
-
-            # ATUALIZAR NA MEMÓRIA COM SOFT DELETE
-            mensagem_para_deletar['deletada'] = True
-            mensagem_para_deletar['conteudo_original'] = mensagem_para_deletar.get(
-                'mensagem', mensagem_para_deletar.get('nome_arquivo', ''))
-
-            if mensagem_para_deletar.get('tipo') == 'arquivo':
-                mensagem_para_deletar['mensagem'] = 'Arquivo deletado'
-                mensagem_para_deletar['nome_arquivo'] = 'Arquivo deletado'
-                # Limpar dados do arquivo
-                mensagem_para_deletar['caminho_arquivo'] = None
-                mensagem_para_deletar['tipo_arquivo'] = None
-            else:
-                mensagem_para_deletar['mensagem'] = 'Mensagem deletada'
+                eh_arquivo = mensagem_para_deletar.get('tipo') == 'arquivo'
+                caminho_arquivo = mensagem_para_deletar.get('caminho_arquivo')
+                sha256 = mensagem_para_deletar.get('sha256') if eh_arquivo else None
+                novo_conteudo = 'Arquivo deletado' if eh_arquivo else 'Mensagem deletada'
 
-            print(
-                f"[SOFT DELETE] Mensagem {id_mensagem} marcada como deletada na sala {id_sala}")
+                if sha256:
+                    # Arquivo deduplicado: soft delete e referência na mesma transação
+                    self._remover_referencia_arquivo(id_mensagem, novo_conteudo, sha256)
+                else:
+                    # MARCAR COMO DELETADA NO BANCO (mesma fila dos INSERTs, preserva a ordem)
+                    self._executar_escrita(
+                        'UPDATE mensagens SET conteudo = ?, tipo = ? WHERE id = ?',
+                        (novo_conteudo, 'deletada', id_mensagem),
+                        chave=id_mensagem
+                    )
+
+                # ATUALIZAR NA MEMÓRIA COM SOFT DELETE
+                self._marcar_deletada_em_memoria(mensagem_para_deletar)
+
+            # Remover arquivo físico se existir (arquivos anteriores ao armazém deduplicado)
+            if eh_arquivo and not sha256 and caminho_arquivo and os.path.exists(caminho_arquivo):
+                try:
+                    executar_bloqueante(os.remove, caminho_arquivo)
+                    log.info("Arquivo físico removido: %s", caminho_arquivo)
+                except Exception as e:
+                    log.error("Falha ao remover arquivo físico: %s", e)
+                self.previas.remover({'id': id_mensagem})
+
+            log.info("Soft delete: mensagem %s marcada como deletada na sala %s", id_mensagem, id_sala)
             return True
 
         except Exception as e:
-            print(f"[ERROR] Falha ao deletar mensagem {id_mensagem}: {e}")
+            log.error("Falha ao deletar mensagem %s: %s", id_mensagem, e)
             return False
 
-    def limpar_salas_expiradas(self, timeout_horas=24):
-        """Marca salas inativas como expiradas"""
+    def _agendar_expiracao(self, sala):
+        """Registra a sala na agenda de expiração; inativas saem da memória na próxima varredura"""
+        self.agenda_expiracao.agendar(sala.id, sala.ultima_atividade if sala.esta_ativa else 0)
+
+    def _descarregar_sala(self, sala):
+        """Libera a memória de uma sala inativa"""
+        if self.carregamento_sob_demanda:
+            # Volta do banco (inativa) se alguém a acessar
+            self.salas.pop(sala.id, esperada=sala)
+            return
+        # Com todas as salas em memória, mantém só os dados da sala, sem o histórico.
+        # O total vem da coluna mantida pelos triggers (o buffer é limitado) e
+        # não muda mais: a sala inativa não recebe mensagens
         try:
-            ids_expirados = []
-
-            for id_sala, sala in list(self.salas.items()):
-                if sala.esta_expirada(timeout_horas):
-                    ids_expirados.append(id_sala)
+            with self.pool.conexao('descarregar_sala') as conexao:
+                linha = conexao.execute(
+                    'SELECT total_mensagens FROM salas WHERE id = ?', (sala.id,)).fetchone()
+        except Exception as e:
+            log.error("Falha ao ler total de mensagens da sala %s: %s", sala.id, e)
+            return  # Histórico continua em memória
+        with sala.trava:
+            sala.total_mensagens = linha['total_mensagens'] if linha else len(sala.mensagens)
+            sala.mensagens = HistoricoMensagens(sala.mensagens.capacidade, trava=sala.trava)
+            sala.historico_descarregado = True
+
+    def _recarregar_historico(self, sala, limite_mensagens=50):
+        """Volta as mensagens recentes de uma sala descarregada para o buffer"""
+        try:
+            with self.pool.conexao('recarregar_historico') as conexao:
+                mensagens = conexao.execute(
+                    SQL_MENSAGENS_RECENTES, (sala.id, limite_mensagens)).fetchall()
+        except Exception as e:
+            log.error("Falha ao recarregar histórico da sala %s: %s", sala.id, e)
+            return
+        with sala.trava:
+            if not sala.historico_descarregado:
+                return  # Outra thread já recarregou
+            for msg in reversed(mensagens):
+                sala.mensagens.append(self._linha_para_mensagem(msg))
+            sala.historico_descarregado = False
+
+    def limpar_salas_expiradas(self, timeout_horas=None):
+        """Marca salas inativas como expiradas e as retira da memória
+
+        Os candidatos vêm da agenda de expiração (só as salas cuja última
+        atividade registrada passou do limite), não de uma varredura de todas
+        as salas. As desativações são gravadas em uma única transação.
+        Retorna quantas salas foram desativadas.
+        """
+        if timeout_horas is None:
+            timeout_horas = Config.ROOM_TIMEOUT_HOURS
+        agora = time.time()
+        vencidas = self.agenda_expiracao.vencidas(agora - timeout_horas * 60 * 60)
+
+        expirar = {}      # id_sala -> atividade registrada, a desativar no banco
+        descarregar = []  # salas em memória que deixam de ficar carregadas
+        for id_sala, atividade in vencidas:
+            sala = self.salas.get(id_sala)
+            if sala is None:
+                # Despejada da memória: a agenda guardou a última atividade
+                expirar[id_sala] = atividade
+            elif not sala.esta_ativa:
+                if not sala.usuarios:
+                    descarregar.append(sala)
+            elif sala.esta_expirada(timeout_horas):
+                expirar[id_sala] = atividade
+                descarregar.append(sala)
+            else:
+                # Teve atividade depois do registro ou ainda tem usuários: reagendar.
+                # Com usuários, a saída do último atualiza a atividade.
+                self.agenda_expiracao.agendar(
+                    id_sala, agora if sala.usuarios else sala.ultima_atividade)
 
-            for id_sala in ids_expirados:
+        desativadas = 0
+        try:
+            if expirar:
                 # Não exclui do banco, apenas marca como inativo
-                conexao = sqlite3.connect(self.caminho_bd)
-                cursor = conexao.cursor()
-                cursor.execute(
-                    'UPDATE salas SET esta_ativa = 0 WHERE id = ?', (id_sala,))
-                conexao.commit()
-                conexao.close()
-
-                # Atualiza o objeto em memória
-                self.salas[id_sala].esta_ativa = False
-
-            return len(ids_expirados)
+                with self.pool.conexao('limpar_salas_expiradas') as conexao:
+                    cursor = conexao.executemany(
+                        'UPDATE salas SET esta_ativa = 0 WHERE id = ? AND esta_ativa = 1',
+                        [(id_sala,) for id_sala in expirar])
+                    desativadas = cursor.rowcount
+                    conexao.commit()
 
         except Exception as e:
-            print(f"[ERROR] Falha ao limpar salas expiradas: {e}")
+            log.error("Falha ao limpar salas expiradas: %s", e)
+            # Candidatos voltam para a agenda e entram na próxima varredura
+            for id_sala, atividade in expirar.items():
+                self.agenda_expiracao.agendar(id_sala, atividade)
+            for sala in descarregar:
+                self._agendar_expiracao(sala)
             return 0
 
+        for sala in descarregar:
+            sala.esta_ativa = False
+            self._descarregar_sala(sala)
+
+        if desativadas:
+            self.estatisticas.ajustar(salas_ativas=-desativadas)
+        if expirar or descarregar:
+            log.info("Expiração: %s salas desativadas, %s retiradas da memória",
+                     desativadas, len(descarregar))
+        return desativadas
+
     def obter_estatisticas(self):
         """Retorna estatísticas do sistema para dashboard administrativo"""
         try:
-            salas_ativas = sum(
-                1 for sala in self.salas.values() if sala.esta_ativa)
-            usuarios_online = sum(len(sala.usuarios)
-                                  for sala in self.salas.values())
-
-            return {
-                'total_salas': len(self.salas),
-                'salas_ativas': salas_ativas,
-                'usuarios_online': usuarios_online,
-                'atividade_recente': self._obter_atividade_recente()
-            }
+            # Contadores mantidos a cada escrita: nada é recalculado aqui
+            estatisticas = self.estatisticas.obter()
+            estatisticas['atividade_recente'] = self.estatisticas.atividades_recentes()
+            return estatisticas
 
         except Exception as e:
-            print(f"[ERROR] Falha ao obter estatísticas: {e}")
+            log.error("Falha ao obter estatísticas: %s", e)
             return {
                 'total_salas': 0,
                 'salas_ativas': 0,
@@ -594,36 +1218,46 @@ class GerenciadorSalas:
                 'atividade_recente': []
             }
 
-    def _obter_atividade_recente(self):
-        """Recupera atividade recente do sistema para logs administrativos"""
+    def _obter_atividade_recente(self, limite=10):
+        """Recupera do banco as últimas mensagens para semear a atividade recente"""
         try:
             recente = []
 
-            conexao = sqlite3.connect(self.caminho_bd)
-            conexao.row_factory = sqlite3.Row
-            cursor = conexao.cursor()
+            with self.pool.conexao('obter_atividade_recente') as conexao:
+                cursor = conexao.cursor()
 
-            cursor.execute('''
-                SELECT salas.nome, mensagens.nome_usuario, mensagens.horario
-                FROM mensagens JOIN salas ON mensagens.id_sala = salas.id
-                ORDER BY mensagens.horario DESC LIMIT 10
-            ''')
+                cursor.execute(SQL_ATIVIDADE_RECENTE, (limite,))
 
-            atividades = cursor.fetchall()
+                atividades = cursor.fetchall()
 
-            for atividade in atividades:
-                recente.append({
-                    'horario': atividade['horario'],
-                    'texto': f"{atividade['nome_usuario']} enviou uma mensagem na sala {atividade['nome']}"
-                })
+                for atividade in atividades:
+                    recente.append({
+                        'tipo': 'mensagem',
+                        'horario': atividade['horario'],
+                        'texto': f"{atividade['nome_usuario']} enviou uma mensagem na sala {atividade['nome']}"
+                    })
 
-            conexao.close()
             return recente
 
         except Exception as e:
-            print(f"[ERROR] Falha ao obter atividade recente: {e}")
+            log.error("Falha ao obter atividade recente: %s", e)
             return []
 
 
 # Instância global do gerenciador de salas
 gerenciador_salas = GerenciadorSalas()
+atexit.register(gerenciador_salas.fechar)
+
+# Medidores calculados a cada coleta de /metrics
+registro_metricas.medidor(
+    'webtalk_salas_em_memoria', 'Salas carregadas em memória',
+    lambda: len(gerenciador_salas.salas))
+registro_metricas.medidor(
+    'webtalk_historico_mensagens', 'Mensagens mantidas no histórico em memória',
+    lambda: sum(len(sala.mensagens) for sala in gerenciador_salas.salas.values()))
+registro_metricas.medidor(
+    'webtalk_historico_bytes', 'Memória aproximada do histórico em memória',
+    lambda: sum(sala.mensagens.bytes_estimados for sala in gerenciador_salas.salas.values()))
+registro_metricas.medidor(
+    'webtalk_fila_escrita_pendentes', 'Operações aguardando gravação na fila write-behind',
+    lambda: gerenciador_salas.fila_escrita.pendentes() if gerenciador_salas.fila_escrita else 0)
@@ -0,0 +1,227 @@
+"""Uploads em partes (chunked) e retomáveis.
+
+Protocolo: o cliente inicia uma sessão informando nome e tamanho, envia os
+bytes em partes indicando o offset de cada uma e conclui a sessão. Cada parte
+é gravada direto no arquivo temporário enquanto chega, com o hash SHA-256
+atualizado de forma incremental. Se a conexão cair, o cliente consulta o
+offset já gravado e continua dali, sem reenviar o que o servidor já tem.
+
+Cada sessão aberta pode ocupar até o tamanho declarado em disco até expirar,
+então o número de sessões simultâneas é limitado por cliente e por sala.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from logs import obter_logger
+from models.concorrencia import executar_bloqueante
+from models.metricas import BYTES_UPLOAD
+
+log = obter_logger('webtalk.arquivos')
+
+
+# Assinaturas de arquivo conhecidas
+ASSINATURAS = {
+    'pdf': [b'%PDF'],
+    'jpg': [b'\xFF\xD8\xFF'],
+    'jpeg': [b'\xFF\xD8\xFF'],
+    'png': [b'\x89PNG\r\n\x1a\n']
+}
+TAMANHO_CABECALHO = 16
+
+
+def assinatura_confere(cabecalho, extensao):
+    """Verifica se os primeiros bytes correspondem à extensão declarada"""
+    if extensao not in ASSINATURAS:
+        return True  # Para extensões não validadas
+    return any(cabecalho.startswith(assinatura) for assinatura in ASSINATURAS[extensao])
+
+
+class UploadInvalidoError(Exception):
+    """Conteúdo ou tamanho recebido não corresponde ao declarado"""
+
+
+class LimiteUploadsError(Exception):
+    """O cliente ou a sala já tem o máximo de uploads em andamento"""
+
+
+class UploadEncerradoError(Exception):
+    """A sessão já foi concluída ou cancelada por outra requisição"""
+
+
+class OffsetInvalidoError(Exception):
+    """A parte enviada não começa onde a gravação parou"""
+
+    def __init__(self, offset_atual):
+        super().__init__(f'Offset esperado: {offset_atual}')
+        self.offset_atual = offset_atual
+
+
+class SessaoUpload:
+    """Estado de um upload em andamento"""
+
+    def __init__(self, id_upload, id_sala, nome_usuario, nome_arquivo, extensao, tamanho, caminho,
+                 cliente=None):
+        self.id = id_upload
+        self.id_sala = id_sala
+        self.cliente = cliente
+        self.nome_usuario = nome_usuario
+        self.nome_arquivo = nome_arquivo
+        self.extensao = extensao
+        self.tamanho = tamanho
+        self.caminho = caminho
+        self.offset = 0
+        self.hash = hashlib.sha256()
+        self.cabecalho = b''
+        self.atualizado_em = time.monotonic()
+        self.trava = threading.Lock()
+
+    @property
+    def completo(self):
+        return self.offset == self.tamanho
+
+    def para_dicionario(self):
+        return {
+            'id_upload': self.id,
+            'nome_arquivo': self.nome_arquivo,
+            'tamanho': self.tamanho,
+            'offset': self.offset
+        }
+
+
+class GerenciadorUploads:
+    """Sessões de upload retomável gravadas em disco parte a parte"""
+
+    def __init__(self, pasta_temp, tempo_expiracao=3600, tamanho_leitura=64 * 1024,
+                 maximo_por_cliente=0, maximo_por_sala=0):
+        self.pasta_temp = pasta_temp
+        self.tempo_expiracao = tempo_expiracao
+        self.tamanho_leitura = tamanho_leitura
+        self.maximo_por_cliente = maximo_por_cliente  # 0 = sem limite
+        self.maximo_por_sala = maximo_por_sala
+        self._sessoes = {}
+        self._trava = threading.Lock()
+        os.makedirs(pasta_temp, exist_ok=True)
+
+    def iniciar(self, id_sala, nome_usuario, nome_arquivo, extensao, tamanho, cliente=None):
+        """Cria sessão e arquivo temporário vazio
+
+        `cliente` identifica quem envia (endereço IP) para o limite de sessões
+        simultâneas; LimiteUploadsError se o cliente ou a sala já está no máximo.
+        """
+        self.limpar_expiradas()
+        id_upload = uuid.uuid4().hex
+        caminho = os.path.join(self.pasta_temp, f"{id_upload}.parcial")
+        sessao = SessaoUpload(id_upload, id_sala, nome_usuario,
+                              nome_arquivo, extensao, tamanho, caminho, cliente)
+
+        # Verificar e reservar sob a mesma trava: pedidos simultâneos não passam do limite
+        with self._trava:
+            abertas = list(self._sessoes.values())
+            if self.maximo_por_sala and sum(
+                    s.id_sala == id_sala for s in abertas) >= self.maximo_por_sala:
+                raise LimiteUploadsError('Muitos uploads em andamento nesta sala')
+            if self.maximo_por_cliente and cliente is not None and sum(
+                    s.cliente == cliente for s in abertas) >= self.maximo_por_cliente:
+                raise LimiteUploadsError('Muitos uploads em andamento')
+            self._sessoes[id_upload] = sessao
+
+        try:
+            os.makedirs(self.pasta_temp, exist_ok=True)
+            open(caminho, 'wb').close()
+        except OSError:
+            with self._trava:
+                self._sessoes.pop(id_upload, None)
+            raise
+        return sessao
+
+    def obter(self, id_upload, id_sala=None):
+        sessao = self._sessoes.get(id_upload)
+        if sessao and id_sala is not None and sessao.id_sala != id_sala:
+            return None
+        return sessao
+
+    def anexar(self, sessao, offset, ler):
+        """Grava no arquivo os bytes lidos por ler(n) a partir do offset informado
+
+        Os bytes são gravados e incluídos no hash à medida que chegam; se a
+        leitura for interrompida, o offset reflete exatamente o que foi gravado.
+        A leitura roda na thread da requisição (no eventlet/gevent o socket é
+        cooperativo); só a gravação em disco vai para o pool de threads.
+        Retorna o novo offset.
+        """
+        if not sessao.trava.acquire(blocking=False):
+            raise OffsetInvalidoError(sessao.offset)  # Outra parte em gravação
+        try:
+            if offset != sessao.offset:
+                raise OffsetInvalidoError(sessao.offset)
+
+            with open(sessao.caminho, 'r+b') as arquivo:
+                arquivo.seek(sessao.offset)
+                while True:
+                    bloco = ler(self.tamanho_leitura)
+                    if not bloco:
+                        break
+                    if sessao.offset + len(bloco) > sessao.tamanho:
+                        raise UploadInvalidoError(
+                            'Arquivo maior que o tamanho declarado')
+
+                    # Validar assinatura assim que os primeiros bytes chegam; o
+                    # cabeçalho da sessão só muda depois que o bloco foi gravado,
+                    # para uma retomada após falha na escrita não repetir bytes
+                    cabecalho = sessao.cabecalho
+                    if len(cabecalho) < TAMANHO_CABECALHO:
+                        cabecalho += bloco[:TAMANHO_CABECALHO - len(cabecalho)]
+                        if (len(cabecalho) == TAMANHO_CABECALHO or
+                                sessao.offset + len(bloco) == sessao.tamanho) and \
+                                not assinatura_confere(cabecalho, sessao.extensao):
+                            raise UploadInvalidoError(
+                                'Conteúdo do arquivo não corresponde ao tipo esperado')
+
+                    executar_bloqueante(arquivo.write, bloco)
+                    sessao.hash.update(bloco)
+                    sessao.offset += len(bloco)
+                    sessao.cabecalho = cabecalho
+                    BYTES_UPLOAD.incrementar(quantidade=len(bloco))
+                    sessao.atualizado_em = time.monotonic()
+            return sessao.offset
+        finally:
+            sessao.trava.release()
+
+    def finalizar(self, sessao):
+        """Retira a sessão completa do registro e retorna o SHA-256 do conteúdo
+
+        Só uma requisição retira a sessão; as demais (clique duplo, nova
+        tentativa do cliente) recebem UploadEncerradoError e não registram o
+        arquivo de novo.
+        """
+        if not sessao.completo:
+            raise UploadInvalidoError(
+                f'Upload incompleto ({sessao.offset} de {sessao.tamanho} bytes)')
+        with self._trava:
+            if self._sessoes.pop(sessao.id, None) is None:
+                raise UploadEncerradoError('Upload já concluído ou cancelado')
+        return sessao.hash.hexdigest()
+
+    def cancelar(self, sessao):
+        """Descarta a sessão e seu arquivo parcial"""
+        with self._trava:
+            self._sessoes.pop(sessao.id, None)
+        try:
+            if os.path.exists(sessao.caminho):
+                os.remove(sessao.caminho)
+        except OSError as e:
+            log.error("Falha ao remover upload parcial: %s", e)
+
+    def limpar_expiradas(self):
+        """Remove sessões abandonadas há mais que o tempo de expiração"""
+        limite = time.monotonic() - self.tempo_expiracao
+        with self._trava:
+            expiradas = [sessao for sessao in self._sessoes.values()
+                         if sessao.atualizado_em < limite]
+        for sessao in expiradas:
+            self.cancelar(sessao)
+        if expiradas:
+            log.info("%s uploads abandonados removidos", len(expiradas))
+        return len(expiradas)
@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session
+import hmac
+from flask import Blueprint, Response, render_template, request, jsonify, redirect, url_for, session
+from logs import obter_logger
 from models.room import gerenciador_salas
+from models.metricas import registro as registro_metricas
 from config import Config
 
 admin_bp = Blueprint('admin', __name__)
+log = obter_logger('webtalk.admin')
 
 
 @admin_bp.route('/admin')
@@ -19,7 +23,7 @@ def estatisticas_admin():
         return jsonify(estatisticas)
 
     except Exception as e:
-        print(f"[ADMIN ERROR] Falha ao obter estatísticas: {e}")
+        log.error("Falha ao obter estatísticas: %s", e)
         return jsonify({
             'total_salas': 0,
             'salas_ativas': 0,
@@ -28,6 +32,17 @@ def estatisticas_admin():
         })
 
 
+@admin_bp.route('/api/admin/armazenamento')
+def armazenamento_admin():
+    """API endpoint com a economia de disco da deduplicação de arquivos"""
+    try:
+        return jsonify(gerenciador_salas.obter_estatisticas_armazenamento())
+
+    except Exception as e:
+        log.error("Falha ao obter armazenamento: %s", e)
+        return jsonify({'erro': 'Erro interno do servidor'}), 500
+
+
 @admin_bp.route('/api/admin/salas/<id_sala>', methods=['DELETE'])
 def excluir_sala(id_sala):
     """API endpoint para exclusão administrativa de sala"""
@@ -43,7 +58,7 @@ def excluir_sala(id_sala):
         return jsonify({'erro': 'Erro ao excluir sala'}), 500
 
     except Exception as e:
-        print(f"[ADMIN ERROR] Falha ao excluir sala {id_sala}: {e}")
+        log.error("Falha ao excluir sala %s: %s", id_sala, e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
@@ -81,7 +96,7 @@ def atualizar_configuracoes():
         return jsonify({'mensagem': 'Configurações atualizadas com sucesso'})
 
     except Exception as e:
-        print(f"[ADMIN ERROR] Falha ao atualizar configurações: {e}")
+        log.error("Falha ao atualizar configurações: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
@@ -96,5 +111,19 @@ def limpar_salas():
         })
 
     except Exception as e:
-        print(f"[ADMIN ERROR] Falha ao limpar salas: {e}")
+        log.error("Falha ao limpar salas: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
+
+
+@admin_bp.route('/metrics')
+def metricas():
+    """Métricas no formato de texto do Prometheus"""
+    if not Config.METRICS_ENABLED or not Config.METRICS_TOKEN:
+        return jsonify({'erro': 'Métricas desativadas'}), 404
+
+    if not hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {Config.METRICS_TOKEN}'):
+        return jsonify({'erro': 'Não autorizado'}), 401
+
+    return Response(registro_metricas.exportar(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,21 +1,40 @@
 import os
 import uuid
-import shutil
-from flask import Blueprint, render_template, request, jsonify, send_from_directory
-from werkzeug.utils import secure_filename
+import hashlib
+import mimetypes
+from flask import Blueprint, render_template, request, jsonify, send_file, current_app
+from werkzeug.utils import secure_filename, send_file as enviar_arquivo_werkzeug
+from logs import obter_logger
 from models.room import gerenciador_salas
+from models.historico import serializar_mensagem, decodificar_cursor, cursor_da_pagina
+from models.concorrencia import executar_bloqueante
+from models.uploads import (GerenciadorUploads, UploadInvalidoError, LimiteUploadsError,
+                            UploadEncerradoError, OffsetInvalidoError, assinatura_confere)
+from models.armazem import calcular_sha256
+from models.envio import MODOS_PROXY, usar_sendfile, caminho_interno_accel
+from models.metricas import BYTES_UPLOAD
+from config import Config
 
 main_bp = Blueprint('main', __name__)
+log = obter_logger('webtalk.api')
 
 # Configurações de upload
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+MAX_MENSAGENS_POR_PAGINA = 100
+CACHE_ARQUIVOS_SEGUNDOS = 365 * 24 * 60 * 60  # Conteúdo imutável por mensagem
 
 # Criar pasta de uploads se não existir
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
+# Sessões de upload em partes (ver models/uploads.py)
+gerenciador_uploads = GerenciadorUploads(
+    os.path.join(UPLOAD_FOLDER, 'temp'), Config.UPLOAD_SESSION_TTL_SECONDS,
+    maximo_por_cliente=Config.UPLOAD_MAX_SESSIONS_PER_CLIENT,
+    maximo_por_sala=Config.UPLOAD_MAX_SESSIONS_PER_ROOM)
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -42,7 +61,8 @@ def chat(id_sala):
         'senha': bool(sala.senha)
     }
 
-    return render_template('chat.html', room=room_data)
+    return render_template('chat.html', room=room_data,
+                           intervalo_sinal=Config.PRESENCE_HEARTBEAT_SECONDS)
 
 
 @main_bp.route('/api/salas', methods=['GET'])
@@ -57,11 +77,11 @@ def obter_salas():
         salas = [sala.para_dicionario()
                  for sala in gerenciador_salas.obter_todas_salas() if sala.esta_ativa]
 
-        print(f"[API] Retornando {len(salas)} salas. Mobile: {is_mobile}")
+        log.debug("Retornando %s salas. Mobile: %s", len(salas), is_mobile)
 
         return jsonify(salas)
     except Exception as e:
-        print(f"[API ERROR] Falha ao buscar salas: {e}")
+        log.error("Falha ao buscar salas: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
@@ -91,7 +111,7 @@ def criar_sala():
         return jsonify({'id_sala': sala.id, 'mensagem': 'Sala criada com sucesso!'})
 
     except Exception as e:
-        print(f"[API ERROR] Falha ao criar sala: {e}")
+        log.error("Falha ao criar sala: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
@@ -115,7 +135,44 @@ def entrar_sala(id_sala):
         return jsonify({'mensagem': 'Acesso autorizado!'})
 
     except Exception as e:
-        print(f"[API ERROR] Falha ao processar entrada na sala: {e}")
+        log.error("Falha ao processar entrada na sala: %s", e)
+        return jsonify({'erro': 'Erro interno do servidor'}), 500
+
+
+@main_bp.route('/api/salas/<id_sala>/mensagens', methods=['GET'])
+def listar_mensagens(id_sala):
+    """API endpoint para histórico paginado por cursor (antes=<cursor>&limite=N)"""
+    try:
+        antes = request.args.get('antes')
+        limite = request.args.get('limite', Config.HISTORY_BATCH_SIZE)
+
+        try:
+            chave_antes = decodificar_cursor(antes) if antes else None
+            limite = max(1, min(int(limite), MAX_MENSAGENS_POR_PAGINA))
+        except ValueError:
+            return jsonify({'erro': 'Parâmetros de paginação inválidos'}), 400
+
+        sala = gerenciador_salas.obter_sala(id_sala)
+        if not sala:
+            return jsonify({'erro': 'Sala não encontrada'}), 404
+
+        mensagens, tem_mais = gerenciador_salas.obter_pagina_historico(
+            id_sala, chave_antes, limite)
+
+        pagina = {
+            'mensagens': [serializar_mensagem(m) for m in mensagens],
+            'tem_mais': tem_mais,
+            'cursor': cursor_da_pagina(mensagens)
+        }
+
+        resposta = jsonify(pagina)
+        # ETag derivada do conteúdo: muda quando a página recebe mensagens ou soft deletes
+        resposta.set_etag(hashlib.sha1(resposta.get_data()).hexdigest())
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta.make_conditional(request)
+
+    except Exception as e:
+        log.error("Falha ao listar mensagens: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
@@ -145,10 +202,7 @@ def upload_arquivo(id_sala):
             return jsonify({'erro': 'Nenhum arquivo selecionado'}), 400
 
         # MOBILE-SPECIFIC: Better file validation for mobile uploads
-        # Check if request is from mobile device
-        user_agent = request.headers.get('User-Agent', '').lower()
-        is_mobile = any(mobile in user_agent for mobile in [
-                        'mobile', 'android', 'iphone', 'ipad', 'tablet'])
+        is_mobile = eh_dispositivo_movel()
 
         # Verificar tamanho do arquivo
         arquivo.seek(0, os.SEEK_END)
@@ -156,8 +210,7 @@ def upload_arquivo(id_sala):
         arquivo.seek(0)
 
         # Mobile devices may have smaller memory constraints
-        max_size = MAX_FILE_SIZE if not is_mobile else min(
-            MAX_FILE_SIZE, 8 * 1024 * 1024)  # 8MB for mobile
+        max_size = limite_upload(is_mobile)
 
         if tamanho_arquivo > max_size:
             max_mb = max_size // (1024 * 1024)
@@ -178,21 +231,15 @@ def upload_arquivo(id_sala):
             extensao = nome_original.rsplit('.', 1)[1].lower()
             nome_unico = f"{uuid.uuid4().hex}.{extensao}"
 
-            # Criar pasta da sala se não existir
-            pasta_sala = os.path.join(UPLOAD_FOLDER, id_sala)
-            if not os.path.exists(pasta_sala):
-                os.makedirs(pasta_sala)
-
             # Salvar primeiro em arquivo temporário
             pasta_temp = os.path.join(UPLOAD_FOLDER, 'temp')
             os.makedirs(pasta_temp, exist_ok=True)
 
             caminho_temp = os.path.join(pasta_temp, nome_unico)
-            caminho_final = os.path.join(pasta_sala, nome_unico)
 
             # Salvar arquivo temporário
             try:
-                arquivo.save(caminho_temp)
+                executar_bloqueante(arquivo.save, caminho_temp)
                 arquivo_salvo = caminho_temp
 
                 # Validar arquivo salvo
@@ -200,6 +247,7 @@ def upload_arquivo(id_sala):
                     return jsonify({'erro': 'Falha ao salvar arquivo temporário'}), 500
 
                 tamanho_salvo = os.path.getsize(caminho_temp)
+                BYTES_UPLOAD.incrementar(quantidade=tamanho_salvo)
                 if tamanho_salvo == 0:
                     return jsonify({'erro': 'Arquivo salvo está vazio'}), 500
 
@@ -207,40 +255,23 @@ def upload_arquivo(id_sala):
                     return jsonify({'erro': 'Arquivo corrompido durante upload'}), 500
 
                 # Validar conteúdo do arquivo baseado na extensão
-                if not validar_conteudo_arquivo(caminho_temp, extensao):
+                if not executar_bloqueante(validar_conteudo_arquivo, caminho_temp, extensao):
                     return jsonify({'erro': 'Conteúdo do arquivo não corresponde ao tipo esperado'}), 400
 
             except Exception as save_error:
-                print(f"[ERROR] Falha ao salvar arquivo: {save_error}")
+                log.error("Falha ao salvar arquivo: %s", save_error)
                 return jsonify({'erro': 'Erro ao salvar arquivo no servidor'}), 500
 
-            # Registrar no banco de dados ANTES de mover o arquivo
+            # Registrar no banco; o armazém move o arquivo ou descarta a cópia duplicada
+            sha256 = executar_bloqueante(calcular_sha256, caminho_temp)
             mensagem_arquivo = gerenciador_salas.adicionar_arquivo_na_sala(
-                id_sala, nome_usuario, nome_original, caminho_final, extensao
+                id_sala, nome_usuario, nome_original, caminho_temp, extensao,
+                sha256=sha256, tamanho=tamanho_salvo
             )
 
             if not mensagem_arquivo:
                 return jsonify({'erro': 'Erro ao registrar arquivo no banco de dados'}), 500
 
-            # Mover arquivo para localização final apenas se tudo deu certo
-            try:
-                shutil.move(caminho_temp, caminho_final)
-                arquivo_salvo = caminho_final
-
-                # Verificar se o arquivo foi movido corretamente
-                if not os.path.exists(caminho_final) or os.path.getsize(caminho_final) == 0:
-                    # Reverter registro no banco
-                    gerenciador_salas.remover_mensagem_da_sala(
-                        id_sala, mensagem_arquivo['id'], nome_usuario)
-                    return jsonify({'erro': 'Falha ao finalizar upload'}), 500
-
-            except Exception as move_error:
-                print(f"[ERROR] Falha ao mover arquivo: {move_error}")
-                # Reverter registro no banco
-                gerenciador_salas.remover_mensagem_da_sala(
-                    id_sala, mensagem_arquivo['id'], nome_usuario)
-                return jsonify({'erro': 'Erro ao finalizar upload'}), 500
-
             return jsonify({
                 'mensagem': 'Arquivo enviado com sucesso!',
                 'nome_arquivo': nome_original,
@@ -253,7 +284,7 @@ def upload_arquivo(id_sala):
         return jsonify({'erro': 'Tipo de arquivo não permitido. Use: PDF, JPG, JPEG, PNG'}), 400
 
     except Exception as e:
-        print(f"[API ERROR] Falha no upload: {e}")
+        log.error("Falha no upload: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
     finally:
@@ -261,12 +292,172 @@ def upload_arquivo(id_sala):
         if arquivo_salvo and arquivo_salvo.startswith(os.path.join(UPLOAD_FOLDER, 'temp')):
             try:
                 if os.path.exists(arquivo_salvo):
-                    os.remove(arquivo_salvo)
-                    print(
-                        f"[CLEANUP] Arquivo temporário removido: {arquivo_salvo}")
+                    executar_bloqueante(os.remove, arquivo_salvo)
+                    log.info("Arquivo temporário removido: %s", arquivo_salvo)
             except Exception as cleanup_error:
-                print(
-                    f"[ERROR] Falha ao limpar arquivo temporário: {cleanup_error}")
+                log.error("Falha ao limpar arquivo temporário: %s", cleanup_error)
+
+
+def eh_dispositivo_movel():
+    """Detecta navegadores móveis pelo User-Agent"""
+    user_agent = request.headers.get('User-Agent', '').lower()
+    return any(mobile in user_agent for mobile in [
+        'mobile', 'android', 'iphone', 'ipad', 'tablet'])
+
+
+def limite_upload(is_mobile):
+    """Tamanho máximo de arquivo aceito (menor para dispositivos móveis)"""
+    return MAX_FILE_SIZE if not is_mobile else min(MAX_FILE_SIZE, 8 * 1024 * 1024)
+
+
+@main_bp.route('/api/salas/<id_sala>/uploads', methods=['POST'])
+def iniciar_upload(id_sala):
+    """Inicia upload em partes retomável; o tamanho é validado antes de qualquer byte"""
+    try:
+        sala = gerenciador_salas.obter_sala(id_sala)
+        if not sala:
+            return jsonify({'erro': 'Sala não encontrada'}), 404
+
+        if not sala.esta_ativa:
+            return jsonify({'erro': 'Sala não está ativa'}), 403
+
+        dados = request.json or {}
+        nome_usuario = (dados.get('nome_usuario') or '').strip()
+        nome_original = secure_filename(dados.get('nome_arquivo') or '').replace(' ', '_')
+
+        if not nome_usuario:
+            return jsonify({'erro': 'Nome de usuário é obrigatório'}), 400
+
+        if not nome_original or not allowed_file(nome_original):
+            return jsonify({'erro': 'Tipo de arquivo não permitido. Use: PDF, JPG, JPEG, PNG'}), 400
+
+        try:
+            tamanho = int(dados.get('tamanho', 0))
+        except (TypeError, ValueError):
+            return jsonify({'erro': 'Tamanho inválido'}), 400
+
+        if tamanho <= 0:
+            return jsonify({'erro': 'Arquivo está vazio'}), 400
+
+        is_mobile = eh_dispositivo_movel()
+        max_size = limite_upload(is_mobile)
+        if tamanho > max_size:
+            max_mb = max_size // (1024 * 1024)
+            return jsonify({'erro': f'Arquivo muito grande (máximo {max_mb}MB)'}), 413
+
+        extensao = nome_original.rsplit('.', 1)[1].lower()
+
+        # Sem atalho por hash informado pelo cliente: a deduplicação só acontece em
+        # concluir, com o SHA-256 calculado pelo servidor sobre os bytes recebidos
+        try:
+            sessao = executar_bloqueante(
+                gerenciador_uploads.iniciar, id_sala, nome_usuario, nome_original, extensao,
+                tamanho, request.remote_addr)
+        except LimiteUploadsError as e:
+            return jsonify({'erro': str(e)}), 429
+
+        resposta = sessao.para_dicionario()
+        resposta['tamanho_parte'] = Config.UPLOAD_CHUNK_SIZE
+        return jsonify(resposta), 201
+
+    except Exception as e:
+        log.error("Falha ao iniciar upload: %s", e)
+        return jsonify({'erro': 'Erro interno do servidor'}), 500
+
+
+@main_bp.route('/api/salas/<id_sala>/uploads/<id_upload>', methods=['GET'])
+def estado_upload(id_sala, id_upload):
+    """Informa o offset já gravado para o cliente retomar o envio"""
+    sessao = gerenciador_uploads.obter(id_upload, id_sala)
+    if not sessao:
+        return jsonify({'erro': 'Upload não encontrado'}), 404
+    return jsonify(sessao.para_dicionario())
+
+
+@main_bp.route('/api/salas/<id_sala>/uploads/<id_upload>', methods=['PUT'])
+def enviar_parte_upload(id_sala, id_upload):
+    """Recebe uma parte do arquivo gravando em disco conforme os bytes chegam"""
+    sessao = gerenciador_uploads.obter(id_upload, id_sala)
+    if not sessao:
+        return jsonify({'erro': 'Upload não encontrado'}), 404
+
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({'erro': 'Offset inválido'}), 400
+
+    try:
+        novo_offset = gerenciador_uploads.anexar(
+            sessao, offset, request.stream.read)
+        return jsonify({'offset': novo_offset, 'tamanho': sessao.tamanho})
+
+    except OffsetInvalidoError as e:
+        return jsonify({'erro': 'Offset não corresponde ao já recebido', 'offset': e.offset_atual}), 409
+
+    except UploadInvalidoError as e:
+        executar_bloqueante(gerenciador_uploads.cancelar, sessao)
+        return jsonify({'erro': str(e)}), 400
+
+    except Exception as e:
+        # Conexão interrompida: o que já foi gravado permanece para retomada
+        log.warning("Parte de upload interrompida em %s bytes: %s", sessao.offset, e)
+        return jsonify({'erro': 'Envio interrompido', 'offset': sessao.offset}), 400
+
+
+@main_bp.route('/api/salas/<id_sala>/uploads/<id_upload>/concluir', methods=['POST'])
+def concluir_upload(id_sala, id_upload):
+    """Finaliza upload completo e registra o arquivo na sala"""
+    sessao = gerenciador_uploads.obter(id_upload, id_sala)
+    if not sessao:
+        return jsonify({'erro': 'Upload não encontrado'}), 404
+
+    # A sala pode ter expirado durante o envio
+    sala = gerenciador_salas.obter_sala(id_sala)
+    if not sala or not sala.esta_ativa:
+        executar_bloqueante(gerenciador_uploads.cancelar, sessao)
+        if not sala:
+            return jsonify({'erro': 'Sala não encontrada'}), 404
+        return jsonify({'erro': 'Sala não está ativa'}), 403
+
+    try:
+        sha256 = gerenciador_uploads.finalizar(sessao)
+    except UploadInvalidoError as e:
+        return jsonify({'erro': str(e), 'offset': sessao.offset}), 409
+    except UploadEncerradoError as e:
+        return jsonify({'erro': str(e)}), 409
+
+    try:
+        # O armazém move o arquivo ou descarta a cópia duplicada; em caso de erro o
+        # próprio gerenciador remove o arquivo
+        mensagem_arquivo = gerenciador_salas.adicionar_arquivo_na_sala(
+            id_sala, sessao.nome_usuario, sessao.nome_arquivo, sessao.caminho, sessao.extensao,
+            sha256=sha256, tamanho=sessao.tamanho)
+
+        if not mensagem_arquivo:
+            return jsonify({'erro': 'Erro ao registrar arquivo no banco de dados'}), 500
+
+        return jsonify({
+            'mensagem': 'Arquivo enviado com sucesso!',
+            'nome_arquivo': sessao.nome_arquivo,
+            'tipo_arquivo': sessao.extensao,
+            'id_mensagem': mensagem_arquivo['id'],
+            'tamanho': sessao.tamanho
+        })
+
+    except Exception as e:
+        log.error("Falha ao concluir upload: %s", e)
+        executar_bloqueante(gerenciador_uploads.cancelar, sessao)
+        return jsonify({'erro': 'Erro ao finalizar upload'}), 500
+
+
+@main_bp.route('/api/salas/<id_sala>/uploads/<id_upload>', methods=['DELETE'])
+def cancelar_upload(id_sala, id_upload):
+    """Descarta upload em andamento"""
+    sessao = gerenciador_uploads.obter(id_upload, id_sala)
+    if not sessao:
+        return jsonify({'erro': 'Upload não encontrado'}), 404
+    executar_bloqueante(gerenciador_uploads.cancelar, sessao)
+    return jsonify({'mensagem': 'Upload cancelado'})
 
 
 def validar_conteudo_arquivo(caminho_arquivo, extensao_esperada):
@@ -275,74 +466,148 @@ def validar_conteudo_arquivo(caminho_arquivo, extensao_esperada):
         with open(caminho_arquivo, 'rb') as f:
             cabecalho = f.read(16)
 
-        # Assinaturas de arquivo conhecidas
-        assinaturas = {
-            'pdf': [b'%PDF'],
-            'jpg': [b'\xFF\xD8\xFF'],
-            'jpeg': [b'\xFF\xD8\xFF'],
-            'png': [b'\x89PNG\r\n\x1a\n']
-        }
+        return assinatura_confere(cabecalho, extensao_esperada)
 
-        if extensao_esperada in assinaturas:
-            for assinatura in assinaturas[extensao_esperada]:
-                if cabecalho.startswith(assinatura):
-                    return True
-            return False
+    except Exception as e:
+        log.error("Falha na validação de conteúdo: %s", e)
+        return False
 
-        return True  # Para extensões não validadas
+
+def responder_arquivo(sala, mensagem, previa=None, imutavel=True):
+    """Envia arquivo de mensagem (ou sua prévia) com ETag forte, Last-Modified, 304 e Range
+
+    O conteúdo de uma mensagem nunca muda (uma nova versão é outra mensagem),
+    então a resposta das URLs por id pode ficar em cache indefinidamente.
+    Com imutavel=False (URL por nome, que passa a apontar para o upload mais
+    recente com esse nome) o cache precisa revalidar a ETag a cada uso.
+    """
+    caminho_arquivo = os.path.abspath(previa or mensagem['caminho_arquivo'])
+    if not os.path.isfile(caminho_arquivo):
+        log.error("Arquivo ausente no disco: %s (mensagem %s)", caminho_arquivo, mensagem['id'])
+        return jsonify({'erro': 'Arquivo não encontrado'}), 404
+
+    nome_arquivo = mensagem.get('nome_arquivo') or os.path.basename(caminho_arquivo)
+    # O id da mensagem, e não o SHA-256: o hash do conteúdo não sai do servidor
+    etag = mensagem['id']
+    if previa:
+        nome_arquivo = f"{os.path.splitext(nome_arquivo)[0]}-previa.jpg"
+        etag = f"{etag}-previa"
+
+    # Verificar se é uma requisição para visualização (sem download forçado)
+    force_download = request.args.get(
+        'download', 'false').lower() == 'true'
+
+    opcoes_envio = dict(
+        # Arquivos do armazém não têm extensão: o tipo vem do nome original
+        mimetype=mimetypes.guess_type(nome_arquivo)[0],
+        as_attachment=force_download,
+        download_name=nome_arquivo,
+        conditional=True,
+        etag=etag
+    )
+    modo = Config.DOWNLOAD_SERVING_MODE
+
+    if modo in MODOS_PROXY:
+        resposta = enviar_pelo_proxy(caminho_arquivo, modo, opcoes_envio)
+    else:
+        # conditional=True trata If-None-Match/If-Modified-Since (304) e Range (206)
+        resposta = send_file(caminho_arquivo, **opcoes_envio)
+        if modo == 'sendfile':
+            resposta = usar_sendfile(resposta, request.environ, caminho_arquivo)
+    # Salas com senha não devem ficar em caches compartilhados
+    visibilidade = 'private' if sala.senha else 'public'
+    if imutavel:
+        resposta.headers['Cache-Control'] = f'{visibilidade}, max-age={CACHE_ARQUIVOS_SEGUNDOS}, immutable'
+    else:
+        resposta.headers['Cache-Control'] = f'{visibilidade}, no-cache'
+    return resposta
+
+
+def enviar_pelo_proxy(caminho_arquivo, modo, opcoes_envio):
+    """Resposta só com cabeçalhos; o proxy na frente envia o arquivo
+
+    304 continua sendo decidido aqui. Range fica com o proxy, que serve
+    o arquivo como estático e responde 206 por conta própria.
+    """
+    environ = dict(request.environ)
+    environ.pop('HTTP_RANGE', None)
+    environ.pop('HTTP_IF_RANGE', None)
+    resposta = enviar_arquivo_werkzeug(
+        caminho_arquivo, environ, use_x_sendfile=True,
+        response_class=current_app.response_class, **opcoes_envio)
+
+    if modo == 'x-accel-redirect' and 'X-Sendfile' in resposta.headers:
+        uri_interna = caminho_interno_accel(
+            caminho_arquivo, Config.UPLOAD_FOLDER, Config.DOWNLOAD_ACCEL_PREFIX)
+        if uri_interna is None:
+            # Fora da location do nginx: enviar pelo próprio Flask
+            return send_file(caminho_arquivo, **opcoes_envio)
+        del resposta.headers['X-Sendfile']
+        resposta.headers['X-Accel-Redirect'] = uri_interna
+    return resposta
+
+
+@main_bp.route('/api/salas/<id_sala>/arquivos/<id_mensagem>')
+def baixar_arquivo_mensagem(id_sala, id_mensagem):
+    """API endpoint para download de arquivo pelo id da mensagem"""
+    try:
+        sala = gerenciador_salas.obter_sala(id_sala)
+        if not sala:
+            return jsonify({'erro': 'Sala não encontrada'}), 404
+
+        mensagem = gerenciador_salas.obter_arquivo(id_sala, id_mensagem=id_mensagem)
+        if not mensagem:
+            return jsonify({'erro': 'Arquivo não encontrado'}), 404
+
+        return responder_arquivo(sala, mensagem)
 
     except Exception as e:
-        print(f"[ERROR] Falha na validação de conteúdo: {e}")
-        return False
+        log.error("Falha no download: %s", e)
+        return jsonify({'erro': 'Erro interno do servidor'}), 500
+
+
+@main_bp.route('/api/salas/<id_sala>/arquivos/<id_mensagem>/previa')
+def previa_arquivo_mensagem(id_sala, id_mensagem):
+    """API endpoint da miniatura (JPG/PNG) ou primeira página (PDF) de um arquivo"""
+    try:
+        sala = gerenciador_salas.obter_sala(id_sala)
+        if not sala:
+            return jsonify({'erro': 'Sala não encontrada'}), 404
+
+        mensagem = gerenciador_salas.obter_arquivo(id_sala, id_mensagem=id_mensagem)
+        if not mensagem:
+            return jsonify({'erro': 'Arquivo não encontrado'}), 404
+
+        # Aguarda a geração em andamento logo após o upload
+        previa = gerenciador_salas.previas.obter(
+            mensagem, timeout=Config.PREVIEW_WAIT_SECONDS)
+        if not previa:
+            return jsonify({'erro': 'Prévia indisponível'}), 404
+
+        return responder_arquivo(sala, mensagem, previa)
+
+    except Exception as e:
+        log.error("Falha na prévia: %s", e)
+        return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
 @main_bp.route('/api/salas/<id_sala>/download/<path:nome_arquivo>')
 def download_arquivo(id_sala, nome_arquivo):
-    """API endpoint para download de arquivos da sala"""
+    """API endpoint para download pelo nome do arquivo (links anteriores ao download por id)"""
     try:
         sala = gerenciador_salas.obter_sala(id_sala)
         if not sala:
             return jsonify({'erro': 'Sala não encontrada'}), 404
 
-        pasta_sala = os.path.join(UPLOAD_FOLDER, id_sala)
-
-        # Procurar o arquivo correto nas mensagens da sala
-        arquivo_fisico_encontrado = None
-
-        # Primeiro, procurar nas mensagens para encontrar o arquivo físico correto
-        for mensagem in sala.mensagens:
-            if (mensagem.get('tipo') == 'arquivo' and
-                    mensagem.get('nome_arquivo') == nome_arquivo):
-                caminho_arquivo = mensagem.get('caminho_arquivo')
-                if caminho_arquivo and os.path.exists(caminho_arquivo):
-                    arquivo_fisico_encontrado = os.path.basename(
-                        caminho_arquivo)
-                    break
-
-        # Se não encontrou, tentar busca direta
-        if not arquivo_fisico_encontrado:
-            caminho_direto = os.path.join(pasta_sala, nome_arquivo)
-            if os.path.exists(caminho_direto):
-                arquivo_fisico_encontrado = nome_arquivo
-
-        if not arquivo_fisico_encontrado:
-            print(
-                f"[DOWNLOAD ERROR] Arquivo não encontrado: {nome_arquivo} na sala {id_sala}")
+        mensagem = gerenciador_salas.obter_arquivo(id_sala, nome_arquivo=nome_arquivo)
+        if not mensagem:
+            log.warning("Arquivo não encontrado: %s na sala %s", nome_arquivo, id_sala)
             return jsonify({'erro': 'Arquivo não encontrado'}), 404
 
-        # Verificar se é uma requisição para visualização (sem download forçado)
-        force_download = request.args.get(
-            'download', 'false').lower() == 'true'
-
-        return send_from_directory(
-            pasta_sala,
-            arquivo_fisico_encontrado,
-            as_attachment=force_download,
-            download_name=nome_arquivo if force_download else None
-        )
+        return responder_arquivo(sala, mensagem, imutavel=False)
 
     except Exception as e:
-        print(f"[API ERROR] Falha no download: {e}")
+        log.error("Falha no download: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
 
 
@@ -373,7 +638,7 @@ def deletar_mensagem(id_sala, id_mensagem):
             return jsonify({'erro': 'Mensagem não encontrada ou você não tem permissão para removê-la'}), 403
 
     except Exception as e:
-        print(f"[API ERROR] Falha ao deletar mensagem: {e}")
+        log.error("Falha ao deletar mensagem: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
         return jsonify({'erro': 'Nome de usuário é obrigatório'}), 400
 
@@ -394,5 +659,5 @@ def deletar_mensagem(id_sala, id_mensagem):
             return jsonify({'erro': 'Mensagem não encontrada ou você não tem permissão para removê-la'}), 403
 
     except Exception as e:
-        print(f"[API ERROR] Falha ao deletar mensagem: {e}")
+        log.error("Falha ao deletar mensagem: %s", e)
         return jsonify({'erro': 'Erro interno do servidor'}), 500
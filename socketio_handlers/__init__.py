@@ -1 +1,4 @@
-from .events import *
\ No newline at end of file
+from .events import registrar_eventos_socketio
+from .admin import registrar_eventos_admin
+
+__all__ = ['registrar_eventos_socketio', 'registrar_eventos_admin']
@@ -0,0 +1,42 @@
+from flask import request
+from flask_socketio import emit
+from logs import obter_logger
+from models.room import gerenciador_salas
+import threading
+
+
+NAMESPACE_ADMIN = '/admin'
+log = obter_logger('webtalk.admin')
+
+
+def registrar_eventos_admin(socketio):
+    """Registra o namespace /admin, que envia estatísticas por push em vez de polling"""
+    conectados = set()
+    trava = threading.Lock()
+
+    def repassar_estatisticas(evento, dados):
+        """Entrega deltas e atividades aos painéis abertos"""
+        if not conectados:
+            return  # Nenhum painel aberto: nada a serializar
+        nome_evento = 'estatisticas_delta' if evento == 'delta' else evento
+        socketio.emit(nome_evento, dados, namespace=NAMESPACE_ADMIN)
+
+    gerenciador_salas.estatisticas.assinar(repassar_estatisticas)
+
+    @socketio.on('connect', namespace=NAMESPACE_ADMIN)
+    def manipular_conexao_admin():
+        """Envia o retrato completo ao abrir o painel"""
+        with trava:
+            conectados.add(request.sid)
+        log.info("Admin Connect: %s", request.sid[:8])
+        emit('estatisticas', gerenciador_salas.obter_estatisticas())
+
+    @socketio.on('disconnect', namespace=NAMESPACE_ADMIN)
+    def manipular_desconexao_admin():
+        with trava:
+            conectados.discard(request.sid)
+
+    @socketio.on('sincronizar', namespace=NAMESPACE_ADMIN)
+    def manipular_sincronizar():
+        """Reenvia o retrato quando o painel detecta um delta perdido"""
+        emit('estatisticas', gerenciador_salas.obter_estatisticas())
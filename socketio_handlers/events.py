@@ -1,28 +1,122 @@
 from flask import request
 from flask_socketio import emit, join_room, leave_room
+from logs import obter_logger
 from models.room import gerenciador_salas
+from models.historico import serializar_mensagem, decodificar_cursor, cursor_da_pagina
+from models.metricas import evento_socketio, SIDS_CONECTADOS, ENTRADAS, MENSAGENS
+from config import Config
 from datetime import datetime
 import uuid
-import time
+
+log = obter_logger('webtalk.socketio')
+# Mensagens de chat: alto volume, com amostragem própria (LOG_SAMPLING)
+log_mensagens = obter_logger('webtalk.socketio.mensagens')
+
+
+# Eventos de sala repassados aos clientes quando chegam de outro processo
+EVENTOS_CLIENTE = {'usuario_entrou', 'usuario_saiu', 'mensagem_chat',
+                   'mensagem_removida', 'arquivo_compartilhado'}
+
+
+def transmitir_para_sala(evento, dados, id_sala):
+    """Emite para a sala neste processo e publica no barramento para os demais"""
+    emit(evento, dados, room=id_sala)
+    gerenciador_salas.barramento.publicar(evento, dados, id_sala)
+
+
+def notificar_saida(id_sala, nome_usuario, emissor=emit):
+    """Remove o usuário da sala em memória e avisa os participantes de todos os processos"""
+    # Não hidratar a sala só para registrar a saída
+    sala = gerenciador_salas.salas.get(id_sala)
+    if sala:
+        sala.remover_usuario(nome_usuario)
+    emissor('usuario_saiu', {'nome_usuario': nome_usuario}, room=id_sala)
+    gerenciador_salas.barramento.publicar(
+        'usuario_saiu', {'nome_usuario': nome_usuario}, id_sala)
+
+
+def emitir_historico(id_sala, antes=None, limite=None):
+    """Emite uma página do histórico da sala como um único evento 'historico'
+
+    `antes` é o cursor recebido na página anterior (ver codificar_cursor).
+    """
+    limite = max(1, min(int(limite or Config.HISTORY_BATCH_SIZE),
+                        Config.HISTORY_BATCH_SIZE))
+
+    try:
+        chave_antes = decodificar_cursor(antes) if antes else None
+    except ValueError:
+        emit('erro', {'mensagem': 'Cursor de histórico inválido'})
+        return
+
+    mensagens, tem_mais = gerenciador_salas.obter_pagina_historico(
+        id_sala, chave_antes, limite)
+
+    emit('historico', {
+        'id_sala': id_sala,
+        'antes': antes,
+        'mensagens': [serializar_mensagem(m) for m in mensagens],
+        'tem_mais': tem_mais,
+        'cursor': cursor_da_pagina(mensagens)
+    })
 
 
 def registrar_eventos_socketio(socketio):
     """Registra todos os manipuladores de eventos WebSocket"""
 
-    @socketio.on('connect')
+    def receber_evento_remoto(evento, dados, id_sala):
+        """Aplica evento de outro processo e o entrega aos clientes locais da sala"""
+        gerenciador_salas.aplicar_evento_remoto(evento, dados, id_sala)
+        if id_sala and evento in EVENTOS_CLIENTE:
+            socketio.emit(evento, dados, room=id_sala)
+
+    gerenciador_salas.barramento.assinar(receber_evento_remoto)
+
+    def expirar_presenca():
+        """Encerra sessões sem sinal de vida (conexões meio abertas)"""
+        intervalo = max(1, Config.PRESENCE_TIMEOUT_SECONDS // 3)
+        while True:
+            socketio.sleep(intervalo)
+            try:
+                expiradas = gerenciador_salas.presenca.expirar(
+                    Config.PRESENCE_TIMEOUT_SECONDS)
+                for sid, id_sala, nome_usuario, saiu in expiradas:
+                    if saiu:
+                        notificar_saida(id_sala, nome_usuario, socketio.emit)
+                    socketio.server.disconnect(sid, namespace='/')
+                if expiradas:
+                    log.info("%s sessões expiradas por falta de sinal", len(expiradas))
+            except Exception as e:
+                log.error("Expiração de presença: %s", e)
+
+    if Config.PRESENCE_TIMEOUT_SECONDS > 0:
+        socketio.start_background_task(expirar_presenca)
+
+    @evento_socketio(socketio, 'connect')
     def manipular_conexao():
         """Manipula nova conexão WebSocket"""
-        timestamp = time.strftime("%H:%M:%S")
-        print(f"[{timestamp}] WS Connect: {request.sid[:8]}")
+        log.info("WS Connect: %s", request.sid[:8])
+        SIDS_CONECTADOS.ajustar(1)
         return True
 
-    @socketio.on('disconnect')
+    @evento_socketio(socketio, 'disconnect')
     def manipular_desconexao():
         """Manipula desconexão WebSocket"""
-        timestamp = time.strftime("%H:%M:%S")
-        print(f"[{timestamp}] WS Disconnect: {request.sid[:8]}")
+        log.info("WS Disconnect: %s", request.sid[:8])
+        SIDS_CONECTADOS.ajustar(-1)
+
+        sessao = gerenciador_salas.presenca.sair(request.sid)
+        if sessao:
+            id_sala, nome_usuario, saiu = sessao
+            if saiu:
+                notificar_saida(id_sala, nome_usuario)
+
+    @evento_socketio(socketio, 'sinal')
+    def manipular_sinal():
+        """Renova a presença do cliente na sala"""
+        gerenciador_salas.presenca.sinal(request.sid)
 
-    @socketio.on('entrar')
+    @evento_socketio(socketio, 'entrar')
     def manipular_entrada(dados):
         """Processa entrada de usuário em sala de chat"""
         try:
@@ -44,69 +138,74 @@ def registrar_eventos_socketio(socketio):
                 return
 
             join_room(id_sala)
-            sala.adicionar_usuario(nome_usuario)
-
-            emit('usuario_entrou', {
-                 'nome_usuario': nome_usuario}, room=id_sala)
-
-            timestamp = time.strftime("%H:%M:%S")
-            print(f"[{timestamp}] User Join: {nome_usuario} -> Room {id_sala}")
-
-            # Enviar mensagens históricas VERIFICANDO SOFT DELETE
-            for mensagem in sala.mensagens[-20:]:
-                # VERIFICAR SE A MENSAGEM FOI DELETADA
-                if mensagem.get('deletada'):
-                    # Enviar como mensagem deletada
-                    if mensagem.get('tipo') == 'arquivo':
-                        emit('mensagem_chat', {
-                            'id': mensagem['id'],
-                            'nome_usuario': mensagem['nome_usuario'],
-                            'mensagem': 'Arquivo deletado',
-                            'tipo': 'arquivo_deletado',
-                            'horario': mensagem['horario'],
-                            'deletada': True
-                        })
-                    else:
-                        emit('mensagem_chat', {
-                            'id': mensagem['id'],
-                            'nome_usuario': mensagem['nome_usuario'],
-                            'mensagem': 'Mensagem deletada',
-                            'tipo': 'texto_deletado',
-                            'horario': mensagem['horario'],
-                            'deletada': True
-                        })
-                elif mensagem.get('tipo') == 'arquivo':
-                    emit('arquivo_compartilhado', mensagem)
-                else:
-                    emit('mensagem_chat', mensagem)
+            saida_anterior, entrou = gerenciador_salas.presenca.entrar(
+                request.sid, id_sala, nome_usuario)
+
+            # O mesmo socket estava em outra sala ou com outro nome
+            if saida_anterior:
+                if saida_anterior[0] != id_sala:
+                    leave_room(saida_anterior[0])
+                notificar_saida(*saida_anterior)
+
+            # Outras abas do mesmo usuário não repetem o aviso de entrada
+            if entrou:
+                sala.adicionar_usuario(nome_usuario)
+                transmitir_para_sala('usuario_entrou', {
+                    'nome_usuario': nome_usuario}, id_sala)
+
+            log.info("User Join: %s -> Room %s", nome_usuario, id_sala)
+            ENTRADAS.incrementar()
+
+            # Enviar histórico recente em um único evento
+            emitir_historico(id_sala)
 
         except Exception as e:
-            print(f"[ERROR] Entrada na sala: {e}")
+            log.error("Entrada na sala: %s", e)
             emit('erro', {'mensagem': 'Erro interno do servidor'})
 
-    @socketio.on('sair')
-    def manipular_saida(dados):
-        """Processa saída de usuário de sala de chat"""
+    @evento_socketio(socketio, 'carregar_historico')
+    def manipular_carregar_historico(dados):
+        """Envia página anterior do histórico para rolagem (scrollback)"""
         try:
             id_sala = dados.get('id_sala')
-            nome_usuario = dados.get('nome_usuario')
+            antes = dados.get('antes')
+
+            if not id_sala or not antes:
+                emit('erro', {'mensagem': 'Dados incompletos'})
+                return
+
+            sala = gerenciador_salas.obter_sala(id_sala)
+            if not sala:
+                emit('erro', {'mensagem': 'Sala não encontrada'})
+                return
+
+            emitir_historico(id_sala, antes, dados.get('limite'))
+
+        except Exception as e:
+            log.error("Carregar histórico: %s", e)
+            emit('erro', {'mensagem': 'Erro ao carregar histórico'})
 
-            if id_sala and nome_usuario:
-                sala = gerenciador_salas.obter_sala(id_sala)
-                if sala:
-                    sala.remover_usuario(nome_usuario)
+    @evento_socketio(socketio, 'sair')
+    def manipular_saida(dados):
+        """Processa saída de usuário de sala de chat"""
+        try:
+            sessao = gerenciador_salas.presenca.sair(request.sid)
+            if not sessao:
+                if dados.get('id_sala'):
+                    leave_room(dados['id_sala'])
+                return
 
-                leave_room(id_sala)
-                emit('usuario_saiu', {
-                     'nome_usuario': nome_usuario}, room=id_sala)
+            id_sala, nome_usuario, saiu = sessao
+            leave_room(id_sala)
+            if saiu:
+                notificar_saida(id_sala, nome_usuario)
 
-                timestamp = time.strftime("%H:%M:%S")
-                print(f"[{timestamp}] User Leave: {nome_usuario} <- Room {id_sala}")
+            log.info("User Leave: %s <- Room %s", nome_usuario, id_sala)
 
         except Exception as e:
-            print(f"[ERROR] Saída da sala: {e}")
+            log.error("Saída da sala: %s", e)
 
-    @socketio.on('mensagem_chat')
+    @evento_socketio(socketio, 'mensagem_chat')
     def manipular_mensagem(dados):
         """Processa e distribui mensagens de chat"""
         try:
@@ -114,9 +213,7 @@ def registrar_eventos_socketio(socketio):
             nome_usuario = dados.get('nome_usuario')
             mensagem = dados.get('mensagem', '').strip()
 
-            timestamp = time.strftime("%H:%M:%S")
-            print(
-                f"[{timestamp}] Chat Message: {nome_usuario} in {id_sala} ({len(mensagem)} chars)")
+            log_mensagens.info("Chat Message: %s in %s (%s chars)", nome_usuario, id_sala, len(mensagem))
 
             if not id_sala or not nome_usuario or not mensagem:
                 emit('erro', {'mensagem': 'Dados incompletos'})
@@ -141,16 +238,17 @@ def registrar_eventos_socketio(socketio):
                 id_sala, nome_usuario, mensagem)
 
             if mensagem_obj:
-                emit('mensagem_chat', mensagem_obj, room=id_sala)
-                print(f"  Message saved: ID {mensagem_obj['id'][:8]}")
+                transmitir_para_sala('mensagem_chat', mensagem_obj, id_sala)
+                MENSAGENS.incrementar()
+                log_mensagens.debug("Message saved: ID %s", mensagem_obj['id'][:8])
             else:
                 emit('erro', {'mensagem': 'Erro ao salvar mensagem'})
 
         except Exception as e:
-            print(f"[ERROR] Mensagem chat: {e}")
+            log.error("Mensagem chat: %s", e)
             emit('erro', {'mensagem': 'Erro ao enviar mensagem'})
 
-    @socketio.on('deletar_mensagem')
+    @evento_socketio(socketio, 'deletar_mensagem')
     def manipular_deletar_mensagem(dados):
         """Processa deleção de mensagem via WebSocket"""
         try:
@@ -158,9 +256,7 @@ def registrar_eventos_socketio(socketio):
             id_mensagem = dados.get('id_mensagem')
             nome_usuario = dados.get('nome_usuario')
 
-            timestamp = time.strftime("%H:%M:%S")
-            print(
-                f"[{timestamp}] Delete Message: {nome_usuario} deleting {id_mensagem[:8]} in {id_sala}")
+            log.info("Delete Message: %s deleting %s in %s", nome_usuario, id_mensagem[:8], id_sala)
 
             if not all([id_sala, id_mensagem, nome_usuario]):
                 emit('erro', {'mensagem': 'Dados incompletos'})
@@ -176,21 +272,21 @@ def registrar_eventos_socketio(socketio):
                 id_sala, id_mensagem, nome_usuario)
 
             if sucesso:
-                emit('mensagem_removida', {
+                transmitir_para_sala('mensagem_removida', {
                     'id_mensagem': id_mensagem,
                     'nome_usuario': nome_usuario
-                }, room=id_sala)
-                print(f"  Delete success: Message {id_mensagem[:8]}")
+                }, id_sala)
+                log.debug("Delete success: Message %s", id_mensagem[:8])
             else:
                 emit(
                     'erro', {'mensagem': 'Não foi possível remover a mensagem'})
-                print(f"  Delete failed: Permission denied or not found")
+                log.debug("Delete failed: Permission denied or not found")
 
         except Exception as e:
-            print(f"[ERROR] Deletar mensagem: {e}")
+            log.error("Deletar mensagem: %s", e)
             emit('erro', {'mensagem': 'Erro ao deletar mensagem'})
 
-    @socketio.on('arquivo_compartilhado')
+    @evento_socketio(socketio, 'arquivo_compartilhado')
     def manipular_arquivo_compartilhado(dados):
         """Notifica usuários sobre novo arquivo compartilhado"""
         try:
@@ -200,9 +296,7 @@ def registrar_eventos_socketio(socketio):
             tipo_arquivo = dados.get('tipo_arquivo')
             id_mensagem = dados.get('id')
 
-            timestamp = time.strftime("%H:%M:%S")
-            print(
-                f"[{timestamp}] File Share: {nome_usuario} shared {nome_arquivo} ({tipo_arquivo}) in {id_sala}")
+            log.info("File Share: %s shared %s (%s) in %s", nome_usuario, nome_arquivo, tipo_arquivo, id_sala)
 
             if not all([id_sala, nome_usuario, nome_arquivo, tipo_arquivo]):
                 emit('erro', {'mensagem': 'Dados incompletos'})
@@ -223,10 +317,14 @@ def registrar_eventos_socketio(socketio):
                 'tipo_arquivo': tipo_arquivo,
                 'horario': horario
             }
+            # Prévia gerada em segundo plano a partir do registro do upload
+            mensagem = sala.mensagens.obter(id_mensagem) if id_mensagem else None
+            if mensagem and mensagem.get('url_previa'):
+                dados_arquivo['url_previa'] = mensagem['url_previa']
 
-            emit('arquivo_compartilhado', dados_arquivo, room=id_sala)
-            print(f"  File notification sent to {len(sala.usuarios)} users")
+            transmitir_para_sala('arquivo_compartilhado', dados_arquivo, id_sala)
+            log.debug("File notification sent to %s users", len(sala.usuarios))
 
         except Exception as e:
-            print(f"[ERROR] Arquivo compartilhado: {e}")
+            log.error("Arquivo compartilhado: %s", e)
             emit('erro', {'mensagem': 'Erro ao compartilhar arquivo'})
@@ -0,0 +1,24 @@
+"""Isola os testes do banco e dos uploads do projeto.
+
+Importar qualquer módulo de `models` cria o gerenciador global com
+db.sqlite3 no diretório atual, então o diretório de trabalho e as pastas
+de upload apontam para um diretório temporário antes da coleta.
+"""
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_TEMPORARIO = tempfile.mkdtemp(prefix='webtalk-testes-')
+
+os.environ.setdefault('UPLOAD_BLOB_FOLDER', os.path.join(_TEMPORARIO, 'blobs'))
+os.environ.setdefault('PREVIEW_FOLDER', os.path.join(_TEMPORARIO, 'previas'))
+os.chdir(_TEMPORARIO)
+sys.path.insert(0, RAIZ)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # A thread de logs escreve no stderr capturado pelo pytest, fechado antes
+    # dos atexit que ainda registram o encerramento do gerenciador
+    import logs
+    logs.parar_logs()
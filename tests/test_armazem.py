@@ -0,0 +1,81 @@
+import errno
+import os
+import sqlite3
+
+import pytest
+
+from models.armazem import ArmazemArquivos
+
+SHA256 = 'ab' + '0' * 62
+
+
+@pytest.fixture
+def banco(tmp_path):
+    caminho = str(tmp_path / 'armazem.db')
+    with sqlite3.connect(caminho) as conexao:
+        conexao.execute('PRAGMA journal_mode=WAL')
+        conexao.execute('''CREATE TABLE arquivos (sha256 TEXT PRIMARY KEY,
+                           tamanho INTEGER NOT NULL, referencias INTEGER NOT NULL DEFAULT 0)''')
+    conexoes = []
+
+    def conectar():
+        conexoes.append(sqlite3.connect(caminho, timeout=5))
+        return conexoes[-1]
+
+    yield conectar
+    for conexao in conexoes:
+        conexao.close()
+
+
+def _origem(tmp_path, nome, conteudo=b'conteudo'):
+    caminho = tmp_path / nome
+    caminho.write_bytes(conteudo)
+    return str(caminho)
+
+
+def test_remocao_confere_referencias_de_outro_processo(tmp_path, banco):
+    armazem = ArmazemArquivos(str(tmp_path / 'blobs'))
+    processo_a, processo_b = banco(), banco()
+
+    armazem.referenciar(processo_a.cursor(), SHA256, 8, _origem(tmp_path, 'a'))
+    processo_a.commit()
+    assert armazem.liberar(processo_a.cursor(), SHA256)
+    processo_a.commit()
+
+    # Outro processo referencia o conteúdo entre o commit e a remoção do arquivo
+    caminho, _ = armazem.referenciar(processo_b.cursor(), SHA256, 8, _origem(tmp_path, 'b'))
+    processo_b.commit()
+
+    assert not armazem.remover(processo_a, SHA256)
+    assert os.path.exists(caminho)
+    assert not processo_a.in_transaction
+
+
+def test_remocao_apaga_conteudo_sem_referencias(tmp_path, banco):
+    armazem = ArmazemArquivos(str(tmp_path / 'blobs'))
+    conexao = banco()
+    caminho, _ = armazem.referenciar(conexao.cursor(), SHA256, 8, _origem(tmp_path, 'a'))
+    assert armazem.liberar(conexao.cursor(), SHA256)
+    conexao.commit()
+
+    assert armazem.remover(conexao, SHA256)
+    assert not os.path.exists(caminho)
+
+
+def test_referenciar_entre_sistemas_de_arquivos(tmp_path, banco, monkeypatch):
+    armazem = ArmazemArquivos(str(tmp_path / 'blobs'))
+    origem = _origem(tmp_path, 'a')
+    renomear = os.replace
+
+    def replace(de, para):
+        if de == origem:
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        renomear(de, para)
+
+    monkeypatch.setattr(os, 'replace', replace)
+    caminho, novo = armazem.referenciar(banco().cursor(), SHA256, 8, origem)
+
+    assert novo and not os.path.exists(origem)
+    with open(caminho, 'rb') as arquivo:
+        assert arquivo.read() == b'conteudo'
+    assert os.listdir(os.path.dirname(caminho)) == [SHA256]
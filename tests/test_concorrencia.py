@@ -0,0 +1,26 @@
+import threading
+import time
+
+from models.concorrencia import TarefaPeriodica
+
+
+def test_tarefa_periodica_segue_apos_falhas_e_para():
+    execucoes = []
+    terceira = threading.Event()
+
+    def funcao():
+        execucoes.append(1)
+        if len(execucoes) == 3:
+            terceira.set()
+        raise RuntimeError('falha a cada execução')
+
+    tarefa = TarefaPeriodica(funcao, 0.01, 'teste-periodica')
+    tarefa.iniciar()
+    tarefa.iniciar()  # Já rodando: não cria outra thread
+    assert terceira.wait(5)
+    tarefa.parar()
+
+    total = len(execucoes)
+    assert not any(thread.name == 'teste-periodica' for thread in threading.enumerate())
+    time.sleep(0.05)
+    assert len(execucoes) == total
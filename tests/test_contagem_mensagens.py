@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from config import Config
+from models.room import GerenciadorSalas
+
+
+@pytest.fixture
+def criar_gerenciador(tmp_path, monkeypatch):
+    gerenciadores = []
+
+    def criar(write_behind=False, sob_demanda=True):
+        monkeypatch.setattr(Config, 'DB_WRITE_BEHIND', write_behind)
+        monkeypatch.setattr(Config, 'ROOM_LAZY_LOADING', sob_demanda)
+        gerenciador = GerenciadorSalas(str(tmp_path / 'salas.db'))
+        gerenciadores.append(gerenciador)
+        return gerenciador
+
+    yield criar
+    for gerenciador in gerenciadores:
+        gerenciador.fechar()
+
+
+def _totais(gerenciador):
+    return {sala.id: sala.para_dicionario()['contador_mensagens']
+            for sala in gerenciador.obter_todas_salas()}
+
+
+def test_migracao_preenche_total_de_bancos_antigos(tmp_path, criar_gerenciador):
+    with sqlite3.connect(tmp_path / 'salas.db') as conexao:
+        conexao.execute('''CREATE TABLE salas (id TEXT PRIMARY KEY, nome TEXT NOT NULL,
+                           criador TEXT NOT NULL, senha TEXT, criado_em TEXT NOT NULL,
+                           esta_ativa INTEGER DEFAULT 1)''')
+        conexao.execute('''CREATE TABLE mensagens (id TEXT PRIMARY KEY, id_sala TEXT NOT NULL,
+                           nome_usuario TEXT NOT NULL, conteudo TEXT NOT NULL,
+                           tipo TEXT DEFAULT 'texto', horario TEXT NOT NULL)''')
+        for id_sala, quantidade in (('a', 3), ('b', 0)):
+            conexao.execute("INSERT INTO salas VALUES (?, ?, 'x', NULL, '2024-01-01', 1)",
+                            (id_sala, id_sala))
+            conexao.executemany(
+                "INSERT INTO mensagens (id, id_sala, nome_usuario, conteudo, horario) "
+                "VALUES (?, ?, 'x', 'oi', '12:00:00')",
+                [(f'{id_sala}{indice}', id_sala) for indice in range(quantidade)])
+
+    assert _totais(criar_gerenciador()) == {'a': 3, 'b': 0}
+
+
+@pytest.mark.parametrize('write_behind', [False, True], ids=['direto', 'write_behind'])
+def test_total_acompanha_gravacoes_e_exclusao(criar_gerenciador, write_behind):
+    gerenciador = criar_gerenciador(write_behind)
+    sala = gerenciador.criar_sala('contagem', 'teste')
+    outra = gerenciador.criar_sala('outra', 'teste')
+    for indice in range(7):
+        assert gerenciador.adicionar_mensagem_na_sala(sala.id, 'teste', f'm{indice}')
+    if gerenciador.fila_escrita:
+        assert gerenciador.fila_escrita.descarregar()
+
+    # Fora da memória, o total vem da coluna mantida pelos triggers
+    gerenciador.salas.pop(sala.id)
+    assert _totais(gerenciador) == {sala.id: 7, outra.id: 0}
+
+    assert gerenciador.obter_sala(sala.id).para_dicionario()['contador_mensagens'] == 7
+    assert gerenciador.excluir_sala(sala.id)
+    with gerenciador.pool.conexao() as conexao:
+        linhas = conexao.execute('SELECT id, total_mensagens FROM salas').fetchall()
+    assert [tuple(linha) for linha in linhas] == [(outra.id, 0)]
+
+
+def test_sala_expirada_mantem_total_e_recarrega_historico(criar_gerenciador, monkeypatch):
+    # Com todas as salas em memória, a expiração libera só o histórico da sala
+    monkeypatch.setattr(Config, 'MAX_MESSAGES_PER_ROOM', 3)
+    gerenciador = criar_gerenciador(sob_demanda=False)
+    sala = gerenciador.criar_sala('expirada', 'teste')
+    enviadas = [gerenciador.adicionar_mensagem_na_sala(sala.id, 'teste', f'm{indice}')['id']
+                for indice in range(5)]
+
+    assert gerenciador.limpar_salas_expiradas(timeout_horas=0) == 1
+    assert len(sala.mensagens) == 0
+    assert _totais(gerenciador) == {sala.id: 5}
+
+    # O próximo acesso traz de volta a janela recente, com a capacidade original
+    assert gerenciador.obter_sala(sala.id) is sala
+    assert [mensagem['id'] for mensagem in sala.mensagens] == enviadas[-3:]
+    assert _totais(gerenciador) == {sala.id: 5}
@@ -0,0 +1,37 @@
+import io
+
+from PIL import Image
+
+
+def _png(cor):
+    saida = io.BytesIO()
+    Image.new('RGB', (4, 4), cor).save(saida, 'PNG')
+    return saida.getvalue()
+
+
+def test_cache_imutavel_so_na_url_por_id():
+    from app import app
+
+    cliente = app.test_client()
+    id_sala = cliente.post('/api/salas', json={'nome': 'cache', 'criador': 'teste'}).json['id_sala']
+
+    def enviar(conteudo):
+        resposta = cliente.post(f'/api/salas/{id_sala}/upload', data={
+            'nome_usuario': 'teste', 'arquivo': (io.BytesIO(conteudo), 'foto.png')})
+        assert resposta.status_code == 200, resposta.json
+        return resposta.json['id_mensagem']
+
+    enviar(_png('red'))
+    id_recente = enviar(_png('blue'))
+
+    por_id = cliente.get(f'/api/salas/{id_sala}/arquivos/{id_recente}')
+    assert 'immutable' in por_id.headers['Cache-Control']
+
+    # O nome passa a apontar para o upload mais recente: o cache revalida a ETag
+    por_nome = cliente.get(f'/api/salas/{id_sala}/download/foto.png')
+    assert por_nome.headers['Cache-Control'] == 'public, no-cache'
+    assert por_nome.get_data() == _png('blue')
+    assert por_nome.headers['ETag'] == f'"{id_recente}"'
+    revalidada = cliente.get(f'/api/salas/{id_sala}/download/foto.png',
+                             headers={'If-None-Match': por_nome.headers['ETag']})
+    assert revalidada.status_code == 304
@@ -0,0 +1,26 @@
+import threading
+import time
+
+from models.estatisticas import EstatisticasSistema
+
+
+def test_deltas_chegam_na_ordem_das_versoes():
+    estatisticas = EstatisticasSistema()
+    versoes = []
+
+    def assinante(evento, dados):
+        time.sleep(0)  # Cede a vez no meio da entrega
+        versoes.append(dados['versao'])
+        estatisticas.obter()  # Ler os contadores dentro do callback não trava
+
+    estatisticas.assinar(assinante)
+    threads = [threading.Thread(target=lambda: [estatisticas.ajustar(usuarios_online=1)
+                                                for _ in range(200)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert versoes == list(range(1, 1601))
+    assert estatisticas.obter()['usuarios_online'] == 1600
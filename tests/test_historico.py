@@ -0,0 +1,72 @@
+import pytest
+
+from config import Config
+from models.historico import codificar_cursor, decodificar_cursor, cursor_da_pagina
+from models.room import GerenciadorSalas
+
+
+@pytest.mark.parametrize('seq', [1, 42, 1718000000123456])
+def test_cursor_ida_e_volta(seq):
+    cursor = codificar_cursor(seq, 'a1:b2')
+    assert str(seq) not in cursor
+    assert decodificar_cursor(cursor) == (seq, 'a1:b2')
+
+
+@pytest.mark.parametrize('cursor', ['', '!!', '42', codificar_cursor('-1', 'x'),
+                                    codificar_cursor('0', 'x'), codificar_cursor('abc', 'x'),
+                                    codificar_cursor(5, ''), 42, None])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ValueError):
+        decodificar_cursor(cursor)
+
+
+def test_cursor_da_pagina_usa_a_mensagem_mais_antiga():
+    assert cursor_da_pagina([]) is None
+    assert decodificar_cursor(cursor_da_pagina([{'seq': 5, 'id': 'a'}, {'seq': 9, 'id': 'b'}])) == (5, 'a')
+
+
+@pytest.mark.parametrize('capacidade', [3, 100], ids=['banco', 'memoria'])
+def test_paginacao_nao_pula_seq_repetido(tmp_path, monkeypatch, capacidade):
+    # Workers diferentes podem gerar o mesmo seq; páginas pela chave (seq, id)
+    monkeypatch.setattr(Config, 'DB_WRITE_BEHIND', False)
+    monkeypatch.setattr(Config, 'MAX_MESSAGES_PER_ROOM', capacidade)
+    gerenciador = GerenciadorSalas(str(tmp_path / 'empates.db'))
+    try:
+        monkeypatch.setattr(gerenciador, '_proximo_seq', lambda: 1000)
+        id_sala = gerenciador.criar_sala('empates', 'teste').id
+        enviadas = {gerenciador.adicionar_mensagem_na_sala(id_sala, 'teste', f'm{indice}')['id']
+                    for indice in range(10)}
+
+        recebidas, antes = [], None
+        while True:
+            pagina, tem_mais = gerenciador.obter_pagina_historico(id_sala, antes, 4)
+            recebidas = [mensagem['id'] for mensagem in pagina] + recebidas
+            if not tem_mais:
+                break
+            antes = decodificar_cursor(cursor_da_pagina(pagina))
+        assert len(recebidas) == len(enviadas) and set(recebidas) == enviadas
+    finally:
+        gerenciador.fechar()
+
+
+def test_paginacao_rest_percorre_o_historico_pelo_cursor():
+    from app import app
+    from models.room import gerenciador_salas
+
+    cliente = app.test_client()
+    id_sala = cliente.post('/api/salas', json={'nome': 'cursor', 'criador': 'teste'}).json['id_sala']
+    enviadas = [gerenciador_salas.adicionar_mensagem_na_sala(id_sala, 'teste', f'm{indice}')['id']
+                for indice in range(25)]
+
+    recebidas, cursor = [], None
+    while True:
+        parametros = {'limite': 10, **({'antes': cursor} if cursor else {})}
+        pagina = cliente.get(f'/api/salas/{id_sala}/mensagens', query_string=parametros).json
+        recebidas = [mensagem['id'] for mensagem in pagina['mensagens']] + recebidas
+        cursor = pagina['cursor']
+        if not pagina['tem_mais']:
+            break
+
+    assert recebidas == enviadas
+    resposta = cliente.get(f'/api/salas/{id_sala}/mensagens', query_string={'antes': '42'})
+    assert resposta.status_code == 400
@@ -0,0 +1,73 @@
+import logging
+import queue
+
+import pytest
+
+import logs
+from config import Config
+
+
+class Coletor(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.registros = []
+
+    def emit(self, record):
+        self.registros.append(record)
+
+
+@pytest.fixture
+def configurar():
+    yield logs.configurar_logs
+    Config.configurar_logs()  # Volta à configuração da aplicação
+
+
+def test_configuracao_nao_altera_globais_do_logging(configurar):
+    origem, threads, processos = logging._srcfile, logging.logThreads, logging.logProcesses
+    configurar(amostragem='teste.globais=2')
+    assert (logging._srcfile, logging.logThreads, logging.logProcesses) == (origem, threads, processos)
+
+
+def test_origem_so_e_omitida_nos_loggers_webtalk():
+    coletor = Coletor()
+    for logger in (logs.obter_logger('webtalk.teste.origem'),
+                   logging.getLogger('biblioteca.teste.origem')):
+        logger.addHandler(coletor)
+        logger.propagate = False
+        logger.warning('origem')
+
+    proprio, externo = coletor.registros
+    assert proprio.lineno == 0
+    assert externo.pathname == __file__ and externo.lineno > 0
+
+
+def test_loggers_de_outras_bibliotecas_continuam_padrao():
+    assert isinstance(logs.obter_logger('teste.classe'), logs.LoggerWebtalk)
+    assert type(logging.getLogger('biblioteca.teste.classe')) is logging.Logger
+    assert logging.getLoggerClass() is logging.Logger
+
+
+def test_fila_usa_a_trava_padrao_do_handler():
+    handler = logs.FilaNaoBloqueante(queue.Queue())
+    assert handler.lock is not None
+    with handler.lock:  # Handler.handle usa `with self.lock` a partir do Python 3.13
+        pass
+
+
+def test_amostragem_emite_um_a_cada_n(configurar):
+    logger = logs.obter_logger('webtalk.teste.amostrado')
+    coletor = Coletor()
+    logger.addHandler(coletor)
+    logger.propagate = False
+
+    configurar(amostragem='teste.amostrado=3')
+    for indice in range(9):
+        logger.warning('registro %s', indice)
+    assert [registro.args[0] for registro in coletor.registros] == [0, 3, 6]
+    assert coletor.registros[0].amostragem == 3
+
+    configurar()  # Sem amostragem na nova configuração: tudo passa
+    coletor.registros.clear()
+    for indice in range(3):
+        logger.warning('registro %s', indice)
+    assert len(coletor.registros) == 3
@@ -0,0 +1,34 @@
+from config import Config
+from models.banco import PoolConexoes
+from models.metricas import DURACAO_BANCO
+
+
+def test_metrics_desativado_sem_token(monkeypatch):
+    from app import app
+    monkeypatch.setattr(Config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(Config, 'METRICS_TOKEN', '')
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_metrics_exige_token(monkeypatch):
+    from app import app
+    monkeypatch.setattr(Config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(Config, 'METRICS_TOKEN', 'segredo')
+    cliente = app.test_client()
+    assert cliente.get('/metrics').status_code == 401
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer outro'}).status_code == 401
+    resposta = cliente.get('/metrics', headers={'Authorization': 'Bearer segredo'})
+    assert resposta.status_code == 200
+    texto = resposta.get_data(as_text=True)
+    assert 'webtalk_banco_duracao_segundos' in texto
+    assert 'webtalk_fila_escrita_pendentes ' in texto
+    assert 'webtalk_logs_descartados ' in texto
+
+
+def test_tempo_de_banco_rotulado_pela_operacao(tmp_path):
+    pool = PoolConexoes(str(tmp_path / 'metricas.db'))
+    with pool.conexao('operacao_de_teste') as conexao:
+        conexao.execute('SELECT 1')
+    pool.fechar()
+    serie = DURACAO_BANCO.valores()[('operacao_de_teste',)]
+    assert sum(serie[:-1]) == 1  # Contagens por faixa; a última posição é a soma
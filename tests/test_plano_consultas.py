@@ -0,0 +1,44 @@
+import pytest
+
+from models.room import (GerenciadorSalas, SQL_ATIVIDADE_RECENTE,
+                         SQL_MENSAGENS_ANTERIORES, SQL_MENSAGENS_RECENTES)
+
+CONSULTAS = [
+    ('pagina_recente', SQL_MENSAGENS_RECENTES, ('sala-1', 21), 'idx_mensagens_sala_seq_id'),
+    ('pagina_anterior', SQL_MENSAGENS_ANTERIORES, ('sala-1', 500, 'm500', 21),
+     'idx_mensagens_sala_seq_id'),
+    ('atividade_recente', SQL_ATIVIDADE_RECENTE, (10,), 'idx_mensagens_seq'),
+]
+
+
+@pytest.fixture(scope='module')
+def gerenciador(tmp_path_factory):
+    # O schema e os índices vêm da própria migração do gerenciador
+    gerenciador = GerenciadorSalas(str(tmp_path_factory.mktemp('plano') / 'plano.db'))
+    with gerenciador.pool.conexao() as conexao:
+        for indice in range(20):
+            conexao.execute(
+                'INSERT INTO salas (id, nome, criador, criado_em) VALUES (?, ?, ?, ?)',
+                (f'sala-{indice}', f'Sala {indice}', 'teste', '2024-01-01T00:00:00'))
+        conexao.executemany(
+            'INSERT INTO mensagens (id, id_sala, nome_usuario, conteudo, tipo, horario, seq) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(f'm{seq}', f'sala-{seq % 20}', 'teste', 'oi', 'texto', '12:00:00', seq)
+             for seq in range(1, 2001)])
+        conexao.commit()
+    yield gerenciador
+    gerenciador.fechar()
+
+
+@pytest.mark.parametrize('analisar', [False, True], ids=['sem_estatisticas', 'com_analyze'])
+@pytest.mark.parametrize('nome, sql, parametros, indice', CONSULTAS, ids=[c[0] for c in CONSULTAS])
+def test_consulta_usa_indice_sem_scan_nem_ordenacao(gerenciador, analisar, nome, sql, parametros, indice):
+    with gerenciador.pool.conexao() as conexao:
+        if analisar:
+            conexao.execute('ANALYZE')
+        plano = [linha[3] for linha in conexao.execute('EXPLAIN QUERY PLAN ' + sql, parametros)]
+
+    assert any(indice in passo for passo in plano), plano
+    # Percorrer um índice em ordem (SCAN ... USING INDEX) para no LIMIT; varrer a tabela não
+    assert not any(passo.startswith('SCAN') and 'USING' not in passo for passo in plano), plano
+    assert not any('USE TEMP B-TREE' in passo for passo in plano), plano
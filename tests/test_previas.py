@@ -0,0 +1,37 @@
+from PIL import Image
+
+from models.previas import GeradorPrevias
+
+
+def _imagem(tmp_path, nome, tamanho):
+    caminho = tmp_path / nome
+    Image.new('1', tamanho).save(caminho, 'PNG')  # Poucos bytes, muitos pixels
+    return str(caminho)
+
+
+def _mensagem(tmp_path, indice, tamanho=(100, 100)):
+    return {'id': f'm{indice}', 'tipo_arquivo': 'png',
+            'caminho_arquivo': _imagem(tmp_path, f'{indice}.png', tamanho)}
+
+
+def test_imagem_acima_do_limite_de_pixels_nao_e_decodificada(tmp_path):
+    gerador = GeradorPrevias(str(tmp_path / 'previas'), trabalhadores=1, maximo_pixels=200 * 200)
+    gerador.iniciar()
+    try:
+        assert gerador.obter(_mensagem(tmp_path, 1), timeout=5)
+        assert gerador.obter(_mensagem(tmp_path, 2, (4000, 4000)), timeout=5) is None
+        assert gerador.estatisticas()['falhas'] == 1
+    finally:
+        gerador.parar()
+
+
+def test_falhas_lembradas_sao_limitadas(tmp_path):
+    gerador = GeradorPrevias(str(tmp_path / 'previas'), trabalhadores=1,
+                             maximo_pixels=1, maximo_falhas=2)
+    gerador.iniciar()
+    try:
+        for indice in range(5):
+            assert gerador.obter(_mensagem(tmp_path, indice), timeout=5) is None
+        assert list(gerador._falhas) == ['mm3', 'mm4']
+    finally:
+        gerador.parar()
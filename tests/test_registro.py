@@ -0,0 +1,97 @@
+import sys
+import threading
+
+import pytest
+
+from models.registro import RegistroSalas
+
+THREADS = 8
+OPERACOES = 3000
+
+
+@pytest.fixture(autouse=True)
+def trocas_frequentes():
+    # Trocar de thread com frequência para intercalar leitores e escritores
+    intervalo = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(intervalo)
+
+
+def _rodar(alvos):
+    erros = []
+    inicio = threading.Barrier(len(alvos))
+
+    def executar(alvo):
+        inicio.wait()
+        try:
+            alvo()
+        except Exception as e:  # pragma: no cover - só em falha
+            erros.append(e)
+
+    threads = [threading.Thread(target=executar, args=(alvo,)) for alvo in alvos]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not erros, erros
+
+
+def test_inserir_se_ausente_concorrente_registra_um_unico_objeto():
+    registro = RegistroSalas(fragmentos=4)
+    vencedores = [[] for _ in range(THREADS)]
+
+    def inserir(indice):
+        def alvo():
+            for numero in range(OPERACOES):
+                vencedores[indice].append(
+                    registro.inserir_se_ausente(f'sala-{numero}', object()))
+        return alvo
+
+    _rodar([inserir(indice) for indice in range(THREADS)])
+
+    assert len(registro) == OPERACOES
+    for numero in range(OPERACOES):
+        # Todas as threads receberam o mesmo objeto, o que ficou no registro
+        assert {id(lista[numero]) for lista in vencedores} == {id(registro.get(f'sala-{numero}'))}
+
+
+def test_escritas_e_iteracao_concorrentes_mantem_o_registro_consistente():
+    registro = RegistroSalas(fragmentos=4)
+    terminaram = threading.Event()
+    restantes = [THREADS]
+    trava = threading.Lock()
+
+    def escritor(indice):
+        def alvo():
+            try:
+                for numero in range(OPERACOES):
+                    id_sala = f'{indice}-{numero}'
+                    sala = object()
+                    assert registro.inserir_se_ausente(id_sala, sala) is sala
+                    assert registro.get(id_sala) is sala
+                    if numero % 2:
+                        assert registro.pop(id_sala, esperada=object()) is None
+                        assert registro.pop(id_sala, esperada=sala) is sala
+                        assert id_sala not in registro
+            finally:
+                with trava:
+                    restantes[0] -= 1
+                    if not restantes[0]:
+                        terminaram.set()
+        return alvo
+
+    def leitor():
+        # Iterar enquanto os fragmentos mudam de tamanho não pode falhar
+        while not terminaram.is_set():
+            itens = registro.items()
+            assert len({id_sala for id_sala, _ in itens}) == len(itens)
+            for id_sala in registro:
+                registro.get(id_sala)
+
+    _rodar([escritor(indice) for indice in range(THREADS)] + [leitor, leitor])
+
+    esperado = {f'{indice}-{numero}' for indice in range(THREADS)
+                for numero in range(0, OPERACOES, 2)}
+    assert set(registro) == esperado
+    assert len(registro) == len(esperado)
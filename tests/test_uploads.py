@@ -0,0 +1,94 @@
+import io
+
+import pytest
+
+import models.uploads as uploads
+from models.uploads import GerenciadorUploads, LimiteUploadsError, UploadEncerradoError
+
+PDF = b'%PDF-1.4\n' + b'x' * 200
+
+
+def _leitor(dados):
+    return io.BytesIO(dados).read
+
+
+def test_retomada_apos_falha_na_escrita_nao_repete_o_cabecalho(tmp_path, monkeypatch):
+    gerenciador = GerenciadorUploads(str(tmp_path), tamanho_leitura=4)
+    sessao = gerenciador.iniciar('sala', 'teste', 'a.pdf', 'pdf', len(PDF))
+
+    # A primeira escrita falha: nada gravado, offset e cabeçalho intactos
+    def falhar(funcao, *args):
+        raise OSError('disco cheio')
+
+    with monkeypatch.context() as contexto:
+        contexto.setattr(uploads, 'executar_bloqueante', falhar)
+        with pytest.raises(OSError):
+            gerenciador.anexar(sessao, 0, _leitor(PDF))
+    assert (sessao.offset, sessao.cabecalho) == (0, b'')
+
+    assert gerenciador.anexar(sessao, 0, _leitor(PDF)) == len(PDF)
+    assert sessao.cabecalho == PDF[:16]
+    gerenciador.finalizar(sessao)
+    assert open(sessao.caminho, 'rb').read() == PDF
+
+
+def test_limite_de_sessoes_por_cliente_e_por_sala(tmp_path):
+    gerenciador = GerenciadorUploads(str(tmp_path), maximo_por_cliente=2, maximo_por_sala=3)
+    primeira = gerenciador.iniciar('sala', 'a', 'a.pdf', 'pdf', 10, '10.0.0.1')
+    gerenciador.iniciar('sala', 'a', 'b.pdf', 'pdf', 10, '10.0.0.1')
+    with pytest.raises(LimiteUploadsError):
+        gerenciador.iniciar('outra', 'a', 'c.pdf', 'pdf', 10, '10.0.0.1')
+
+    gerenciador.iniciar('sala', 'b', 'd.pdf', 'pdf', 10, '10.0.0.2')
+    with pytest.raises(LimiteUploadsError):
+        gerenciador.iniciar('sala', 'c', 'e.pdf', 'pdf', 10, '10.0.0.3')
+
+    # Cancelar libera a vaga do cliente e da sala
+    gerenciador.cancelar(primeira)
+    gerenciador.iniciar('sala', 'a', 'f.pdf', 'pdf', 10, '10.0.0.1')
+
+
+def test_finalizar_so_libera_a_sessao_uma_vez(tmp_path):
+    gerenciador = GerenciadorUploads(str(tmp_path))
+    sessao = gerenciador.iniciar('sala', 'teste', 'a.pdf', 'pdf', len(PDF))
+    gerenciador.anexar(sessao, 0, _leitor(PDF))
+    assert gerenciador.finalizar(sessao)
+    with pytest.raises(UploadEncerradoError):
+        gerenciador.finalizar(sessao)
+
+
+def _upload_completo(cliente, id_sala):
+    id_upload = cliente.post(f'/api/salas/{id_sala}/uploads', json={
+        'nome_usuario': 'teste', 'nome_arquivo': 'a.pdf', 'tamanho': len(PDF)}).json['id_upload']
+    resposta = cliente.put(f'/api/salas/{id_sala}/uploads/{id_upload}?offset=0', data=PDF)
+    assert resposta.json['offset'] == len(PDF)
+    return f'/api/salas/{id_sala}/uploads/{id_upload}/concluir'
+
+
+def test_concluir_repetido_registra_o_arquivo_uma_vez():
+    from app import app
+    from models.room import gerenciador_salas
+
+    cliente = app.test_client()
+    id_sala = cliente.post('/api/salas', json={'nome': 'concluir', 'criador': 'teste'}).json['id_sala']
+    concluir = _upload_completo(cliente, id_sala)
+
+    assert cliente.post(concluir).status_code == 200
+    # Chamadas simultâneas disputam finalizar() (ver teste acima); depois, a sessão não existe mais
+    assert cliente.post(concluir).status_code == 404
+    arquivos = [m for m in gerenciador_salas.obter_sala(id_sala).mensagens if m['tipo'] == 'arquivo']
+    assert len(arquivos) == 1
+
+
+def test_concluir_em_sala_inativa_descarta_o_upload():
+    from app import app
+    from models.room import gerenciador_salas
+
+    cliente = app.test_client()
+    id_sala = cliente.post('/api/salas', json={'nome': 'expirada', 'criador': 'teste'}).json['id_sala']
+    concluir = _upload_completo(cliente, id_sala)
+
+    gerenciador_salas.obter_sala(id_sala).esta_ativa = False  # Expirou durante o envio
+    assert cliente.post(concluir).status_code == 403
+    assert not any(m.get('tipo') == 'arquivo' for m in gerenciador_salas.obter_sala(id_sala).mensagens)
+    assert cliente.post(concluir).status_code == 404